@@ -1,143 +1,133 @@
-from server.playerHandler import PlayerHandler
+from server.app import GameApp, Response
+from server.capture import CaptureWriter
+from server.chatStore import DEFAULT_CAPACITY
+from server.collision import MAPS_DIR
+from server.pushServer import PushServer
+from server.rateLimiter import DEFAULT_LIMITS, parse_limit
+from server.shardRouter import SHARD_BASE_PORT, ShardRouter, load_maps
+from server.udpServer import UdpServer
 
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-from urllib.parse import urlparse, parse_qs
-import json
-import threading
-import time
+import argparse
+import asyncio
+import signal
+import sys
 
 PORT = 8989
+PUSH_PORT = 8990
+UDP_PORT = 8991
 
-PLAYER_HANDLER = PlayerHandler()
-PLAYER_HANDLER.start()
+APP: GameApp | ShardRouter  # created in __main__ from the command line options
 
-# Simple in-memory chat log
-CHAT_LOCK = threading.Lock()
-CHAT_LOG: list[dict] = []
-NEXT_CHAT_ID = 0
-    
 class Handler(BaseHTTPRequestHandler):
     # def log_message(self, fmt, *args):
     #     return
 
     def do_GET(self):
-        if self.path == "/":
-            self._json(200, {"status": "ok"})
-            return
-            
-        if self.path == "/register":
-            pid = PLAYER_HANDLER.register()
-            self._json(200, {"message": "registration successful", "id": pid})
-            return
-
-        if self.path == "/players":
-            self._json(200, {"players": PLAYER_HANDLER.list_players()})
-            return
-
-        if self.path.startswith("/chat"):
-            self._handle_get_chat()
-            return
-
-        self._json(404, {"error": "not_found"})
+        self._respond(APP.handle("GET", self.path, b"", self._headers()))
 
     def do_POST(self):
-        if self.path == "/chat":
-            self._handle_post_chat()
-            return
-
-        if self.path != "/players":
-            self._json(404, {"error": "not_found"})
-            return
-
         length = int(self.headers.get("Content-Length", "0"))
-        try:
-            body = self.rfile.read(length)
-            data = json.loads(body.decode("utf-8"))
-        except Exception:
-            self._json(400, {"error": "invalid_json"})
-            return
-
-        missing = [k for k in ("id", "x", "y", "map") if k not in data]
-        if missing:
-            self._json(400, {"error": "bad_fields", "missing": missing})
-            return
-
-        try:
-            pid = int(data["id"])
-            x = float(data["x"])
-            y = float(data["y"])
-            map_name = str(data["map"])
-            direction = str(data.get("direction", "DOWN"))
-            moving = bool(data.get("moving", False))
-        except (ValueError, TypeError):
-            self._json(400, {"error": "bad_fields"})
-            return
+        body = self.rfile.read(length)
+        self._respond(APP.handle("POST", self.path, body, self._headers()))
 
-        ok = PLAYER_HANDLER.update(pid, x, y, map_name, direction, moving)
-        if not ok:
-            self._json(404, {"error": "player_not_found"})
-            return
+    def _headers(self) -> dict[str, str]:
+        return {k.lower(): v for k, v in self.headers.items()}
 
-        self._json(200, {"success": True})
+    def _respond(self, response: Response) -> None:
+        self._json(response.status, response.body(), response.headers, response.content_type)
 
-    # Utility for JSON responses
-    def _json(self, code: int, obj: object) -> None:
-        data = json.dumps(obj).encode("utf-8")
+    # Utility for JSON responses; cached and binary bodies arrive already encoded
+    def _json(self, code: int, data: bytes, headers: dict[str, str] | None = None,
+              content_type: str = "application/json") -> None:
         self.send_response(code)
-        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Type", content_type)
         self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
         self.end_headers()
         self.wfile.write(data)
 
-    # ------------------- Chat -------------------
-    def _handle_post_chat(self):
-        global NEXT_CHAT_ID
-        length = int(self.headers.get("Content-Length", "0"))
-        try:
-            body = self.rfile.read(length)
-            data = json.loads(body.decode("utf-8"))
-        except Exception:
-            self._json(400, {"error": "invalid_json"})
-            return
-
-        if "id" not in data or "text" not in data:
-            self._json(400, {"error": "bad_fields"})
-            return
-        try:
-            pid = int(data["id"])
-            text = str(data["text"]).strip()
-        except Exception:
-            self._json(400, {"error": "bad_fields"})
-            return
-        if not text:
-            self._json(400, {"error": "empty_text"})
-            return
-
-        with CHAT_LOCK:
-            msg = {"id": NEXT_CHAT_ID, "from": pid, "text": text, "ts": time.time()}
-            CHAT_LOG.append(msg)
-            NEXT_CHAT_ID += 1
-            if len(CHAT_LOG) > 200:
-                CHAT_LOG[:] = CHAT_LOG[-200:]
-        self._json(200, {"success": True, "msg": msg})
+def rate_limit(text: str) -> tuple[str, float, float]:
+    try:
+        return parse_limit(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
-    def _handle_get_chat(self):
-        qs = parse_qs(urlparse(self.path).query or "")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monster Go online server")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--push-port", type=int, default=PUSH_PORT)
+    parser.add_argument("--udp-port", type=int, default=UDP_PORT,
+                        help="UDP channel for position updates and snapshots (0 disables it)")
+    parser.add_argument("--chat-history", type=int, default=DEFAULT_CAPACITY,
+                        help="number of chat messages kept for GET /chat (per read with --chat-dir)")
+    parser.add_argument("--chat-dir", help="keep chat history in segment files in this directory across restarts")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="serve HTTP from a single asyncio event loop instead of one thread per connection")
+    parser.add_argument("--shards", action="store_true",
+                        help="serve each map from saves/game.json in its own worker process behind this router")
+    parser.add_argument("--shard-base-port", type=int, default=SHARD_BASE_PORT,
+                        help="first local port for shard workers (one per map)")
+    parser.add_argument("--rate-limit", type=rate_limit, action="append", default=[], metavar="ENDPOINT=RATE[:BURST]",
+                        help="per-player token bucket, e.g. players=20:40 or chat=2:5 (RATE 0 disables it)")
+    parser.add_argument("--no-rate-limit", action="store_true", help="accept requests at any rate")
+    parser.add_argument("--no-move-check", action="store_true",
+                        help="accept position updates on blocked tiles and at any speed")
+    parser.add_argument("--capture", metavar="FILE",
+                        help="record every request to FILE for replaying with python -m server.replay")
+    parser.add_argument("--state-file", metavar="FILE",
+                        help="save players and chat to FILE on shutdown and restore them from it on startup")
+    parser.add_argument("--tick-rate", type=float, default=0.0, metavar="HZ",
+                        help="buffer position updates and apply them in fixed-rate ticks, e.g. 20 (0: apply at once)")
+    args = parser.parse_args()
+    maps_dir = None if args.no_move_check else MAPS_DIR
+    rate_limits = {} if args.no_rate_limit else dict(DEFAULT_LIMITS)
+    if not args.no_rate_limit:
+        rate_limits.update((endpoint, (rate, burst)) for endpoint, rate, burst in args.rate_limit)
+
+    capture = CaptureWriter(args.capture) if args.capture else None
+    # Unwind on SIGTERM like on Ctrl-C, so the finally blocks below save state,
+    # stop shard workers and close capture files
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    if args.shards:
+        APP = ShardRouter(load_maps(), args.shard_base_port, chat_capacity=args.chat_history, chat_dir=args.chat_dir,
+                          rate_limits=rate_limits, maps_dir=maps_dir, tick_rate=args.tick_rate, capture=capture)
+        APP.start()
+        if args.state_file:
+            print(f"[Server] Restored {APP.load_state(args.state_file)} players from {args.state_file}")
+        print(f"[Server] Routing {len(APP.shards)} map shards on localhost with port {args.port}")
         try:
-            since = int(qs.get("since", ["-1"])[0])
-        except ValueError:
-            since = -1
+            ThreadingHTTPServer(("0.0.0.0", args.port), Handler).serve_forever()
+        finally:
+            if args.state_file:
+                APP.save_state(args.state_file)
+            APP.close()
+    elif args.use_async:
+        from server.asyncServer import AsyncGameServer
+
+        # The push and UDP channels are thread-based; async clients fall back to polling.
+        print(f"[Server] Running asyncio server on localhost with port {args.port}")
+        asyncio.run(AsyncGameServer("0.0.0.0", args.port, chat_capacity=args.chat_history,
+                                    chat_dir=args.chat_dir, rate_limits=rate_limits,
+                                    maps_dir=maps_dir, tick_rate=args.tick_rate, capture=capture,
+                                    state_file=args.state_file).serve_forever())
+    else:
+        print(f"[Server] Running on localhost with port {args.port}")
+        APP = GameApp(chat_capacity=args.chat_history, chat_dir=args.chat_dir, rate_limits=rate_limits,
+                      maps_dir=maps_dir, tick_rate=args.tick_rate, capture=capture)
+        if args.state_file:
+            print(f"[Server] Restored {APP.load_state(args.state_file)} players from {args.state_file}")
+        APP.players.start()
+        PushServer(APP.players, "0.0.0.0", args.push_port).start()
+        print(f"[Server] Push channel on port {args.push_port}")
+        if args.udp_port:
+            UdpServer(APP.players, "0.0.0.0", args.udp_port, APP.limiter).start()
+            print(f"[Server] UDP channel on port {args.udp_port}")
         try:
-            limit = int(qs.get("limit", ["50"])[0])
-            limit = max(1, min(200, limit))
-        except ValueError:
-            limit = 50
-
-        with CHAT_LOCK:
-            msgs = [m for m in CHAT_LOG if m["id"] > since]
-            msgs = msgs[-limit:]
-        self._json(200, {"messages": msgs})
-
-if __name__ == "__main__":
-    print(f"[Server] Running on localhost with port {PORT}")
-    ThreadingHTTPServer(("0.0.0.0", PORT), Handler).serve_forever()
+            ThreadingHTTPServer(("0.0.0.0", args.port), Handler).serve_forever()
+        finally:
+            if args.state_file:
+                APP.save_state(args.state_file)
+            APP.close()
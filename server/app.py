@@ -0,0 +1,557 @@
+import json
+import math
+import struct
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+from urllib.parse import urlparse, parse_qs
+
+from server import codec, metrics, stateFile
+from server.battleService import BattleError, BattleService
+from server.capture import CaptureWriter
+from server.chatLog import SegmentLog
+from server.chatStore import ChatStore, DEFAULT_CAPACITY, MAX_TEXT_LENGTH
+from server.collision import CollisionIndex
+from server.playerHandler import PlayerHandler, RejectedUpdate
+from server.playerTable import ID_LIMIT
+from server.rateLimiter import RateLimiter
+from server.metrics import Metrics
+from server.responseCache import (
+    COMPRESSORS, MIN_COMPRESS_SIZE, CachedBody, ResponseCache, etag_matches, make_etag, negotiate_encoding,
+)
+
+DEFAULT_AOI_RADIUS = 1024.0
+MAX_AOI_RADIUS = 4096.0
+MAX_CHAT_WAIT = 25.0  # seconds a long-poll GET /chat or GET /battle may block
+
+# Paths reported individually in /metrics; anything else is counted as "other"
+ENDPOINTS = frozenset({"/", "/register", "/players", "/chat", "/sync", "/metrics", "/shard/join", "/shard/leave",
+                       "/battle", "/battle/challenge", "/battle/accept", "/battle/decline", "/battle/action"})
+
+
+def parse_player_id(value: object) -> int:
+    # Raises ValueError for ids no player can have; the chat log stores senders as int32
+    pid = int(value)
+    if not 0 <= pid < ID_LIMIT:
+        raise ValueError(f"player id out of range: {pid}")
+    return pid
+
+
+@dataclass
+class Response:
+    status: int
+    payload: object
+    headers: dict[str, str] = field(default_factory=dict)
+    cached: CachedBody | None = None  # pre-encoded body shared between requests
+    content_type: str = "application/json"
+
+    def body(self) -> bytes:
+        if self.cached is not None:
+            return self.cached.body
+        if isinstance(self.payload, bytes):
+            return self.payload
+        return json.dumps(self.payload).encode("utf-8")
+
+    @classmethod
+    def from_cache(cls, cached: CachedBody, content_type: str = "application/json") -> "Response":
+        return cls(200, None, {"ETag": cached.etag}, cached, content_type)
+
+    def compressed(self, accept_encoding: str | None) -> "Response":
+        """
+        This response encoded with the best coding `accept_encoding` allows,
+        if its body is at least MIN_COMPRESS_SIZE bytes. Cached bodies reuse
+        the variant memoized on their CachedBody, so each state version is
+        compressed once per coding.
+        """
+        if self.status != 200 or "Content-Encoding" in self.headers:
+            return self
+        body = self.body()
+        if len(body) < MIN_COMPRESS_SIZE:
+            return self
+        headers = dict(self.headers, Vary="Accept-Encoding")
+        encoding = negotiate_encoding(accept_encoding or "")
+        if encoding is None:
+            return Response(self.status, body, headers, content_type=self.content_type)
+        data = self.cached.variant(encoding) if self.cached is not None else COMPRESSORS[encoding](body)
+        headers["Content-Encoding"] = encoding
+        if "ETag" in headers:
+            # Each coding is a different representation
+            headers["ETag"] = f'{headers["ETag"][:-1]}-{encoding}"'
+        return Response(self.status, data, headers, content_type=self.content_type)
+
+    def conditional(self, if_none_match: str | None) -> "Response":
+        # 304 without a body when the client already holds this representation
+        etag = self.headers.get("ETag")
+        if self.status != 200 or not etag or not if_none_match or not etag_matches(if_none_match, etag):
+            return self
+        headers = {k: v for k, v in self.headers.items() if k in ("ETag", "Vary")}
+        return Response(304, b"", headers, content_type=self.content_type)
+
+
+class GameApp:
+    """
+    Transport-independent game server: routes /register, /players, /chat and
+    /battle requests to the player handler, chat log and battle service, and
+    reports request and lock metrics at /metrics. Both the threaded HTTP server and the asyncio server
+    (server.asyncServer) delegate to this class.
+
+    With threadsafe=False the app is meant to be driven from a single thread
+    (an event loop) and takes no locks.
+
+    `rate_limits` maps "players" and "chat" to (tokens per second, burst) for
+    server.rateLimiter (None for its defaults, {} for no limits). Requests over
+    a player's budget are answered 429 with Retry-After before any lock is taken.
+
+    With `maps_dir`, position updates are validated against the collision
+    layers of the .tmx maps there (server.collision) and implausible moves
+    are answered 422.
+
+    With `tick_rate` (Hz), position updates are buffered and applied once per
+    tick (PlayerHandler.tick); the server that runs the app drives the ticks.
+
+    With `capture`, every handled request is recorded for server.replay; the
+    app closes the writer on close().
+
+    save_state() and load_state() keep players and chat across restarts
+    (server.stateFile).
+    """
+    players: PlayerHandler
+    chat: ChatStore
+
+    def __init__(self, *, threadsafe: bool = True, chat_capacity: int = DEFAULT_CAPACITY, chat_dir: str | None = None,
+                 shard: bool = False, rate_limits: dict[str, tuple[float, float]] | None = None,
+                 maps_dir: str | None = None, tick_rate: float = 0.0, capture: CaptureWriter | None = None):
+        # A shard worker also accepts /shard/join and /shard/leave from server.shardRouter
+        self.shard = shard
+        self.metrics = Metrics(threadsafe=threadsafe)
+        lock_wait = self.metrics.histogram(
+            "lock_wait_seconds", "Time spent waiting to acquire a server lock.", ("lock",), metrics.LOCK_BUCKETS)
+        self.players = PlayerHandler(
+            threadsafe=threadsafe, lock_wait=lock_wait,
+            sweep_time=self.metrics.histogram("cleaner_sweep_seconds", "Duration of inactive player sweeps."),
+            collision=CollisionIndex(maps_dir) if maps_dir else None,
+            tick_rate=tick_rate,
+            tick_time=self.metrics.histogram("server_tick_seconds", "Duration of ticks applying buffered updates."),
+        )
+        # With chat_dir, chat history is kept in segment files there and survives restarts
+        self.chat = ChatStore(chat_capacity, threadsafe=threadsafe, lock_wait=lock_wait,
+                              storage=SegmentLog(chat_dir) if chat_dir else None)
+        self._persistent_chat = bool(chat_dir)
+        # PvP battles between registered players (server.battleService)
+        self.battles = BattleService(lambda pid: pid in self.players.snapshot().players, threadsafe=threadsafe)
+        # Encoded GET /players and /chat bodies, keyed by world and chat version
+        self.cache = ResponseCache(threadsafe=threadsafe)
+        self.limiter = RateLimiter(rate_limits, threadsafe=threadsafe)
+        self.capture = capture
+
+        self._requests = self.metrics.counter(
+            "http_requests_total", "HTTP requests handled.", ("endpoint", "status"))
+        self._latency = self.metrics.histogram(
+            "http_request_duration_seconds", "Time to handle an HTTP request, including long-poll waits.", ("endpoint",))
+        self._rate_limited = self.metrics.counter(
+            "rate_limited_total", "Requests rejected with 429 by the per-player rate limits.", ("limit",))
+        self.metrics.gauge("players_active", "Registered players in the published snapshot.",
+                           lambda: len(self.players.snapshot().players))
+        self.metrics.gauge("chat_messages_retained", "Chat messages kept for GET /chat.", lambda: len(self.chat))
+        self.metrics.gauge("response_cache_hits_total", "Responses served from the encoded body cache.",
+                           lambda: self.cache.hits, "counter")
+        self.metrics.gauge("response_cache_misses_total", "Responses encoded on a cache miss.",
+                           lambda: self.cache.misses, "counter")
+
+    def close(self) -> None:
+        self.chat.close()
+        if self.capture is not None:
+            self.capture.close()
+
+    def save_state(self, path: str, players: dict | None = None) -> None:
+        # `players` (PlayerHandler.export_state() output) defaults to this app's
+        state = {"players": players if players is not None else self.players.export_state()}
+        if not self._persistent_chat:
+            state["chat"] = self.chat.export_state()
+        stateFile.save_state(path, state)
+
+    def load_state(self, path: str, restore_players: Callable[[dict], int] | None = None) -> int:
+        """
+        Restores a save_state() file before serving and returns how many
+        players it held. The players go to `restore_players` if given,
+        otherwise to this app's PlayerHandler.
+        """
+        state = stateFile.load_state(path)
+        if state is None:
+            return 0
+        if "chat" in state and not self._persistent_chat:
+            self.chat.restore_state(state["chat"])
+        return (restore_players or self.players.restore_state)(state["players"])
+
+    def chat_wait_time(self, method: str, target: str) -> float:
+        """
+        Seconds a GET /chat?since=N&wait=S request should wait before being
+        handled: 0 unless it is a long-poll with nothing newer than `since`.
+        Used by servers that cannot block inside handle() (server.asyncServer).
+        """
+        url = urlparse(target)
+        if method != "GET" or not url.path.startswith("/chat"):
+            return 0.0
+        since, _, wait = self._parse_chat_query(parse_qs(url.query or ""))
+        if wait <= 0 or self.chat.has_newer(since):
+            return 0.0
+        return wait
+
+    def battle_wait_time(self, method: str, target: str) -> float:
+        # Same as chat_wait_time for GET /battle?id=P&since=N&wait=S
+        url = urlparse(target)
+        if method != "GET" or url.path != "/battle":
+            return 0.0
+        query = self._parse_battle_query(parse_qs(url.query or ""))
+        if query is None or query[2] <= 0 or self.battles.has_newer(query[0], query[1]):
+            return 0.0
+        return query[2]
+
+    def handle(self, method: str, target: str, body: bytes = b"", headers: dict[str, str] | None = None,
+               started: float | None = None) -> Response:
+        # `started` (time.perf_counter) lets a server that waited before calling
+        # handle() (the asyncio long-poll) include that wait in the latency
+        started = time.perf_counter() if started is None else started
+        headers = headers or {}
+        response = self._route(method, target, body, headers)
+        response = response.compressed(headers.get("accept-encoding")).conditional(headers.get("if-none-match"))
+        self.observe(method, target, response.status, started)
+        self.record(method, target, body, headers, response, started)
+        return response
+
+    def observe(self, method: str, target: str, status: int, started: float) -> None:
+        # Records a handled request in /metrics
+        path = urlparse(target).path
+        endpoint = f"{method} {path if path in ENDPOINTS else 'other'}"
+        self._requests.inc((endpoint, status))
+        self._latency.observe(time.perf_counter() - started, (endpoint,))
+
+    def record(self, method: str, target: str, body: bytes, headers: dict[str, str] | None, response: Response,
+               started: float) -> None:
+        # Appends a handled request to the capture file, if capturing
+        if self.capture is not None:
+            self.capture.record(started, method, target, headers, body, response.status, response.headers,
+                                response.body(), response.content_type)
+
+    def throttle(self, limit: str, pid: int, cost: int = 1) -> Response | None:
+        # A 429 response if `pid` is over its budget for `limit`, else None
+        retry_after = self.limiter.acquire(limit, pid, cost)
+        if not retry_after:
+            return None
+        self._rate_limited.inc((limit,))
+        return Response(429, {"error": "rate_limited", "retry_after": round(retry_after, 3)},
+                        {"Retry-After": str(math.ceil(retry_after))})
+
+    def _route(self, method: str, target: str, body: bytes, headers: dict[str, str] | None) -> Response:
+        url = urlparse(target)
+        qs = parse_qs(url.query or "")
+        if method == "GET":
+            if target == "/":
+                return Response(200, {"status": "ok"})
+            if target == "/register":
+                pid = self.players.register()
+                return Response(200, {"message": "registration successful", "id": pid})
+            if url.path == "/players":
+                # Negotiate first: cached bodies are keyed by representation
+                binary = codec.CONTENT_TYPE in (headers or {}).get("accept", "")
+                if target == "/players" and not binary:
+                    snap = self.players.snapshot()
+                    return Response.from_cache(self.cache.get(
+                        "players", snap.version, ("all", "json"),
+                        lambda: {"players": dict(snap.players), "version": snap.version}, representation="all",
+                    ))
+                return self._get_players(qs, binary)
+            if target.startswith("/chat"):
+                return self._get_chat(qs)
+            if url.path == "/battle":
+                return self._get_battle(qs)
+            if target == "/metrics":
+                return Response(200, self.metrics.render().encode("utf-8"), content_type=metrics.CONTENT_TYPE)
+        elif method == "POST":
+            if target == "/chat":
+                return self._post_chat(body)
+            if target == "/players":
+                if (headers or {}).get("content-type", "").startswith(codec.CONTENT_TYPE):
+                    return self._post_players_binary(body)
+                return self._post_players(body)
+            if target == "/sync":
+                return self._sync(body)
+            if target.startswith("/battle/"):
+                return self._post_battle(target[len("/battle/"):], body)
+            if self.shard and target == "/shard/join":
+                return self._shard_join(body)
+            if self.shard and target == "/shard/leave":
+                return self._shard_leave(body)
+        return Response(404, {"error": "not_found"})
+
+    # ------------------- Players -------------------
+    def _get_players(self, qs: dict[str, list[str]], binary: bool = False) -> Response:
+        # `binary` selects the compact codec encoding (negotiated via the Accept header)
+        try:
+            since = int(qs.get("since", ["-1"])[0])
+        except ValueError:
+            since = -1
+
+        if "near" not in qs:
+            snap = self.players.snapshot()
+            if since < snap.removed_floor or since > snap.version:
+                since = -1  # every stale cursor gets the same full listing
+            if binary:
+                return Response.from_cache(self.cache.get(
+                    "players", snap.version, (since, "binary"),
+                    lambda: self.players.list_players_since(since, snap),
+                    codec.encode_listing, f"bin-since{since}",
+                ), codec.CONTENT_TYPE)
+            return Response.from_cache(self.cache.get(
+                "players", snap.version, (since, "json"),
+                lambda: self.players.list_players_since(since, snap), representation=f"since{since}",
+            ))
+
+        # Area of interest: same map as the caller, within radius, caller excluded
+        try:
+            pid = int(qs["near"][0])
+            radius = float(qs.get("radius", [str(DEFAULT_AOI_RADIUS)])[0])
+        except ValueError:
+            return Response(400, {"error": "bad_fields"})
+        radius = max(0.0, min(MAX_AOI_RADIUS, radius))
+        result = self.players.list_players_near(pid, radius, since)
+        if result is None:
+            return Response(404, {"error": "player_not_found"})
+        # The tag names the caller, radius and whether this is the empty "nothing changed" listing
+        area = f"near{pid}-r{radius:g}" + ("-same" if since == result["version"] else "")
+        if binary:
+            return Response(200, codec.encode_listing(result),
+                            {"ETag": make_etag("players", result["version"], f"bin-{area}")},
+                            content_type=codec.CONTENT_TYPE)
+        return Response(200, result, {"ETag": make_etag("players", result["version"], area)})
+
+    def _post_players_binary(self, body: bytes) -> Response:
+        try:
+            data = codec.decode_update(body)
+        except (ValueError, IndexError, struct.error):
+            return Response(400, {"error": "invalid_binary"})
+        error = self._update_player(data)
+        if error:
+            return error
+        return Response(200, {"success": True})
+
+    def _post_players(self, body: bytes) -> Response:
+        try:
+            data = json.loads(body.decode("utf-8"))
+        except Exception:
+            return Response(400, {"error": "invalid_json"})
+        error = self._update_player(data)
+        if error:
+            return error
+        return Response(200, {"success": True})
+
+    @staticmethod
+    def parse_update(data: dict) -> tuple | Response:
+        # (id, x, y, map, direction, moving) from an update body, or a 400 response
+        missing = [k for k in ("id", "x", "y", "map") if k not in data]
+        if missing:
+            return Response(400, {"error": "bad_fields", "missing": missing})
+
+        try:
+            pid = parse_player_id(data["id"])
+            x = float(data["x"])
+            y = float(data["y"])
+            map_name = str(data["map"])
+            direction = str(data.get("direction", "DOWN"))
+            moving = bool(data.get("moving", False))
+        except (ValueError, TypeError):
+            return Response(400, {"error": "bad_fields"})
+        if not (math.isfinite(x) and math.isfinite(y)):
+            return Response(400, {"error": "bad_fields"})
+        return pid, x, y, map_name, direction, moving
+
+    def _update_player(self, data: dict, throttle: bool = True) -> Response | None:
+        fields = self.parse_update(data)
+        if isinstance(fields, Response):
+            return fields
+        limited = self.throttle("players", fields[0]) if throttle else None
+        if limited:
+            return limited
+        try:
+            ok = self.players.update(*fields)
+        except RejectedUpdate as e:
+            return Response(422, {"error": "invalid_move", "reason": e.reason})
+        if not ok:
+            return Response(404, {"error": "player_not_found"})
+        return None
+
+    # ------------------- Sync -------------------
+    def _sync(self, body: bytes) -> Response:
+        """
+        One round-trip for a client tick. The body carries the caller's id, an
+        optional position update (x, y, map, direction, moving), optional outgoing
+        chat lines ("chat"), the world cursor ("since"), the chat cursor
+        ("chat_since") and an optional area-of-interest "radius". The response
+        is a /players delta plus the chat messages after the chat cursor.
+        """
+        try:
+            data = json.loads(body.decode("utf-8"))
+            pid = parse_player_id(data["id"])
+            since = int(data.get("since", -1))
+            chat_since = int(data.get("chat_since", -1))
+            radius = data.get("radius")
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return Response(400, {"error": "bad_fields"})
+        lines = self.parse_chat(data.get("chat", []))
+        if isinstance(lines, Response):
+            return lines
+
+        limited = self.throttle("players", pid)
+        if not limited and lines:
+            limited = self.throttle("chat", pid, len(lines))
+        if limited:
+            return limited
+
+        if "x" in data:
+            error = self._update_player(data, throttle=False)
+            if error:
+                return error
+
+        for text in lines:
+            self.chat.append(pid, text)
+
+        if radius is None:
+            result = self.players.list_players_since(since)
+        else:
+            try:
+                radius = max(0.0, min(MAX_AOI_RADIUS, float(radius)))
+            except (ValueError, TypeError):
+                return Response(400, {"error": "bad_fields"})
+            result = self.players.list_players_near(pid, radius, since)
+            if result is None:
+                return Response(404, {"error": "player_not_found"})
+
+        chat = self.chat.since(chat_since, 50)
+        result["messages"] = chat["messages"]
+        result["chat_gap"] = chat["gap"]
+        return Response(200, result)
+
+    # ------------------- Shard handoff -------------------
+    def _shard_join(self, body: bytes) -> Response:
+        try:
+            fields = self.parse_update(json.loads(body.decode("utf-8")))
+        except Exception:
+            return Response(400, {"error": "invalid_json"})
+        if isinstance(fields, Response):
+            return fields
+        self.players.add(*fields)
+        return Response(200, {"success": True})
+
+    def _shard_leave(self, body: bytes) -> Response:
+        try:
+            pid = int(json.loads(body.decode("utf-8"))["id"])
+        except Exception:
+            return Response(400, {"error": "bad_fields"})
+        if not self.players.remove(pid):
+            return Response(404, {"error": "player_not_found"})
+        return Response(200, {"success": True})
+
+    # ------------------- Battles -------------------
+    def _post_battle(self, action: str, body: bytes) -> Response:
+        try:
+            data = json.loads(body.decode("utf-8"))
+            pid = parse_player_id(data["id"])
+            if action == "challenge":
+                battle = self.battles.challenge(pid, int(data["target"]), data.get("team"), data.get("name"))
+                return Response(200, {"battle": battle})
+            battle = int(data["battle"])
+            if action == "accept":
+                self.battles.accept(pid, battle, data.get("team"), data.get("name"))
+                return Response(200, {"battle": battle})
+            if action == "decline":
+                self.battles.decline(pid, battle)
+                return Response(200, {"success": True})
+            if action == "action":
+                return Response(200, self.battles.act(pid, battle, str(data.get("action", "")), int(data.get("skill", 0))))
+        except BattleError as e:
+            return Response(e.status, {"error": e.error})
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return Response(400, {"error": "bad_fields"})
+        return Response(404, {"error": "not_found"})
+
+    def _get_battle(self, qs: dict[str, list[str]]) -> Response:
+        query = self._parse_battle_query(qs)
+        if query is None:
+            return Response(400, {"error": "bad_fields"})
+        pid, since, wait = query
+        if wait > 0:
+            self.battles.wait(pid, since, wait)
+        return Response(200, self.battles.events(pid, since))
+
+    @staticmethod
+    def _parse_battle_query(qs: dict[str, list[str]]) -> tuple[int, int, float] | None:
+        try:
+            pid = int(qs["id"][0])
+            since = int(qs.get("since", ["-1"])[0])
+            wait = max(0.0, min(MAX_CHAT_WAIT, float(qs.get("wait", ["0"])[0])))
+        except (KeyError, ValueError):
+            return None
+        return pid, since, wait
+
+    # ------------------- Chat -------------------
+    def _post_chat(self, body: bytes) -> Response:
+        try:
+            data = json.loads(body.decode("utf-8"))
+        except Exception:
+            return Response(400, {"error": "invalid_json"})
+
+        if "id" not in data or "text" not in data:
+            return Response(400, {"error": "bad_fields"})
+        try:
+            pid = parse_player_id(data["id"])
+        except Exception:
+            return Response(400, {"error": "bad_fields"})
+        lines = self.parse_chat([data["text"]])
+        if isinstance(lines, Response):
+            return lines
+        text = lines[0]
+        limited = self.throttle("chat", pid)
+        if limited:
+            return limited
+
+        msg = self.chat.append(pid, text)
+        return Response(200, {"success": True, "msg": msg})
+
+    @staticmethod
+    def parse_chat(lines: object) -> list[str] | Response:
+        # Outgoing chat lines from POST /chat or /sync, stripped, or a 400 response
+        if not isinstance(lines, list):
+            return Response(400, {"error": "bad_fields"})
+        texts = [str(line).strip() for line in lines]
+        if not all(texts):
+            return Response(400, {"error": "empty_text"})
+        if any(len(text) > MAX_TEXT_LENGTH for text in texts):
+            return Response(400, {"error": "text_too_long", "max": MAX_TEXT_LENGTH})
+        return texts
+
+    def _get_chat(self, qs: dict[str, list[str]]) -> Response:
+        since, limit, wait = self._parse_chat_query(qs)
+        if wait > 0:
+            # Long-poll: block until a message newer than `since` exists or the wait expires
+            self.chat.wait(since, wait)
+        return Response.from_cache(self.cache.get(
+            "chat", self.chat.next_id, (since, limit),
+            lambda: self.chat.since(since, limit), representation=f"since{since}-limit{limit}",
+        ))
+
+    def _parse_chat_query(self, qs: dict[str, list[str]]) -> tuple[int, int, float]:
+        try:
+            since = int(qs.get("since", ["-1"])[0])
+        except ValueError:
+            since = -1
+        try:
+            limit = int(qs.get("limit", ["50"])[0])
+            limit = max(1, min(self.chat.capacity, limit))
+        except ValueError:
+            limit = 50
+        try:
+            wait = float(qs.get("wait", ["0"])[0])
+            wait = max(0.0, min(MAX_CHAT_WAIT, wait))
+        except ValueError:
+            wait = 0.0
+        return since, limit, wait
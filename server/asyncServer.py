@@ -0,0 +1,152 @@
+import asyncio
+import time
+from http import HTTPStatus
+
+from server.app import GameApp, Response
+from server.capture import CaptureWriter
+from server.chatStore import DEFAULT_CAPACITY
+
+MAX_HEADER_LINES = 100
+MAX_BODY_SIZE = 1 << 20
+
+
+def encode_response(response: Response, keep_alive: bool) -> bytes:
+    data = response.body()
+    reason = HTTPStatus(response.status).phrase
+    lines = [
+        f"HTTP/1.1 {response.status} {reason}",
+        f"Content-Type: {response.content_type}",
+        f"Content-Length: {len(data)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    lines.extend(f"{k}: {v}" for k, v in response.headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data
+
+
+class Wakeup:
+    """Wakes every coroutine in wait() when set() is called (a change listener)."""
+    def __init__(self):
+        self._future: asyncio.Future | None = None
+
+    def set(self) -> None:
+        if self._future is not None and not self._future.done():
+            self._future.set_result(None)
+        self._future = None
+
+    async def wait(self, timeout: float) -> None:
+        if self._future is None:
+            self._future = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class AsyncGameServer:
+    """
+    Single event loop HTTP/1.1 server for the same protocol as server.py's
+    ThreadingHTTPServer. Connections are kept alive between requests and all
+    state lives in a lock-free GameApp, so no request ever waits on a lock.
+    """
+
+    def __init__(self, host: str, port: int, *, chat_capacity: int = DEFAULT_CAPACITY, chat_dir: str | None = None,
+                 shard: bool = False, rate_limits: dict[str, tuple[float, float]] | None = None,
+                 maps_dir: str | None = None, tick_rate: float = 0.0, capture: CaptureWriter | None = None,
+                 state_file: str | None = None):
+        self.host = host
+        self.port = port
+        # Players and chat are loaded from here on start and saved back on shutdown
+        self.state_file = state_file
+        self.app = GameApp(threadsafe=False, chat_capacity=chat_capacity, chat_dir=chat_dir, shard=shard,
+                           rate_limits=rate_limits, maps_dir=maps_dir, tick_rate=tick_rate, capture=capture)
+        # Long-polls waiting for the next chat message or battle event
+        self._chat_posted = Wakeup()
+        self.app.chat.add_listener(self._chat_posted.set)
+        self._battle_posted = Wakeup()
+        self.app.battles.add_listener(self._battle_posted.set)
+
+    async def _long_poll(self, method: str, target: str) -> None:
+        wait = self.app.chat_wait_time(method, target)
+        if wait > 0:
+            await self._chat_posted.wait(wait)
+            return
+        # Battle events are per player, so a wake-up may be for someone else
+        deadline = time.monotonic() + self.app.battle_wait_time(method, target)
+        while (wait := min(self.app.battle_wait_time(method, target), deadline - time.monotonic())) > 0:
+            await self._battle_posted.wait(wait)
+
+    async def serve_forever(self) -> None:
+        if self.state_file:
+            restored = self.app.load_state(self.state_file)
+            print(f"[Server] Restored {restored} players from {self.state_file}")
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        tasks = [asyncio.create_task(self._cleaner())]
+        if self.app.players.tick_interval:
+            tasks.append(asyncio.create_task(self._ticker()))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self.state_file:
+                self.app.save_state(self.state_file)
+            self.app.close()
+
+    async def _cleaner(self) -> None:
+        while True:
+            await asyncio.sleep(self.app.players.next_expiry())
+            self.app.players.sweep()
+
+    async def _ticker(self) -> None:
+        # Same schedule as PlayerHandler._ticker, on the event loop
+        interval = self.app.players.tick_interval
+        next_tick = time.monotonic() + interval
+        while True:
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            self.app.players.tick()
+            next_tick = max(next_tick + interval, time.monotonic())
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    writer.write(encode_response(Response(400, {"error": "bad_request"}), False))
+                    break
+
+                headers: dict[str, str] = {}
+                for _ in range(MAX_HEADER_LINES):
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", "0") or 0)
+                if length > MAX_BODY_SIZE:
+                    writer.write(encode_response(Response(413, {"error": "too_large"}), False))
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                connection = headers.get("connection", "").lower()
+                if version == "HTTP/1.0":
+                    keep_alive = connection == "keep-alive"
+                else:
+                    keep_alive = connection != "close"
+
+                started = time.perf_counter()
+                await self._long_poll(method, target)
+                response = self.app.handle(method, target, body, headers, started)
+                writer.write(encode_response(response, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
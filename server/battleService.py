@@ -0,0 +1,322 @@
+"""
+Server-authoritative player-vs-player battles.
+
+A battle starts with POST /battle/challenge and POST /battle/accept, each
+carrying the sender's team snapshot once (the monster dicts of
+Monster.to_dict). The server builds a RemoteTrainer for each side and from
+then on resolves every turn itself with src.entities.monsters.calculate_damage,
+the rule BattleScene uses. Clients only send their choice of skill (or a
+switch or forfeit) and receive compact turn results.
+
+Submitted stats are not trusted: every field is clamped to the largest
+value any monster in saves/*.json has (see load_limits), and a monster
+without skills fights with DEFAULT_SKILL.
+
+Results are delivered through a per-player event inbox that clients read
+with a GET /battle long-poll, like chat, so a battle adds no per-frame
+traffic. Event ids are increasing across all inboxes. Event types:
+
+    challenge  {battle, from, name}
+    start      {battle, players, teams, turn}        team snapshots, sent once
+    turn       {battle, seq, side, action, skill, damage, hp, active, turn}
+    end        {battle, winner, reason}
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import dataclass, field
+from typing import Callable
+
+from src.entities.monsters import Monster, calculate_damage
+from src.entities.remote_trainer import RemoteTrainer
+
+SAVES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "saves")
+MAX_TEAM = 3  # monsters per side, as in BattleScene
+MAX_SUBMITTED = 12  # monsters accepted in a team snapshot
+CHALLENGE_TIMEOUT = 30.0  # seconds a challenge waits for an answer
+BATTLE_TIMEOUT = 120.0  # an active battle with no turn for this long is abandoned
+INBOX_SIZE = 64  # events kept per player
+INBOX_TTL = 120.0  # inboxes of players not in a battle are dropped after this long without events
+MAX_NAME = 32
+DEFAULT_SKILL = {"name": "Tackle", "power": 10}  # the weakest skill in wildpokemon.json
+# Used for fields no monster in the save files has
+DEFAULT_LIMITS = {"hp": 220, "max_hp": 220, "level": 50, "attack": 50, "defense": 45, "power": 40}
+
+
+class BattleError(Exception):
+    """A battle request that cannot be applied; `status` is the HTTP status to answer with."""
+    def __init__(self, status: int, error: str):
+        super().__init__(error)
+        self.status = status
+        self.error = error
+
+
+@dataclass
+class BattleSession:
+    id: int
+    players: tuple[int, int]  # challenger, opponent
+    trainers: list[RemoteTrainer | None]  # the opponent's is set on accept
+    active: list[int] = field(default_factory=lambda: [0, 0])  # index of each side's monster in play
+    turn: int = 0  # side to move; the challenger opens
+    seq: int = 0  # turns resolved
+    started: bool = False
+    updated: float = field(default_factory=time.monotonic)
+
+    def side_of(self, pid: int) -> int:
+        return self.players.index(pid)
+
+    def monster(self, side: int) -> Monster:
+        return self.trainers[side].monsters[self.active[side]]
+
+
+def load_limits(saves_dir: str = SAVES_DIR) -> dict[str, int]:
+    """
+    Largest hp, max_hp, level, attack, defense and skill power of any monster
+    in the JSON files of `saves_dir` (bags, trainers and wild pools alike).
+    Fields missing from a monster count with Monster's defaults.
+    """
+    found: dict[str, int] = {}
+
+    def visit(node: object) -> None:
+        if isinstance(node, dict):
+            if "max_hp" in node:
+                stats = {"hp": node.get("hp", 0), "max_hp": node["max_hp"], "level": node.get("level", 1),
+                         "attack": node.get("attack", 10), "defense": node.get("defense", 5)}
+                stats["power"] = max((s.get("power", 0) for s in node.get("skills", []) if isinstance(s, dict)),
+                                     default=0)
+                for key, value in stats.items():
+                    if isinstance(value, int):
+                        found[key] = max(found.get(key, 0), value)
+            for value in node.values():
+                visit(value)
+        elif isinstance(node, list):
+            for value in node:
+                visit(value)
+
+    for path in glob.glob(os.path.join(saves_dir, "*.json")):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                visit(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return {key: found.get(key) or default for key, default in DEFAULT_LIMITS.items()}
+
+
+def _clamp(value: object, low: int, high: int) -> int:
+    return max(low, min(int(value), high))
+
+
+def build_trainer(team: object, name: object, limits: dict[str, int] = DEFAULT_LIMITS) -> RemoteTrainer:
+    """
+    RemoteTrainer from a submitted team snapshot. Like BattleScene, the side
+    fights with its healthiest MAX_TEAM monsters that can still battle.
+    Stats are clamped to `limits` (load_limits output). Raises
+    BattleError(400) for malformed snapshots.
+    """
+    if not isinstance(team, list) or not team or len(team) > MAX_SUBMITTED:
+        raise BattleError(400, "bad_team")
+    try:
+        monsters = []
+        for m in team:
+            max_hp = _clamp(m["max_hp"], 1, limits["max_hp"])
+            skills = [{"name": str(s["name"])[:MAX_NAME], "power": _clamp(s["power"], 0, limits["power"])}
+                      for s in m.get("skills", [])]
+            monsters.append({
+                "name": str(m["name"])[:MAX_NAME],
+                "hp": _clamp(m["hp"], 0, min(max_hp, limits["hp"])),
+                "max_hp": max_hp,
+                "level": _clamp(m["level"], 1, limits["level"]),
+                "sprite_path": str(m.get("sprite_path", "")),
+                "attack": _clamp(m.get("attack", 10), 0, limits["attack"]),
+                "defense": _clamp(m.get("defense", 5), 0, limits["defense"]),
+                "element": str(m.get("element", "neutral")),
+                # Without a move the side could never attack and the battle would stall
+                "skills": skills or [dict(DEFAULT_SKILL)],
+            })
+    except (KeyError, TypeError, ValueError, AttributeError, OverflowError):
+        raise BattleError(400, "bad_team")
+    alive = sorted((m for m in monsters if m["hp"] > 0), key=lambda m: m["hp"], reverse=True)[:MAX_TEAM]
+    if not alive:
+        raise BattleError(400, "no_monsters")
+    return RemoteTrainer(alive, str(name)[:MAX_NAME] if name else "Online Trainer")
+
+
+class BattleService:
+    """
+    Battle sessions and per-player event inboxes. `is_player` tells whether an
+    id belongs to a registered player. With threadsafe=False (the asyncio
+    server) nothing is locked and wait() does not block.
+    """
+    _sessions: dict[int, BattleSession]
+    _by_player: dict[int, int]  # pid -> battle id, for pending and active battles
+    _inboxes: dict[int, tuple[deque, float]]  # pid -> (recent events, time of the last one)
+    _listeners: list[Callable[[], None]]
+
+    def __init__(self, is_player: Callable[[int], bool], *, threadsafe: bool = True,
+                 limits: dict[str, int] | None = None):
+        self.is_player = is_player
+        # Upper bounds for submitted monster stats
+        self.limits = limits if limits is not None else load_limits()
+        lock = threading.Lock()
+        self._lock: AbstractContextManager = lock if threadsafe else nullcontext()
+        # GET /battle long-polls wait here for new events (threaded servers only)
+        self._posted = threading.Condition(lock) if threadsafe else None
+        self._next_id = 0
+        self._event_id = -1
+        self._sessions = {}
+        self._by_player = {}
+        self._inboxes = {}
+        self._listeners = []
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        self._listeners.append(callback)
+
+    def _notify(self) -> None:
+        for callback in self._listeners:
+            callback()
+
+    # Events (caller holds the lock)
+    def _post(self, pid: int, event: dict) -> None:
+        events = self._inboxes[pid][0] if pid in self._inboxes else deque(maxlen=INBOX_SIZE)
+        self._event_id += 1
+        events.append(dict(event, id=self._event_id))
+        self._inboxes[pid] = (events, time.monotonic())
+        if self._posted is not None:
+            self._posted.notify_all()
+
+    def _close(self, session: BattleSession, winner: int | None, reason: str) -> None:
+        del self._sessions[session.id]
+        for pid in session.players:
+            if self._by_player.get(pid) == session.id:
+                del self._by_player[pid]
+            self._post(pid, {"type": "end", "battle": session.id, "winner": winner, "reason": reason})
+
+    def _expire(self, now: float) -> None:
+        for session in list(self._sessions.values()):
+            limit = BATTLE_TIMEOUT if session.started else CHALLENGE_TIMEOUT
+            if now - session.updated >= limit:
+                self._close(session, None, "timeout")
+        for pid in [p for p, (_, t) in self._inboxes.items() if now - t >= INBOX_TTL and p not in self._by_player]:
+            del self._inboxes[pid]
+
+    def has_newer(self, pid: int, since: int) -> bool:
+        inbox = self._inboxes.get(pid)
+        return inbox is not None and inbox[0][-1]["id"] > since
+
+    def wait(self, pid: int, since: int, timeout: float) -> bool:
+        # Blocks until `pid` has an event newer than `since`; no-op without locking
+        if self._posted is None:
+            return self.has_newer(pid, since)
+        with self._posted:
+            return self._posted.wait_for(lambda: self.has_newer(pid, since), timeout=timeout)
+
+    def events(self, pid: int, since: int) -> dict:
+        # Events for `pid` after id `since`; "last" is the newest id of any inbox,
+        # so a client whose cursor is ahead of it knows the server restarted
+        with self._lock:
+            self._expire(time.monotonic())
+            events = self._inboxes[pid][0] if pid in self._inboxes else ()
+            return {"events": [e for e in events if e["id"] > since], "last": self._event_id}
+
+    # Battles
+    def challenge(self, pid: int, target: int, team: object, name: object = None) -> int:
+        trainer = build_trainer(team, name, self.limits)
+        if target == pid or not self.is_player(target):
+            raise BattleError(404, "player_not_found")
+        with self._lock:
+            self._expire(time.monotonic())
+            if pid in self._by_player or target in self._by_player:
+                raise BattleError(409, "already_in_battle")
+            session = BattleSession(self._next_id, (pid, target), [trainer, None])
+            self._next_id += 1
+            self._sessions[session.id] = session
+            self._by_player[pid] = self._by_player[target] = session.id
+            self._post(target, {"type": "challenge", "battle": session.id, "from": pid, "name": trainer.name})
+        self._notify()
+        return session.id
+
+    def _session(self, pid: int, battle: int) -> BattleSession:
+        session = self._sessions.get(battle)
+        if session is None or pid not in session.players:
+            raise BattleError(404, "battle_not_found")
+        return session
+
+    def accept(self, pid: int, battle: int, team: object, name: object = None) -> None:
+        trainer = build_trainer(team, name, self.limits)
+        with self._lock:
+            self._expire(time.monotonic())
+            session = self._session(pid, battle)
+            if session.started or session.side_of(pid) != 1:
+                raise BattleError(409, "not_pending")
+            session.trainers[1] = trainer
+            session.started = True
+            session.updated = time.monotonic()
+            start = {"type": "start", "battle": battle, "players": list(session.players),
+                     "teams": [t.to_dict() for t in session.trainers], "turn": session.turn}
+            for p in session.players:
+                self._post(p, start)
+        self._notify()
+
+    def decline(self, pid: int, battle: int) -> None:
+        # Refuses a challenge, withdraws one, or forfeits a running battle
+        with self._lock:
+            session = self._session(pid, battle)
+            if session.started:
+                winner, reason = session.players[1 - session.side_of(pid)], "forfeit"
+            else:
+                winner, reason = None, "declined"
+            self._close(session, winner, reason)
+        self._notify()
+
+    def act(self, pid: int, battle: int, action: str, skill: int = 0) -> dict:
+        """
+        Resolves the caller's move: "attack" with skill index `skill`, or
+        "switch" to their next healthy monster (BattleScene.switch_monster).
+        A side whose monster faints sends in its next healthy one and moves
+        next; it loses when none is left. Returns the turn event sent to both
+        players.
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            session = self._session(pid, battle)
+            side = session.side_of(pid)
+            if not session.started or session.turn != side:
+                raise BattleError(409, "not_your_turn")
+            foe = 1 - side
+            event = {"type": "turn", "battle": battle, "seq": session.seq + 1, "side": side, "action": action}
+            defeated = False
+            if action == "attack":
+                attacker, target = session.monster(side), session.monster(foe)
+                if not 0 <= skill < len(attacker.skills):
+                    raise BattleError(400, "bad_skill")
+                damage = min(calculate_damage(attacker, target, attacker.skills[skill]), target.hp)
+                target.hp -= damage
+                event.update(skill=skill, damage=damage, hp=target.hp)
+                if target.hp <= 0:
+                    healthy = [i for i, m in enumerate(session.trainers[foe].monsters) if m.hp > 0]
+                    if healthy:
+                        session.active[foe] = healthy[0]
+                    defeated = not healthy
+            elif action == "switch":
+                team = session.trainers[side].monsters
+                available = [i for i, m in enumerate(team) if m.hp > 0 and i != session.active[side]]
+                if not available:
+                    raise BattleError(409, "cannot_switch")
+                session.active[side] = available[0]
+            else:
+                raise BattleError(400, "bad_action")
+            session.seq += 1
+            session.turn = foe
+            session.updated = time.monotonic()
+            event.update(active=list(session.active), turn=None if defeated else foe)
+            for p in session.players:
+                self._post(p, event)
+            if defeated:
+                self._close(session, pid, "defeated")
+        self._notify()
+        return event
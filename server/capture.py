@@ -0,0 +1,163 @@
+"""
+Traffic capture for server.py --capture and server.replay.
+
+Every handled HTTP request is appended to a gzip-compressed file of binary
+records: arrival time (seconds since the capture started), method, target,
+the request headers the server looks at, the request body, and the response
+status, length, body fingerprint and server-side latency. Response bodies
+themselves are not stored; fingerprint() reduces them to a checksum that
+ignores compression and volatile fields, so a replay can tell whether the
+server answered the same.
+
+Records are written by a background thread in the order requests finish
+(long-polls late); read_capture() returns them sorted by arrival. The file
+is flushed at least once a second, so a capture cut short by a crash can
+still be read up to its last flush.
+"""
+
+import gzip
+import json
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+
+MAGIC = b"MGCAP\x02"
+# arrival, latency, status, method, target length, headers length, body length, response length, fingerprint
+RECORD = struct.Struct("<dfHBIIIII")
+METHODS = ("GET", "POST", "HEAD", "PUT", "DELETE")
+# Request headers that change what the server answers
+CAPTURED_HEADERS = ("accept", "content-type", "accept-encoding", "if-none-match")
+# JSON keys whose values differ between otherwise identical runs: chat
+# timestamps, retry delays and world versions (which depend on when snapshots
+# are published)
+VOLATILE_KEYS = frozenset({"ts", "retry_after", "version"})
+FLUSH_INTERVAL = 1.0
+
+
+@dataclass(frozen=True)
+class CapturedRequest:
+    arrival: float
+    method: str
+    target: str
+    headers: dict[str, str]
+    body: bytes
+    status: int
+    latency: float
+    length: int
+    fingerprint: int
+
+
+def _strip_volatile(value: object) -> object:
+    if isinstance(value, dict):
+        return {k: _strip_volatile(v) for k, v in value.items() if k not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [_strip_volatile(v) for v in value]
+    return value
+
+
+def decode_body(data: bytes, content_encoding: str | None) -> bytes:
+    if content_encoding == "gzip":
+        return gzip.decompress(data)
+    if content_encoding == "deflate":
+        return zlib.decompress(data)
+    return data
+
+
+def fingerprint(data: bytes, content_type: str) -> int:
+    """
+    CRC-32 of a decoded response body. JSON bodies are compared by value,
+    with VOLATILE_KEYS removed at any depth.
+    """
+    if content_type.startswith("application/json") and data:
+        try:
+            data = json.dumps(_strip_volatile(json.loads(data)), sort_keys=True).encode("utf-8")
+        except ValueError:
+            pass
+    return zlib.crc32(data)
+
+
+class CaptureWriter:
+    """Appends requests to a capture file from a background thread; record() never blocks on I/O."""
+    def __init__(self, path: str):
+        self.path = path
+        self._file = gzip.open(path, "wb")
+        self._file.write(MAGIC)
+        self._origin = time.perf_counter()
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._writer, name="CaptureWriter", daemon=True)
+        self._thread.start()
+
+    def record(self, started: float, method: str, target: str, headers: dict[str, str] | None, body: bytes,
+               status: int, response_headers: dict[str, str], response_body: bytes, content_type: str) -> None:
+        """
+        Queues one handled request. `started` is its time.perf_counter() at
+        arrival; the latency is measured up to this call.
+        """
+        latency = time.perf_counter() - started
+        kept = {k: v for k, v in (headers or {}).items() if k in CAPTURED_HEADERS}
+        self._queue.put((started - self._origin, latency, method, target, kept, body, status,
+                         response_headers.get("Content-Encoding"), response_body, content_type))
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+    def _writer(self) -> None:
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                item = False
+            if item is None:
+                return
+            if item:
+                # One bad record must not stop the writer, or the queue grows without bound
+                try:
+                    self._write(*item)
+                except Exception as e:
+                    print(f"[Server] Capture skipped {item[2]} {item[3][:80]}: {e!r}", file=sys.stderr)
+            if time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                self._file.flush()
+                last_flush = time.monotonic()
+
+    def _write(self, arrival: float, latency: float, method: str, target: str, headers: dict[str, str],
+               body: bytes, status: int, encoding: str | None, response_body: bytes, content_type: str) -> None:
+        try:
+            data = decode_body(response_body, encoding)
+        except (OSError, zlib.error):
+            data = response_body
+        target_bytes = target.encode("utf-8")
+        header_bytes = "".join(f"{k}: {v}\r\n" for k, v in headers.items()).encode("latin-1", "replace")
+        method_index = METHODS.index(method) if method in METHODS else 0
+        # Packed before writing, so a record that cannot be packed leaves no partial bytes behind
+        head = RECORD.pack(arrival, latency, status, method_index, len(target_bytes), len(header_bytes),
+                           len(body), len(data), fingerprint(data, content_type))
+        self._file.write(head + target_bytes + header_bytes + body)
+
+
+def read_capture(path: str) -> list[CapturedRequest]:
+    """Requests in a capture file, by arrival time. A truncated tail is ignored."""
+    requests = []
+    with gzip.open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        try:
+            while len(head := f.read(RECORD.size)) == RECORD.size:
+                arrival, latency, status, method, target_len, headers_len, body_len, length, crc = RECORD.unpack(head)
+                rest = f.read(target_len + headers_len + body_len)
+                if len(rest) < target_len + headers_len + body_len:
+                    break
+                header_text = rest[target_len:target_len + headers_len].decode("latin-1")
+                headers = dict(line.split(": ", 1) for line in header_text.split("\r\n") if line)
+                requests.append(CapturedRequest(arrival, METHODS[method], rest[:target_len].decode("utf-8"), headers,
+                                                rest[target_len + headers_len:], status, latency, length, crc))
+        except (EOFError, OSError, zlib.error):
+            pass
+    requests.sort(key=lambda r: r.arrival)
+    return requests
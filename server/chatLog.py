@@ -0,0 +1,228 @@
+"""
+Persistent chat storage: an append-only log split into segment files.
+
+Each segment is named after the id of its first message and holds records
+
+    <IIqid   crc32 of the rest of the record, text length, id, sender, timestamp
+    text     UTF-8
+
+The active segment is preallocated and written through a writable memory map;
+when it fills up it is truncated to its used size, sealed and mapped
+read-only. Reads go through the maps, so history is never loaded into the
+heap. Every segment keeps a sparse id -> offset index (one entry per
+INDEX_INTERVAL records), built lazily for sealed segments so startup only
+scans the active one. The oldest segments are deleted beyond `max_segments`.
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import zlib
+
+SEGMENT_SIZE = 4 << 20
+MAX_SEGMENTS = 64
+INDEX_INTERVAL = 64
+SUFFIX = ".chat"
+
+RECORD = struct.Struct("<IIqid")
+
+
+def _encode(msg: dict) -> bytes:
+    text = msg["text"].encode("utf-8")
+    rest = RECORD.pack(0, len(text), msg["id"], msg["from"], msg["ts"])[4:] + text
+    return struct.pack("<I", zlib.crc32(rest)) + rest
+
+
+class Segment:
+    first_id: int
+    path: str
+    size: int   # bytes of valid records
+    count: int | None  # valid records; None for a sealed segment until it is indexed
+    _map: mmap.mmap | None
+    _index_ids: list[int]
+    _index_offsets: list[int]
+
+    def __init__(self, path: str, first_id: int):
+        self.path = path
+        self.first_id = first_id
+        self.size = 0
+        self.count = 0
+        self._map = None
+        self._file = None
+        self._index_ids = []
+        self._index_offsets = []
+        self._indexed = False
+
+    # Opening
+    def open_sealed(self) -> None:
+        self.size = os.path.getsize(self.path)
+        self.count = None
+        if self.size:
+            with open(self.path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def open_active(self, capacity: int) -> None:
+        # Maps the file writable at `capacity` bytes and recovers the valid prefix
+        self._file = open(self.path, "r+b" if os.path.exists(self.path) else "w+b")
+        length = max(capacity, os.fstat(self._file.fileno()).st_size)
+        self._file.truncate(length)
+        self._map = mmap.mmap(self._file.fileno(), length, access=mmap.ACCESS_WRITE)
+        self.size = 0
+        self.count = 0
+        self._build_index()
+        # Clear a torn record left by a crash so it is not mistaken for data later
+        self._map[self.size:self.size + RECORD.size] = bytes(min(RECORD.size, length - self.size))
+
+    def seal(self) -> None:
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(self.size)
+        self._file.close()
+        self._file = None
+        self._map = None
+        if self.size:
+            with open(self.path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self) -> None:
+        if self._map is not None:
+            if self._file is not None:
+                self._map.flush()
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # Records
+    @property
+    def writable(self) -> int:
+        return len(self._map) - self.size if self._file is not None else 0
+
+    def append(self, record: bytes) -> None:
+        if self.count % INDEX_INTERVAL == 0:
+            self._index_ids.append(self.first_id + self.count)
+            self._index_offsets.append(self.size)
+        self._map[self.size:self.size + len(record)] = record
+        self.size += len(record)
+        self.count += 1
+
+    def _record_at(self, offset: int) -> tuple[dict, int] | None:
+        # Returns (message, next offset), or None at the end of the valid data
+        end = len(self._map) if self._file is not None else self.size
+        if offset + RECORD.size > end:
+            return None
+        crc, length, mid, pid, ts = RECORD.unpack_from(self._map, offset)
+        stop = offset + RECORD.size + length
+        if stop > end or zlib.crc32(self._map[offset + 4:stop]) != crc:
+            return None
+        text = self._map[offset + RECORD.size:stop].decode("utf-8", errors="replace")
+        return {"id": mid, "from": pid, "text": text, "ts": ts}, stop
+
+    def _build_index(self) -> None:
+        offset, expected = 0, self.first_id
+        while (entry := self._record_at(offset)) is not None and entry[0]["id"] == expected:
+            if (expected - self.first_id) % INDEX_INTERVAL == 0:
+                self._index_ids.append(expected)
+                self._index_offsets.append(offset)
+            offset = entry[1]
+            expected += 1
+        self.size = offset
+        self.count = expected - self.first_id
+        self._indexed = True
+
+    def read(self, start_id: int) -> list[dict]:
+        if self._map is None:
+            return []
+        if not self._indexed:
+            self._build_index()
+        if not self._index_ids:
+            return []
+        i = max(0, bisect.bisect_right(self._index_ids, start_id) - 1)
+        offset = self._index_offsets[i]
+        messages = []
+        while offset < self.size and (entry := self._record_at(offset)) is not None:
+            msg, offset = entry
+            if msg["id"] >= start_id:
+                messages.append(msg)
+        return messages
+
+
+class SegmentLog:
+    """ChatStorage backed by segment files in `directory` (see module docstring)."""
+    directory: str
+    _segments: list[Segment]
+    _first_ids: list[int]
+
+    def __init__(self, directory: str, *, segment_size: int = SEGMENT_SIZE, max_segments: int = MAX_SEGMENTS):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max(1, max_segments)
+        os.makedirs(directory, exist_ok=True)
+
+        first_ids = sorted(int(name[:-len(SUFFIX)]) for name in os.listdir(directory)
+                           if name.endswith(SUFFIX) and name[:-len(SUFFIX)].isdigit())
+        self._segments = [Segment(self._path(first_id), first_id) for first_id in first_ids]
+        for segment in self._segments[:-1]:
+            segment.open_sealed()
+        if self._segments:
+            self._segments[-1].open_active(segment_size)
+        else:
+            self._segments.append(self._create(0, segment_size))
+        self._first_ids = [s.first_id for s in self._segments]
+
+    def _path(self, first_id: int) -> str:
+        return os.path.join(self.directory, f"{first_id:020d}{SUFFIX}")
+
+    def _create(self, first_id: int, capacity: int) -> Segment:
+        segment = Segment(self._path(first_id), first_id)
+        segment.open_active(capacity)
+        return segment
+
+    @property
+    def _active(self) -> Segment:
+        return self._segments[-1]
+
+    # ChatStorage
+    def __len__(self) -> int:
+        return self.last_id() + 1 - self._first_ids[0]
+
+    def last_id(self) -> int:
+        return self._active.first_id + self._active.count - 1
+
+    def oldest_id(self) -> int | None:
+        return self._first_ids[0] if len(self) else None
+
+    def append(self, msg: dict) -> None:
+        record = _encode(msg)
+        if len(record) > self._active.writable:
+            self._roll(msg["id"], len(record))
+        self._active.append(record)
+
+    def _roll(self, first_id: int, needed: int) -> None:
+        capacity = max(self.segment_size, needed)
+        if self._active.count == 0:
+            # Nothing to seal; grow the empty segment instead
+            self._active.close()
+            self._active.open_active(capacity)
+            return
+        self._active.seal()
+        self._segments.append(self._create(first_id, capacity))
+        self._first_ids.append(first_id)
+        while len(self._segments) > self.max_segments:
+            oldest = self._segments.pop(0)
+            self._first_ids.pop(0)
+            oldest.close()
+            os.remove(oldest.path)
+
+    def read(self, start_id: int) -> list[dict]:
+        i = max(0, bisect.bisect_right(self._first_ids, start_id) - 1)
+        messages = []
+        for segment in self._segments[i:]:
+            messages += segment.read(start_id)
+        return messages
+
+    def close(self) -> None:
+        for segment in self._segments:
+            segment.close()
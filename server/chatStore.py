@@ -0,0 +1,165 @@
+import threading
+import time
+from contextlib import AbstractContextManager, nullcontext
+from typing import Callable, Protocol
+
+from server.metrics import Histogram, TimedLock
+
+DEFAULT_CAPACITY = 200
+MAX_TEXT_LENGTH = 256  # characters per chat message, checked by the server and OnlineManager
+
+
+class ChatStorage(Protocol):
+    """
+    Where ChatStore keeps messages. Ids are assigned by ChatStore and are
+    contiguous, so storages address messages by id and only ever drop the
+    oldest ones. Callers hold the ChatStore lock.
+    """
+    def __len__(self) -> int: ...
+    def last_id(self) -> int: ...               # -1 when nothing was ever stored
+    def oldest_id(self) -> int | None: ...      # None when empty
+    def append(self, msg: dict) -> None: ...
+    def read(self, start_id: int) -> list[dict]: ...  # messages with id >= start_id
+    def close(self) -> None: ...
+
+
+class RingBuffer:
+    """Fixed-capacity in-memory storage; the oldest message is overwritten when full."""
+    capacity: int
+    _buffer: list[dict | None]
+    _start: int
+    _count: int
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buffer = [None] * capacity
+        self._start = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _at(self, i: int) -> dict:
+        return self._buffer[(self._start + i) % self.capacity]
+
+    def last_id(self) -> int:
+        return self._at(self._count - 1)["id"] if self._count else -1
+
+    def oldest_id(self) -> int | None:
+        return self._at(0)["id"] if self._count else None
+
+    def append(self, msg: dict) -> None:
+        if self._count < self.capacity:
+            self._buffer[(self._start + self._count) % self.capacity] = msg
+            self._count += 1
+        else:
+            self._buffer[self._start] = msg
+            self._start = (self._start + 1) % self.capacity
+
+    def read(self, start_id: int) -> list[dict]:
+        # Ids are contiguous, so the position of start_id is known directly
+        first = max(0, start_id - self._at(0)["id"]) if self._count else 0
+        return [self._at(i) for i in range(first, self._count)]
+
+    def close(self) -> None:
+        pass
+
+
+class ChatStore:
+    """
+    Chat messages ordered by id, with long-poll waiting and change listeners.
+
+    Messages live in a ChatStorage: by default a RingBuffer of `capacity`
+    messages, or a persistent server.chatLog.SegmentLog. Ids are contiguous,
+    so `since` queries index the retained window directly and cost O(k) for
+    k returned messages. A cursor older than the window (or a read truncated
+    by `limit`) is reported with "gap": True so clients know messages were
+    skipped. `capacity` also caps the messages returned per read.
+    """
+    capacity: int
+    next_id: int
+    _lock: AbstractContextManager
+    _posted: threading.Condition | None
+    _storage: ChatStorage
+    _listeners: list[Callable[[], None]]
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, *, threadsafe: bool = True, lock_wait: Histogram | None = None,
+                 storage: ChatStorage | None = None):
+        if capacity < 1:
+            raise ValueError("chat capacity must be at least 1")
+        self.capacity = capacity
+        self._storage = storage if storage is not None else RingBuffer(capacity)
+        # A persistent storage resumes numbering after its newest message
+        self.next_id = self._storage.last_id() + 1
+        lock = threading.Lock()
+        self._lock = lock if threadsafe else nullcontext()
+        # Long-poll readers wait here for new messages (threaded servers only)
+        self._posted = threading.Condition(lock) if threadsafe else None
+        if threadsafe and lock_wait is not None:
+            self._lock = TimedLock(lock, lock_wait, ("chat",))
+        self._listeners = []
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        self._listeners.append(callback)
+
+    def __len__(self) -> int:
+        return len(self._storage)
+
+    def close(self) -> None:
+        with self._lock:
+            self._storage.close()
+
+    # Warm restarts (server.stateFile); a persistent storage needs neither
+    def export_state(self) -> dict:
+        with self._lock:
+            oldest = self._storage.oldest_id()
+            messages = self._storage.read(oldest) if oldest is not None else []
+            return {"next_id": self.next_id, "messages": messages}
+
+    def restore_state(self, state: dict) -> None:
+        # Loads export_state() output into an empty store; ids continue where they left off
+        with self._lock:
+            if len(self._storage) or self.next_id:
+                raise ValueError("chat already has messages")
+            for msg in state["messages"]:
+                self._storage.append(msg)
+            self.next_id = state["next_id"]
+
+    # API
+    def append(self, pid: int, text: str) -> dict:
+        with self._lock:
+            msg = {"id": self.next_id, "from": pid, "text": text, "ts": time.time()}
+            self._storage.append(msg)
+            self.next_id += 1
+            if self._posted is not None:
+                self._posted.notify_all()
+        for callback in self._listeners:
+            callback()
+        return msg
+
+    def has_newer(self, since: int) -> bool:
+        return self.next_id - 1 > since
+
+    def wait(self, since: int, timeout: float) -> bool:
+        # Blocks until a message newer than `since` exists; no-op without locking
+        if self._posted is None:
+            return self.has_newer(since)
+        with self._posted:
+            return self._posted.wait_for(lambda: self.has_newer(since), timeout=timeout)
+
+    def since(self, since: int, limit: int) -> dict:
+        with self._lock:
+            oldest = self._storage.oldest_id()
+            if oldest is None:
+                oldest = self.next_id
+            first = max(since + 1, oldest)
+            # The newest `limit` messages after the cursor
+            start = max(first, self.next_id - limit)
+            messages = self._storage.read(start) if start < self.next_id else []
+            first_returned = messages[0]["id"] if messages else self.next_id
+        # Messages between the cursor and the first returned one were dropped or skipped
+        gap = since < oldest - 1 or start > first
+        result = {"messages": messages, "gap": gap}
+        if gap:
+            result["oldest"] = first_returned
+        return result
@@ -0,0 +1,103 @@
+"""
+Compact binary encoding of player state, shared by the server and OnlineManager.
+
+A message is a header, a table of the map names it references, fixed-size
+player records and the ids of removed players:
+
+    header   <2sBBqIIH  magic "MP", format version, flags (bit 0: full listing),
+                        world version, record count, removed count, map count
+    maps     per map: uint8 length + UTF-8 name
+    records  <IiiHBB    id, x and y in 1/QUANTIZE px, map index, direction, flags (bit 0: moving)
+    removed  <I per id
+
+A single position update is the same message with one record.
+"""
+
+import struct
+
+CONTENT_TYPE = "application/x-monster-players"
+FORMAT_VERSION = 1
+QUANTIZE = 4  # quarter-pixel precision
+
+HEADER = struct.Struct("<2sBBqIIH")
+RECORD = struct.Struct("<IiiHBB")
+REMOVED = struct.Struct("<I")
+MAGIC = b"MP"
+
+# Same order as src.utils.Direction
+DIRECTIONS = ("UP", "DOWN", "LEFT", "RIGHT", "NONE")
+_DIRECTION_INDEX = {name: i for i, name in enumerate(DIRECTIONS)}
+
+FLAG_FULL = 1
+FLAG_MOVING = 1
+_INT32_MIN, _INT32_MAX = -(1 << 31), (1 << 31) - 1
+
+
+def _quantize(value: float) -> int:
+    return max(_INT32_MIN, min(_INT32_MAX, round(value * QUANTIZE)))
+
+
+def encode_players(version: int, players: list[dict], removed: list[int], full: bool) -> bytes:
+    maps: dict[str, int] = {}
+    records = bytearray()
+    for p in players:
+        map_index = maps.setdefault(p["map"], len(maps))
+        records += RECORD.pack(
+            p["id"],
+            _quantize(p["x"]),
+            _quantize(p["y"]),
+            map_index,
+            _DIRECTION_INDEX.get(p["direction"], 1),
+            FLAG_MOVING if p["moving"] else 0,
+        )
+    parts = [HEADER.pack(MAGIC, FORMAT_VERSION, FLAG_FULL if full else 0, version, len(players), len(removed), len(maps))]
+    for name in maps:
+        raw = name.encode("utf-8")[:255]
+        parts.append(bytes((len(raw),)) + raw)
+    parts.append(bytes(records))
+    parts.extend(REMOVED.pack(pid) for pid in removed)
+    return b"".join(parts)
+
+
+def decode_players(data: bytes) -> dict:
+    """Inverse of encode_players; returns the same shape as the JSON /players?since= response."""
+    magic, fmt, flags, version, count, removed_count, map_count = HEADER.unpack_from(data)
+    if magic != MAGIC or fmt != FORMAT_VERSION:
+        raise ValueError("not a player state message")
+    offset = HEADER.size
+    maps = []
+    for _ in range(map_count):
+        length = data[offset]
+        maps.append(data[offset + 1:offset + 1 + length].decode("utf-8", errors="replace"))
+        offset += 1 + length
+
+    end = offset + count * RECORD.size
+    players = {}
+    for pid, x, y, map_index, direction, pflags in RECORD.iter_unpack(data[offset:end]):
+        players[pid] = {
+            "id": pid,
+            "x": x / QUANTIZE,
+            "y": y / QUANTIZE,
+            "map": maps[map_index],
+            "direction": DIRECTIONS[direction],
+            "moving": bool(pflags & FLAG_MOVING),
+        }
+    removed = [pid for (pid,) in REMOVED.iter_unpack(data[end:end + removed_count * REMOVED.size])]
+    return {"version": version, "players": players, "removed": removed, "full": bool(flags & FLAG_FULL)}
+
+
+def encode_listing(result: dict) -> bytes:
+    # Encodes a PlayerHandler listing ({"version", "players", "removed", "full"})
+    return encode_players(result["version"], list(result["players"].values()), result["removed"], result["full"])
+
+
+def encode_update(pid: int, x: float, y: float, map_name: str, direction: str, moving: bool) -> bytes:
+    player = {"id": pid, "x": x, "y": y, "map": map_name, "direction": direction, "moving": moving}
+    return encode_players(0, [player], [], False)
+
+
+def decode_update(data: bytes) -> dict:
+    players = decode_players(data)["players"]
+    if len(players) != 1:
+        raise ValueError("update must carry exactly one player")
+    return next(iter(players.values()))
@@ -0,0 +1,87 @@
+"""
+Server-side collision grids built from the TMX maps, without pygame or pytmx.
+
+Tiles are blocked by the same layers Map._create_collision_map uses: visible
+tile layers whose name contains "collision" or "house", wherever gid != 0.
+Each map becomes one bit per tile, so checking a position is a single lookup.
+Positions are the top-left of the player's TILE_SIZE hitbox; the client never
+lets that box overlap a blocked tile, so its centre tile must be walkable.
+"""
+
+import base64
+import gzip
+import os
+import xml.etree.ElementTree as ET
+import zlib
+
+MAPS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "assets", "maps")
+TILE_SIZE = 64  # GameSettings.TILE_SIZE
+
+
+def _layer_gids(layer: ET.Element) -> list[int]:
+    data = layer.find("data")
+    if data is None:
+        return []
+    encoding = data.get("encoding")
+    if encoding == "csv":
+        return [int(v) for v in data.text.replace("\n", "").split(",") if v.strip()]
+    if encoding == "base64":
+        raw = base64.b64decode(data.text.strip())
+        compression = data.get("compression")
+        if compression == "zlib":
+            raw = zlib.decompress(raw)
+        elif compression == "gzip":
+            raw = gzip.decompress(raw)
+        return [int.from_bytes(raw[i:i + 4], "little") for i in range(0, len(raw), 4)]
+    # Plain XML <tile gid="..."/> elements
+    return [int(tile.get("gid", "0")) for tile in data.iter("tile")]
+
+
+class CollisionGrid:
+    """Blocked tiles of one map as a bit array, row-major."""
+    width: int
+    height: int
+    _bits: bytearray
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self._bits = bytearray((width * height + 7) // 8)
+
+    @classmethod
+    def from_tmx(cls, path: str) -> "CollisionGrid":
+        root = ET.parse(path).getroot()
+        grid = cls(int(root.get("width")), int(root.get("height")))
+        for layer in root.iter("layer"):
+            name = layer.get("name", "").lower()
+            if layer.get("visible", "1") == "0" or ("collision" not in name and "house" not in name):
+                continue
+            for i, gid in enumerate(_layer_gids(layer)[:grid.width * grid.height]):
+                if gid:
+                    grid._bits[i >> 3] |= 1 << (i & 7)
+        return grid
+
+    def blocked(self, tx: int, ty: int) -> bool:
+        # Tiles outside the map count as blocked
+        if not (0 <= tx < self.width and 0 <= ty < self.height):
+            return True
+        i = ty * self.width + tx
+        return bool(self._bits[i >> 3] & (1 << (i & 7)))
+
+    def walkable(self, x: float, y: float) -> bool:
+        # `x`, `y`: top-left of the player's hitbox in pixels
+        return not self.blocked(int((x + TILE_SIZE / 2) // TILE_SIZE), int((y + TILE_SIZE / 2) // TILE_SIZE))
+
+
+class CollisionIndex:
+    """CollisionGrid for every .tmx map in `directory`, keyed by file name (as sent in updates)."""
+    grids: dict[str, CollisionGrid]
+
+    def __init__(self, directory: str = MAPS_DIR):
+        self.grids = {name: CollisionGrid.from_tmx(os.path.join(directory, name))
+                      for name in sorted(os.listdir(directory)) if name.endswith(".tmx")}
+
+    def walkable(self, map_name: str, x: float, y: float) -> bool:
+        # Unknown maps have no walkable tiles
+        grid = self.grids.get(map_name)
+        return grid is not None and grid.walkable(x, y)
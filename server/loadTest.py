@@ -0,0 +1,338 @@
+"""
+Headless load generator for server.py.
+
+Simulates many OnlineManager clients from one asyncio event loop and reports
+throughput, p50/p99 latency and error rate per endpoint:
+
+    python -m server.loadTest --clients 500 --duration 60
+
+Each client registers, random-walks at 10 Hz over the walkable tiles of
+--map (assets/maps) sending POST /players, polls
+GET /players with the same since/near/radius parameters as OnlineManager,
+posts chat now and then and keeps one GET /chat long-poll open. With --sync
+the position, player and chat traffic goes through POST /sync instead.
+Runs are repeatable for a given --seed; --json writes the report for
+comparing against a baseline.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from urllib.parse import urlencode, urlparse
+
+from server import codec
+from server.collision import MAPS_DIR, TILE_SIZE, CollisionGrid
+
+# Mirrors src.core.managers.online_manager (not imported: it pulls in pygame)
+UPDATE_INTERVAL = 0.1
+POLL_INTERVAL = 0.4
+CHAT_WAIT = 20.0
+AOI_RADIUS = 1024
+
+WALK_SPEED = 200.0  # px per second
+MAP_SIZE = 64 * 64  # random walks stay inside a 64x64-tile map when --map is not in assets/maps
+DIRECTIONS = ("UP", "DOWN", "LEFT", "RIGHT")
+
+
+@dataclass
+class EndpointStats:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+    def record(self, seconds: float, ok: bool) -> None:
+        self.latencies.append(seconds)
+        if not ok:
+            self.errors += 1
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class HttpConnection:
+    """
+    Minimal HTTP/1.1 client over one asyncio stream. Reuses the connection
+    while the server keeps it alive (the --async server) and reconnects when
+    it closes it (the threaded server speaks HTTP/1.0).
+    """
+    def __init__(self, host: str, port: int, timeout: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def request(self, method: str, path: str, body: bytes = b"",
+                      headers: dict[str, str] | None = None) -> tuple[int, dict[str, str], bytes]:
+        try:
+            return await asyncio.wait_for(self._request(method, path, body, headers or {}), self.timeout)
+        except BaseException:
+            self.close()
+            raise
+
+    async def _request(self, method: str, path: str, body: bytes, headers: dict[str, str]):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        reader, writer = self._reader, self._writer
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(body)}"]
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed")
+        version, status = status_line.decode("latin-1").split(" ", 2)[:2]
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            response_headers[key.strip().lower()] = value.strip()
+        data = await reader.readexactly(int(response_headers.get("content-length", "0")))
+        if version == "HTTP/1.0" or response_headers.get("connection", "").lower() == "close":
+            self.close()
+        return int(status), response_headers, data
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        url = urlparse(args.url)
+        self.host = url.hostname or "localhost"
+        self.port = url.port or 80
+        self.args = args
+        self.stats: dict[str, EndpointStats] = {}
+        self.rng = random.Random(args.seed)
+        self.stopping = False
+        # Walks avoid blocked tiles, which the server rejects
+        path = os.path.join(MAPS_DIR, args.map)
+        self.grid = CollisionGrid.from_tmx(path) if os.path.exists(path) else None
+        self.open_tiles = [] if self.grid is None else [
+            (tx, ty) for ty in range(self.grid.height) for tx in range(self.grid.width) if not self.grid.blocked(tx, ty)]
+
+    async def timed(self, conn: HttpConnection, endpoint: str, method: str, path: str,
+                    body: bytes = b"", headers: dict[str, str] | None = None) -> tuple[int, dict, bytes] | None:
+        started = time.perf_counter()
+        try:
+            status, response_headers, data = await conn.request(method, path, body, headers)
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            if not self.stopping:
+                self.stats.setdefault(endpoint, EndpointStats()).record(time.perf_counter() - started, False)
+            return None
+        self.stats.setdefault(endpoint, EndpointStats()).record(time.perf_counter() - started, status < 400)
+        return (status, response_headers, data) if status < 400 else None
+
+    async def run(self) -> None:
+        tasks = []
+        for _ in range(self.args.clients):
+            tasks.append(asyncio.create_task(self.client(random.Random(self.rng.random()))))
+            if self.args.ramp > 0:
+                await asyncio.sleep(self.args.ramp / self.args.clients)
+        # Only steady-state traffic is measured
+        self.stats = {}
+        self.started = time.monotonic()
+        await asyncio.sleep(self.args.duration)
+        self.elapsed = time.monotonic() - self.started
+        # Loops also check `stopping`: wait_for can swallow a cancel that races a response
+        self.stopping = True
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def client(self, rng: random.Random) -> None:
+        conns = [HttpConnection(self.host, self.port, self.args.timeout) for _ in range(3)]
+        try:
+            await self._client(rng, *conns)
+        finally:
+            for conn in conns:
+                conn.close()
+
+    async def _client(self, rng: random.Random, send: HttpConnection, poll: HttpConnection,
+                      chat: HttpConnection) -> None:
+        result = await self.timed(send, "GET /register", "GET", "/register")
+        while result is None and not self.stopping:
+            await asyncio.sleep(1.0)
+            result = await self.timed(send, "GET /register", "GET", "/register")
+        if result is None:
+            return
+        pid = json.loads(result[2])["id"]
+        if self.open_tiles:
+            tx, ty = rng.choice(self.open_tiles)
+            walker = {"x": float(tx * TILE_SIZE), "y": float(ty * TILE_SIZE), "direction": rng.choice(DIRECTIONS)}
+        else:
+            walker = {"x": rng.uniform(0, MAP_SIZE), "y": rng.uniform(0, MAP_SIZE), "direction": rng.choice(DIRECTIONS)}
+        cursors = {"world": -1, "chat": -1}
+
+        if self.args.sync:
+            await self._sync_loop(rng, pid, walker, cursors, send)
+            return
+        background = [asyncio.create_task(self._poll_loop(pid, cursors, poll))]
+        if not self.args.no_chat_poll:
+            background.append(asyncio.create_task(self._chat_loop(cursors, chat)))
+        try:
+            await self._walk_loop(rng, pid, walker, send)
+        finally:
+            for task in background:
+                task.cancel()
+
+    def _step(self, rng: random.Random, walker: dict) -> None:
+        if rng.random() < 0.05:
+            walker["direction"] = rng.choice(DIRECTIONS)
+        dx, dy = {"UP": (0, -1), "DOWN": (0, 1), "LEFT": (-1, 0), "RIGHT": (1, 0)}[walker["direction"]]
+        step = WALK_SPEED * UPDATE_INTERVAL
+        if self.grid is not None:
+            x, y = walker["x"] + dx * step, walker["y"] + dy * step
+            if self.grid.walkable(x, y):
+                walker["x"], walker["y"] = x, y
+            else:
+                walker["direction"] = rng.choice(DIRECTIONS)
+            return
+        walker["x"] = min(MAP_SIZE, max(0.0, walker["x"] + dx * step))
+        walker["y"] = min(MAP_SIZE, max(0.0, walker["y"] + dy * step))
+
+    async def _tick(self, started: float) -> None:
+        await asyncio.sleep(max(0.0, UPDATE_INTERVAL - (time.monotonic() - started)))
+
+    async def _walk_loop(self, rng: random.Random, pid: int, walker: dict, send: HttpConnection) -> None:
+        while not self.stopping:
+            started = time.monotonic()
+            self._step(rng, walker)
+            if self.args.binary:
+                body = codec.encode_update(pid, walker["x"], walker["y"], self.args.map, walker["direction"], True)
+                headers = {"Content-Type": codec.CONTENT_TYPE}
+            else:
+                body = json.dumps({"id": pid, "x": walker["x"], "y": walker["y"], "map": self.args.map,
+                                   "direction": walker["direction"], "moving": True}).encode("utf-8")
+                headers = {"Content-Type": "application/json"}
+            await self.timed(send, "POST /players", "POST", "/players", body, headers)
+            if rng.random() < self.args.chat_rate * UPDATE_INTERVAL:
+                body = json.dumps({"id": pid, "text": f"load test {rng.randrange(1 << 16)}"}).encode("utf-8")
+                await self.timed(send, "POST /chat", "POST", "/chat", body, {"Content-Type": "application/json"})
+            await self._tick(started)
+
+    async def _poll_loop(self, pid: int, cursors: dict, poll: HttpConnection) -> None:
+        while not self.stopping:
+            await asyncio.sleep(POLL_INTERVAL)
+            params = {"since": cursors["world"]}
+            if self.args.radius > 0:
+                params.update(near=pid, radius=self.args.radius)
+            headers = {"Accept": f"{codec.CONTENT_TYPE}, application/json"} if self.args.binary else None
+            result = await self.timed(poll, "GET /players", "GET", "/players?" + urlencode(params), headers=headers)
+            if result is None:
+                continue
+            _, response_headers, data = result
+            if response_headers.get("content-type", "").startswith(codec.CONTENT_TYPE):
+                cursors["world"] = codec.decode_players(data)["version"]
+            else:
+                cursors["world"] = json.loads(data).get("version", -1)
+
+    async def _chat_loop(self, cursors: dict, chat: HttpConnection) -> None:
+        # Long-poll latency mostly measures the wait, so it is reported separately
+        chat.timeout = CHAT_WAIT + self.args.timeout
+        while not self.stopping:
+            path = "/chat?" + urlencode({"since": cursors["chat"], "limit": 50, "wait": CHAT_WAIT})
+            result = await self.timed(chat, "GET /chat (long-poll)", "GET", path)
+            if result is None:
+                await asyncio.sleep(1.0)
+                continue
+            messages = json.loads(result[2]).get("messages", [])
+            if messages:
+                cursors["chat"] = messages[-1]["id"]
+
+    async def _sync_loop(self, rng: random.Random, pid: int, walker: dict, cursors: dict,
+                         send: HttpConnection) -> None:
+        while not self.stopping:
+            started = time.monotonic()
+            self._step(rng, walker)
+            body = {"id": pid, "since": cursors["world"], "chat_since": cursors["chat"],
+                    "x": walker["x"], "y": walker["y"], "map": self.args.map,
+                    "direction": walker["direction"], "moving": True}
+            if self.args.radius > 0:
+                body["radius"] = self.args.radius
+            if rng.random() < self.args.chat_rate * UPDATE_INTERVAL:
+                body["chat"] = [f"load test {rng.randrange(1 << 16)}"]
+            result = await self.timed(send, "POST /sync", "POST", "/sync", json.dumps(body).encode("utf-8"),
+                                      {"Content-Type": "application/json"})
+            if result is not None:
+                data = json.loads(result[2])
+                cursors["world"] = data.get("version", -1)
+                if data.get("messages"):
+                    cursors["chat"] = data["messages"][-1]["id"]
+            await self._tick(started)
+
+    def report(self) -> dict:
+        return {
+            "clients": self.args.clients,
+            "duration": round(self.elapsed, 2),
+            "endpoints": {
+                name: {
+                    "requests": len(s.latencies),
+                    "rps": round(len(s.latencies) / self.elapsed, 1),
+                    "p50_ms": round(s.percentile(0.50) * 1000, 2),
+                    "p99_ms": round(s.percentile(0.99) * 1000, 2),
+                    "errors": s.errors,
+                    "error_rate": round(s.errors / len(s.latencies), 4) if s.latencies else 0.0,
+                }
+                for name, s in sorted(self.stats.items())
+            },
+        }
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['clients']} clients for {report['duration']} s")
+    print(f"{'endpoint':<24}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}{'err %':>8}")
+    for name, e in report["endpoints"].items():
+        print(f"{name:<24}{e['requests']:>10}{e['rps']:>10}{e['p50_ms']:>10}{e['p99_ms']:>10}"
+              f"{e['errors']:>8}{e['error_rate'] * 100:>8.2f}")
+
+
+def raise_file_limit(clients: int) -> None:
+    # Three connections per client; lift the soft descriptor limit where possible
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = clients * 3 + 64
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        limit = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monster Go server load generator")
+    parser.add_argument("--url", default="http://localhost:8989")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds measured after ramp-up")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which clients start")
+    parser.add_argument("--radius", type=int, default=AOI_RADIUS, help="AOI radius for player polls (0 = whole world)")
+    parser.add_argument("--chat-rate", type=float, default=0.05, help="chat messages per client per second")
+    parser.add_argument("--map", default="map.tmx")
+    parser.add_argument("--binary", action="store_true", help="use the binary player encoding")
+    parser.add_argument("--sync", action="store_true", help="drive everything through POST /sync")
+    parser.add_argument("--no-chat-poll", action="store_true", help="skip the GET /chat long-poll")
+    parser.add_argument("--timeout", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    raise_file_limit(args.clients)
+    test = LoadTest(args)
+    asyncio.run(test.run())
+    result = test.report()
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,157 @@
+import bisect
+import threading
+import time
+from contextlib import AbstractContextManager, nullcontext
+from typing import Callable
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Histogram upper bounds in seconds
+REQUEST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LOCK_BUCKETS = (0.000001, 0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0)
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...], lock: AbstractContextManager):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._lock = lock
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.label_names, k)} {v:g}" for k, v in values]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...], buckets: tuple[float, ...],
+                 lock: AbstractContextManager):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = lock
+        # labels -> [count per bucket (+Inf last), sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, labels: tuple = ()) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted((k, list(counts), total) for k, (counts, total) in self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    # Sampled from a callback when /metrics is rendered; `type` may be "counter"
+    # for totals that another object already keeps
+    def __init__(self, name: str, help: str, read: Callable[[], float], type: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.type = type
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", f"{self.name} {self.read():g}"]
+
+
+class Metrics:
+    """
+    In-process metrics registry, rendered in the Prometheus text format for
+    GET /metrics. With threadsafe=False (the asyncio server) metrics are
+    updated without locking.
+    """
+    def __init__(self, *, threadsafe: bool = True):
+        self._threadsafe = threadsafe
+        self._metrics: list[Counter | Histogram | Gauge] = []
+
+    def _lock(self) -> AbstractContextManager:
+        return threading.Lock() if self._threadsafe else nullcontext()
+
+    def counter(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, label_names, self._lock())
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, label_names: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = REQUEST_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, label_names, buckets, self._lock())
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, read: Callable[[], float], type: str = "gauge") -> Gauge:
+        metric = Gauge(name, help, read, type)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class TimedLock:
+    """
+    Wraps a threading.Lock and records how long blocking acquires waited.
+    Uncontended acquires are recorded as zero without reading the clock.
+    """
+    def __init__(self, lock: threading.Lock, histogram: Histogram, labels: tuple = ()):
+        self._lock = lock
+        self._histogram = histogram
+        self._labels = labels
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock.acquire(False):
+            self._histogram.observe(0.0, self._labels)
+            return True
+        if not blocking:
+            return False
+        started = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        self._histogram.observe(time.perf_counter() - started, self._labels)
+        return acquired
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *exc) -> None:
+        self._lock.release()
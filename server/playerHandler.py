@@ -1,52 +1,178 @@
+import heapq
+import math
 import threading
 import time
 import copy
+from collections import OrderedDict
+from contextlib import AbstractContextManager, nullcontext
 from dataclasses import dataclass
-from typing import Dict
+from itertools import chain
+from types import MappingProxyType
+from typing import Callable, Dict, Iterator, Mapping
+
+from server.codec import DIRECTIONS
+from server.collision import TILE_SIZE, CollisionIndex
+from server.metrics import Histogram, TimedLock
+from server.playerTable import DEFAULT_CAPACITY, MOVED, MOVING, PlayerTable, slot_of
 
 TIMEOUT_TIME = 60.0
-CHECK_INTERVAL_TIME = 10.0
-
-@dataclass
-class Player:
-    id: int
-    x: float
-    y: float
-    map: str
-    direction: str
-    moving: bool
-    last_update: float
-
-    def update(self, x: float, y: float, map: str, direction: str, moving: bool) -> None:
-        if x != self.x or y != self.y or map != self.map:
-            self.last_update = time.monotonic()
-        self.x = x
-        self.y = y
-        self.map = map
-        self.direction = direction
-        self.moving = moving
-
-    def is_inactive(self) -> bool:
-        now = time.monotonic()
-        return (now - self.last_update) >= TIMEOUT_TIME
+CHECK_INTERVAL_TIME = 10.0  # longest the cleaner sleeps when no expiry is due sooner
+MAX_TOMBSTONES = 1024  # removed ids remembered for delta queries
+CHUNK_SIZE = 8 * 64  # spatial grid cell: 8 tiles of 64 px
+PUBLISH_INTERVAL = 0.05  # readers see the player table at most this stale
+MAX_SPEED = 1.5 * 4 * TILE_SIZE  # px/s: the client's Player.speed with headroom
+MOVE_TOLERANCE = 2 * TILE_SIZE  # px beyond MAX_SPEED * elapsed (grid snapping, bunched packets)
+MAX_SPEED_WINDOW = 1.0  # s: idle time counts towards the speed allowance for at most this long
+BUCKETS = 64  # per BucketMap; a power of two
+
+
+class RejectedUpdate(ValueError):
+    """A position update that failed collision or speed validation."""
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason  # "blocked" or "too_fast"
+
+
+class BucketMap(Mapping):
+    """
+    Read-only mapping of player ids, split into BUCKETS dicts by the low bits
+    of the id. patched() returns a new map that shares every bucket without
+    changes, so publishing k changed players copies at most k buckets instead
+    of the whole table.
+    """
+    __slots__ = ("_buckets", "_len")
+
+    def __init__(self, buckets: tuple[dict, ...] | None = None, length: int = 0):
+        self._buckets = buckets if buckets is not None else tuple({} for _ in range(BUCKETS))
+        self._len = length
+
+    def __getitem__(self, pid: int):
+        return self._buckets[pid & (BUCKETS - 1)][pid]
+
+    def __iter__(self) -> Iterator[int]:
+        return chain.from_iterable(self._buckets)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def items(self):
+        return chain.from_iterable(bucket.items() for bucket in self._buckets)
+
+    def values(self):
+        return chain.from_iterable(bucket.values() for bucket in self._buckets)
+
+    def patched(self, changes: Mapping[int, object]) -> "BucketMap":
+        # A copy with `changes` applied; a value of None removes the id
+        buckets = list(self._buckets)
+        copied = set()
+        length = self._len
+        for pid, value in changes.items():
+            i = pid & (BUCKETS - 1)
+            if i not in copied:
+                buckets[i] = dict(buckets[i])
+                copied.add(i)
+            bucket = buckets[i]
+            if value is None:
+                if bucket.pop(pid, None) is not None:
+                    length -= 1
+            else:
+                if pid not in bucket:
+                    length += 1
+                bucket[pid] = value
+        return BucketMap(tuple(buckets), length)
+
+
+@dataclass(frozen=True)
+class WorldSnapshot:
+    """
+    Immutable view of the player table published by PlayerHandler.
+    Readers grab the current snapshot without locking; nothing in it is
+    mutated after publication.
+    """
+    version: int
+    created: float
+    players: Mapping[int, dict]          # pid -> wire dict
+    versions: Mapping[int, int]          # pid -> version of last change
+    removed: Mapping[int, int]           # pid -> version it was removed at
+    removed_floor: int
+    grid: Mapping[str, Mapping[tuple[int, int], tuple[int, ...]]]
+
+
+EMPTY_SNAPSHOT = WorldSnapshot(0, 0.0, BucketMap(), BucketMap(), BucketMap(), 0, MappingProxyType({}))
 
 
 class PlayerHandler:
-    _lock: threading.Lock
+    _lock: AbstractContextManager
     _stop_event: threading.Event
     _thread: threading.Thread | None
-    
-    players: Dict[int, Player]
-    _next_id: int
+    _listeners: list[Callable[[], None]]
 
-    def __init__(self, *, timeout_seconds: float = 60.0, check_interval_seconds: float = 5.0):
-        self._lock = threading.Lock()
+    table: PlayerTable
+    _version: int
+    _removed: OrderedDict[int, int]
+    _removed_changes: Dict[int, int | None]
+    _removed_floor: int
+    _grid: Dict[str, Dict[tuple[int, int], set[int]]]
+    _cells: Dict[int, tuple[str, int, int]]
+    _dirty_cells: set[tuple[str, int, int]]
+    _snapshot: WorldSnapshot
+    _pending: set[int]
+    _expiry: list[tuple[float, int, int]]
+    _expiry_tags: int
+    _inbox: Dict[int, tuple[float, float, str, str, bool, float, int]]
+
+    def __init__(self, *, timeout_seconds: float = 60.0, check_interval_seconds: float = 5.0, threadsafe: bool = True,
+                 lock_wait: Histogram | None = None, sweep_time: Histogram | None = None,
+                 collision: CollisionIndex | None = None, capacity: int = DEFAULT_CAPACITY,
+                 tick_rate: float = 0.0, tick_time: Histogram | None = None):
+        # Single-threaded users (the asyncio server) skip locking entirely
+        self._threadsafe = threadsafe
+        self._lock = threading.Lock() if threadsafe else nullcontext()
+        if threadsafe and lock_wait is not None:
+            self._lock = TimedLock(self._lock, lock_wait, ("player",))
+        self._sweep_time = sweep_time
+        # With a collision index, update() rejects positions on blocked tiles and implausible jumps
+        self.collision = collision
         self._stop_event = threading.Event()
         self._thread = None
-        
-        self.players = {}
-        self._next_id = 0
-        
+        self._ticker_thread = None
+        self._listeners = []
+        # With a tick rate, update() only buffers the latest state of each player
+        # and tick() applies the buffer and publishes once per tick_interval. Entries
+        # carry the expiry tag of the player's stay, so tick() drops those of a
+        # player who left (or left and came back under the same id) meanwhile.
+        # Lock order: _lock, then _inbox_lock.
+        self.tick_interval = 1.0 / tick_rate if tick_rate > 0 else 0.0
+        self._tick_time = tick_time
+        self._inbox = {}
+        self._inbox_lock: AbstractContextManager = threading.Lock() if threadsafe else nullcontext()
+
+        # Parallel arrays of player state; ids are recycled slots (see server/playerTable.py)
+        self.table = PlayerTable(capacity)
+        # Monotonic world version, bumped on every join, visible change or leave
+        self._version = 0
+        # Tombstones in the order they were made, which is version order
+        self._removed = OrderedDict()
+        self._removed_floor = 0
+        # Tombstones made (pid -> version) or dropped (pid -> None) since the last publish
+        self._removed_changes = {}
+        # Per-map uniform grid of player ids, keyed by chunk; cells changed since
+        # the last publish are re-snapshotted then
+        self._grid = {}
+        self._cells = {}
+        self._dirty_cells = set()
+        # Copy-on-write snapshot for readers, patched with the ids changed since
+        self._snapshot = EMPTY_SNAPSHOT
+        self._pending = set()
+        # Lazy-deletion min-heap of (last_update when pushed, tag, pid), one live
+        # entry per player. Updates never touch it; an entry that comes due for a
+        # player who moved since is re-pushed with the newer time instead of
+        # evicting. Every insertion gets a new tag, stored in table.expiry_tag, so
+        # entries of removed players and of earlier stays of a re-added id are
+        # dropped when they come due instead of re-pushed.
+        self._expiry = []
+        self._expiry_tags = 0
+
     # Threading
     def start(self) -> None:
         if self._thread and self._thread.is_alive():
@@ -54,50 +180,444 @@ class PlayerHandler:
         self._stop_event.clear()
         self._thread = threading.Thread(target=self._cleaner, name="PlayerCleaner", daemon=True)
         self._thread.start()
+        if self.tick_interval:
+            self._ticker_thread = threading.Thread(target=self._ticker, name="PlayerTicker", daemon=True)
+            self._ticker_thread.start()
 
     def stop(self) -> None:
         self._stop_event.set()
-        if self._thread:
-            self._thread.join(timeout=2.0)
+        for thread in (self._thread, self._ticker_thread):
+            if thread:
+                thread.join(timeout=2.0)
+
+    def _ticker(self) -> None:
+        # Ticks on a fixed schedule; after a stall it skips the missed ticks
+        next_tick = time.monotonic() + self.tick_interval
+        while not self._stop_event.wait(max(0.0, next_tick - time.monotonic())):
+            self.tick()
+            next_tick = max(next_tick + self.tick_interval, time.monotonic())
 
     def _cleaner(self) -> None:
-        while not self._stop_event.wait(CHECK_INTERVAL_TIME):
-            now = time.monotonic()
-            to_remove: list[int] = []
-            with self._lock:
-                for pid, p in list(self.players.items()):
-                    if now - p.last_update >= TIMEOUT_TIME:
-                        to_remove.append(pid)
-                for pid in to_remove:
-                    _ = self.players.pop(pid, None)
-                    
+        while not self._stop_event.wait(self.next_expiry()):
+            self.sweep()
+
+    def next_expiry(self) -> float:
+        # Seconds until the earliest player could time out, capped at CHECK_INTERVAL_TIME.
+        # Players registered meanwhile are due at least TIMEOUT_TIME from now and
+        # never before the heap top, so sleeping this long misses nothing.
+        with self._lock:
+            if not self._expiry:
+                return min(CHECK_INTERVAL_TIME, TIMEOUT_TIME)
+            due = self._expiry[0][0] + TIMEOUT_TIME - time.monotonic()
+        return max(0.0, min(CHECK_INTERVAL_TIME, due))
+
+    def sweep(self) -> int:
+        # Removes players that timed out; returns how many were removed.
+        # Only heap entries that are due are examined: O(log n) each.
+        now = time.monotonic()
+        try:
+            return self._sweep(now)
+        finally:
+            if self._sweep_time is not None:
+                self._sweep_time.observe(time.monotonic() - now)
+
+    def _sweep(self, now: float) -> int:
+        removed = 0
+        with self._lock:
+            while self._expiry and self._expiry[0][0] + TIMEOUT_TIME <= now:
+                stamp, tag, pid = heapq.heappop(self._expiry)
+                slot = self.table.slot(pid)
+                if slot is None or self.table.expiry_tag[slot] != tag:
+                    continue
+                last_update = self.table.last_update[slot]
+                if last_update > stamp:
+                    heapq.heappush(self._expiry, (last_update, tag, pid))
+                    continue
+                self._delete(pid)
+                removed += 1
+            if removed:
+                self._publish()
+        if removed:
+            self._notify()
+        return removed
+
+    # Change notification (called outside the lock)
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        self._listeners.append(callback)
+
+    def _notify(self) -> None:
+        for callback in self._listeners:
+            callback()
+
+    # Versioning (caller holds the lock)
+    def _bump(self) -> int:
+        self._version += 1
+        return self._version
+
+    def _mark_removed(self, pid: int) -> None:
+        self._removed[pid] = self._removed_changes[pid] = self._bump()
+        self._removed.move_to_end(pid)
+        self._pending.add(pid)
+        if len(self._removed) > MAX_TOMBSTONES:
+            oldest, self._removed_floor = self._removed.popitem(last=False)
+            self._removed_changes[oldest] = None
+
+    def _delete(self, pid: int) -> bool:
+        if not self.table.delete(pid):
+            return False
+        self._unindex(pid)
+        self._mark_removed(pid)
+        return True
+
+    def _inserted(self, pid: int, displaced: int | None) -> None:
+        if displaced is not None:
+            self._unindex(displaced)
+            self._mark_removed(displaced)
+        if self._removed.pop(pid, None) is not None:
+            self._removed_changes[pid] = None
+        self._index(pid)
+        self._schedule(pid, self.table.last_update[slot_of(pid)])
+        # Publish immediately so the new id is visible to its own next request
+        self._pending.add(pid)
+        self._publish()
+
+    def _schedule(self, pid: int, last_update: float) -> None:
+        # Caller holds the lock. Gives `pid` a new expiry entry; older ones for its slot stop matching
+        self._expiry_tags += 1
+        self.table.expiry_tag[slot_of(pid)] = self._expiry_tags
+        heapq.heappush(self._expiry, (last_update, self._expiry_tags, pid))
+
+    # Spatial index (caller holds the lock)
+    def _index(self, pid: int) -> None:
+        t, slot = self.table, slot_of(pid)
+        cell = (t.map_name(slot), int(t.x[slot] // CHUNK_SIZE), int(t.y[slot] // CHUNK_SIZE))
+        old = self._cells.get(pid)
+        if old == cell:
+            return
+        if old is not None:
+            self._unindex(pid)
+        self._cells[pid] = cell
+        self._grid.setdefault(cell[0], {}).setdefault(cell[1:], set()).add(pid)
+        self._dirty_cells.add(cell)
+
+    def _unindex(self, pid: int) -> None:
+        cell = self._cells.pop(pid, None)
+        if cell is None:
+            return
+        self._dirty_cells.add(cell)
+        chunks = self._grid[cell[0]]
+        ids = chunks[cell[1:]]
+        ids.discard(pid)
+        if not ids:
+            del chunks[cell[1:]]
+            if not chunks:
+                del self._grid[cell[0]]
+
+    # Snapshots
+    def _publish(self) -> WorldSnapshot:
+        # Caller holds the lock. Patches the previous snapshot with the players,
+        # tombstones and grid cells changed since; everything else is shared with it.
+        prev = self._snapshot
+        t = self.table
+        players, versions = {}, {}
+        for pid in self._pending:
+            slot = t.slot(pid)
+            if slot is None:
+                players[pid] = versions[pid] = None
+            else:
+                players[pid] = t.to_dict(pid, slot)
+                versions[pid] = t.version[slot]
+        self._pending = set()
+        removed = prev.removed.patched(self._removed_changes) if self._removed_changes else prev.removed
+        self._removed_changes = {}
+        self._snapshot = WorldSnapshot(
+            self._version, time.monotonic(),
+            prev.players.patched(players), prev.versions.patched(versions),
+            removed, self._removed_floor, self._patch_grid(prev.grid),
+        )
+        return self._snapshot
+
+    def _patch_grid(self, prev: Mapping[str, Mapping[tuple[int, int], tuple[int, ...]]]) -> Mapping:
+        # Caller holds the lock. `prev` with the dirty cells re-read from the live grid
+        if not self._dirty_cells:
+            return prev
+        grid = dict(prev)
+        changed: Dict[str, list[tuple[int, int]]] = {}
+        for map_name, cx, cy in self._dirty_cells:
+            changed.setdefault(map_name, []).append((cx, cy))
+        self._dirty_cells = set()
+        for map_name, cells in changed.items():
+            live = self._grid.get(map_name)
+            if live is None:
+                grid.pop(map_name, None)
+                continue
+            chunks = dict(grid.get(map_name, {}))
+            for cell in cells:
+                ids = live.get(cell)
+                if ids:
+                    chunks[cell] = tuple(ids)
+                else:
+                    chunks.pop(cell, None)
+            grid[map_name] = MappingProxyType(chunks)
+        return MappingProxyType(grid)
+
+    def _changed(self) -> None:
+        # Caller holds the lock; republish at a bounded rate (in tick mode, on the next tick)
+        if not self.tick_interval and time.monotonic() - self._snapshot.created >= PUBLISH_INTERVAL:
+            self._publish()
+
+    def snapshot(self) -> WorldSnapshot:
+        """
+        Current published snapshot, without blocking. If it is older than
+        PUBLISH_INTERVAL and has unpublished changes, the caller republishes
+        it when the write lock is free; otherwise it reads the older snapshot.
+        """
+        snap = self._snapshot
+        if self.tick_interval or not self._pending or time.monotonic() - snap.created < PUBLISH_INTERVAL:
+            return snap
+        if not self._threadsafe:
+            return self._publish()
+        if self._lock.acquire(blocking=False):
+            try:
+                return self._publish() if self._pending else self._snapshot
+            finally:
+                self._lock.release()
+        return snap
+
+    def has_unpublished(self) -> bool:
+        # Whether changes are waiting for the next publish (or tick)
+        return bool(self._pending) or bool(self._inbox)
+
     # API
+    @property
+    def version(self) -> int:
+        return self.snapshot().version
+
     def register(self) -> int:
         with self._lock:
-            pid = self._next_id
-            self._next_id += 1
-            self.players[pid] = Player(pid, 0.0, 0.0, "", "DOWN", False, time.monotonic())
-            return pid
+            pid, _ = self.table.insert(0.0, 0.0, "", "DOWN", False, time.monotonic(), self._bump())
+            self._inserted(pid, None)
+        self._notify()
+        return pid
+
+    def add(self, pid: int, x: float, y: float, map_name: str, direction: str, moving: bool) -> None:
+        # Inserts a player whose id was assigned elsewhere (a shard router handing them over)
+        with self._lock:
+            pid, displaced = self.table.insert(float(x), float(y), str(map_name), direction, moving,
+                                               time.monotonic(), self._bump(), pid)
+            self._inserted(pid, displaced)
+        self._notify()
+
+    def remove(self, pid: int) -> bool:
+        # Removes a player before they time out (handed over to another shard)
+        with self._lock:
+            if not self._delete(pid):
+                return False
+            self._publish()
+        self._notify()
+        return True
 
     def update(self, pid: int, x: float, y: float, map_name: str, direction: str, moving: bool) -> bool:
+        """
+        Applies a position update; False if `pid` is unknown. Raises RejectedUpdate
+        when a collision index is set and the position is on a blocked tile, or
+        is further from the last accepted one on the same map than MAX_SPEED
+        allows in the time since (at most MAX_SPEED_WINDOW). A map change
+        (teleport) skips the speed check.
+
+        In tick mode the update is only buffered, replacing any earlier one
+        from `pid` in the same tick. The speed check is made here against the
+        buffered update, so a rejection reaches the client right away too.
+        """
+        if self.collision is not None and not self.collision.walkable(map_name, x, y):
+            raise RejectedUpdate("blocked")
+        if self.tick_interval:
+            now = time.monotonic()
+            # The table is read under the lock, so the cleaner or tick() cannot free,
+            # recycle or rewrite the slot meanwhile
+            with self._lock:
+                t = self.table
+                slot = t.slot(pid)
+                if slot is None:
+                    return False
+                tag = t.expiry_tag[slot]
+                with self._inbox_lock:
+                    buffered = self._inbox.get(pid)
+                    if buffered is not None and buffered[6] == tag:
+                        self._check_speed(x, y, map_name, buffered[0], buffered[1], buffered[2], buffered[5], now)
+                    else:
+                        self._check_speed(x, y, map_name, t.x[slot], t.y[slot], t.map_name(slot),
+                                          t.accepted[slot], now)
+                    self._inbox[pid] = (float(x), float(y), str(map_name), direction, moving, now, tag)
+            return True
         with self._lock:
-            p = self.players.get(pid)
-            if not p:
+            changed = self._apply(pid, float(x), float(y), str(map_name), direction, moving, time.monotonic())
+            if changed is None:
                 return False
-            else:
-                p.update(float(x), float(y), str(map_name), direction, moving)
-                return True
+            if changed:
+                self._changed()
+        if changed:
+            self._notify()
+        return True
 
-    def list_players(self) -> dict:
+    def _check_speed(self, x: float, y: float, map_name: str, last_x: float, last_y: float, last_map: str,
+                     accepted: float, now: float) -> None:
+        # Raises RejectedUpdate("too_fast") if (x, y) is further from the last accepted
+        # position on the same map than walking allows. Elapsed time is measured from the
+        # last accepted update, moving or not, and capped so standing still saves nothing up.
+        if self.collision is None or map_name != last_map:
+            return
+        elapsed = min(now - accepted, MAX_SPEED_WINDOW)
+        if math.hypot(x - last_x, y - last_y) > MAX_SPEED * elapsed + MOVE_TOLERANCE:
+            raise RejectedUpdate("too_fast")
+
+    def _apply(self, pid: int, x: float, y: float, map_name: str, direction: str, moving: bool,
+               now: float, check: bool = True) -> bool | None:
+        # Caller holds the lock. Returns whether anything visible changed, None if
+        # `pid` is unknown; raises RejectedUpdate("too_fast") unless `check` is off.
+        t = self.table
+        slot = t.slot(pid)
+        if slot is None:
+            return None
+        if check:
+            self._check_speed(x, y, map_name, t.x[slot], t.y[slot], t.map_name(slot), t.accepted[slot], now)
+        t.accepted[slot] = now
+        result = t.set(slot, x, y, map_name, direction, moving)
+        if result & MOVED:
+            t.last_update[slot] = now
+            self._index(pid)
+        if result:
+            t.version[slot] = self._bump()
+            self._pending.add(pid)
+        return result != 0
+
+    def tick(self) -> int:
+        """
+        Applies the updates buffered since the last tick and publishes one
+        snapshot for every reader. Returns how many changed a player.
+        """
+        started = time.monotonic()
+        with self._inbox_lock:
+            inbox, self._inbox = self._inbox, {}
+        changed = 0
+        with self._lock:
+            t = self.table
+            for pid, (x, y, map_name, direction, moving, received, tag) in inbox.items():
+                slot = t.slot(pid)
+                if slot is None or t.expiry_tag[slot] != tag:
+                    continue  # buffered during an earlier stay of this id
+                # update() already checked the speed
+                changed += bool(self._apply(pid, x, y, map_name, direction, moving, received, check=False))
+            if self._pending:
+                self._publish()
+        if changed:
+            self._notify()
+        if self._tick_time is not None:
+            self._tick_time.observe(time.monotonic() - started)
+        return changed
+
+    # Warm restarts (server.stateFile)
+    def export_state(self) -> dict:
+        """
+        Everything needed to resume under the same ids and world version:
+        players as [id, x, y, map, direction, moving, idle seconds, version]
+        rows, the remembered removals and the slot generations. Buffered
+        tick-mode updates are applied first.
+        """
+        if self.tick_interval:
+            self.tick()
         with self._lock:
-            player_list = {}
-            for p in self.players.values():
-                player_list[p.id] = {
-                    "id": p.id,
-                    "x": p.x,
-                    "y": p.y,
-                    "map": p.map,
-                    "direction": p.direction,
-                    "moving": p.moving
-                }
-            return player_list
+            t, now = self.table, time.monotonic()
+            players = []
+            for pid in self._cells:
+                slot = slot_of(pid)
+                players.append([pid, t.x[slot], t.y[slot], t.map_name(slot), DIRECTIONS[t.direction[slot]],
+                                bool(t.flags[slot] & MOVING), now - t.last_update[slot], t.version[slot]])
+            return {
+                "version": self._version,
+                "players": players,
+                "removed": list(self._removed.items()),
+                "removed_floor": self._removed_floor,
+                "generations": t.ids.generations(),
+            }
+
+    def restore_state(self, state: dict) -> int:
+        """
+        Loads export_state() output into an empty handler and returns how many
+        players it restored. Idle times carry over, so the downtime does not
+        count towards TIMEOUT_TIME.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if len(self.table):
+                raise ValueError("players are already registered")
+            t = self.table
+            t.ids.load_generations(state.get("generations", []))
+            for pid, x, y, map_name, direction, moving, idle, version in state["players"]:
+                pid, _ = t.insert(float(x), float(y), map_name, direction, moving, now - idle, version, pid)
+                self._index(pid)
+                self._schedule(pid, now - idle)
+                self._pending.add(pid)
+            self._version = state["version"]
+            self._removed = OrderedDict(sorted(((int(pid), v) for pid, v in state.get("removed", [])),
+                                               key=lambda entry: entry[1]))
+            self._removed_floor = state.get("removed_floor", 0)
+            self._removed_changes = dict.fromkeys(self._snapshot.removed)
+            self._removed_changes.update(self._removed)
+            self._publish()
+        self._notify()
+        return len(self.table)
+
+    def list_players(self) -> dict:
+        return dict(self.snapshot().players)
+
+    def list_players_since(self, since: int, snap: WorldSnapshot | None = None) -> dict:
+        """
+        Players that joined or changed, and ids that left, after world version `since`.
+        Falls back to a full listing ("full": True) when the cursor is unknown or
+        older than the remembered removals. Reads `snap` if given.
+        """
+        snap = snap or self.snapshot()
+        if since < snap.removed_floor or since > snap.version:
+            return {
+                "version": snap.version,
+                "players": dict(snap.players),
+                "removed": [],
+                "full": True,
+            }
+        return {
+            "version": snap.version,
+            "players": {pid: p for pid, p in snap.players.items() if snap.versions[pid] > since},
+            "removed": [pid for pid, v in snap.removed.items() if v > since],
+            "full": False,
+        }
+
+    def list_players_near(self, pid: int, radius: float, since: int = -1) -> dict | None:
+        """
+        Players on the same map as `pid` within `radius` pixels, excluding `pid`.
+        The result is always a full listing of the area; when nothing in the world
+        changed since `since` it is empty with "full": False. Returns None if `pid`
+        is not registered.
+        """
+        snap = self.snapshot()
+        me = snap.players.get(pid)
+        if me is None:
+            return None
+        if since == snap.version:
+            return {"version": snap.version, "players": {}, "removed": [], "full": False}
+
+        chunks = snap.grid.get(me["map"], {})
+        mx, my = me["x"], me["y"]
+        r2 = radius * radius
+        min_cx, max_cx = math.floor((mx - radius) / CHUNK_SIZE), math.floor((mx + radius) / CHUNK_SIZE)
+        min_cy, max_cy = math.floor((my - radius) / CHUNK_SIZE), math.floor((my + radius) / CHUNK_SIZE)
+        nearby = {}
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                for other_id in chunks.get((cx, cy), ()):
+                    if other_id == pid:
+                        continue
+                    other = snap.players[other_id]
+                    if (other["x"] - mx) ** 2 + (other["y"] - my) ** 2 <= r2:
+                        nearby[other_id] = other
+        return {"version": snap.version, "players": nearby, "removed": [], "full": True}
@@ -0,0 +1,285 @@
+"""
+Struct-of-arrays storage for PlayerHandler.
+
+Player state lives in preallocated parallel arrays indexed by slot: x, y,
+map index, direction, flags, last move, last accepted update and version.
+Freed slots go on a free heap and the lowest is reused first, so memory is
+bounded by the peak number of concurrent players rather than by
+registrations. The arrays grow by doubling when every slot is taken. Map
+names are interned while some player is on them, so clients sending made-up
+map names cannot grow the table either.
+
+The arrays are the authoritative state. Published snapshots still hold one
+wire dict per player (to_dict), rebuilt only for players that changed.
+
+A player id is the slot tagged with a per-slot generation,
+`generation << SLOT_BITS | slot`, bumped whenever the slot is freed. A client
+still holding the id of a player that timed out therefore gets "not found"
+instead of moving whoever got the slot next. Ids stay below 2**31.
+"""
+
+import heapq
+from array import array
+
+from server.codec import DIRECTIONS
+
+SLOT_BITS = 20
+SLOT_MASK = (1 << SLOT_BITS) - 1
+GENERATION_MASK = (1 << (31 - SLOT_BITS)) - 1
+ID_LIMIT = 1 << 31  # every id is below this, so ids fit signed 32-bit fields
+DEFAULT_CAPACITY = 256
+
+# flags
+MOVING = 1
+LIVE = 2
+
+# set() results
+CHANGED = 1
+MOVED = 2
+
+_DIRECTION_INDEX = {name: i for i, name in enumerate(DIRECTIONS)}
+
+
+def slot_of(pid: int) -> int:
+    return pid & SLOT_MASK
+
+
+class IdAllocator:
+    """Generation-tagged ids over recycled slots (see module docstring)."""
+    _generation: array  # per slot, of the next id handed out
+    _owner: array  # per slot, the live id or -1
+    _free: list[int]  # min-heap of slots that were free when pushed
+    _queued: bytearray  # per slot, whether it is in _free
+    _live: int
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self._generation = array("H", bytes(2 * capacity))
+        self._owner = array("l", [-1]) * capacity
+        # claim() leaves its slot in the heap; allocate() skips slots taken meanwhile
+        self._free = list(range(capacity))
+        self._queued = bytearray(b"\x01") * capacity
+        self._live = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self._owner)
+
+    def _grow(self) -> None:
+        old = self.capacity
+        if old > SLOT_MASK:
+            raise OverflowError("player table is full")
+        new = min(2 * old, SLOT_MASK + 1)
+        self._generation.extend(array("H", bytes(2 * (new - old))))
+        self._owner.extend(array("l", [-1]) * (new - old))
+        # Larger than every slot in the heap, so appending keeps it a heap
+        self._free.extend(range(old, new))
+        self._queued.extend(b"\x01" * (new - old))
+
+    def allocate(self) -> int:
+        while True:
+            if not self._free:
+                self._grow()
+            slot = heapq.heappop(self._free)
+            self._queued[slot] = 0
+            if self._owner[slot] < 0:
+                break
+        pid = self._owner[slot] = self._generation[slot] << SLOT_BITS | slot
+        self._live += 1
+        return pid
+
+    def claim(self, pid: int) -> int | None:
+        """
+        Makes `pid` (allocated elsewhere, e.g. by a shard router) live and
+        returns the live id it displaced from the same slot, if any.
+        """
+        slot = slot_of(pid)
+        while slot >= self.capacity:
+            self._grow()
+        displaced = self._owner[slot]
+        if displaced == pid:
+            return None
+        if displaced < 0:
+            self._live += 1
+            displaced = None
+        self._generation[slot] = pid >> SLOT_BITS
+        self._owner[slot] = pid
+        return displaced
+
+    def release(self, pid: int) -> bool:
+        if not self.is_live(pid):
+            return False
+        slot = slot_of(pid)
+        self._owner[slot] = -1
+        self._generation[slot] = (self._generation[slot] + 1) & GENERATION_MASK
+        if not self._queued[slot]:
+            heapq.heappush(self._free, slot)
+            self._queued[slot] = 1
+        self._live -= 1
+        return True
+
+    def is_live(self, pid: int) -> bool:
+        slot = pid & SLOT_MASK
+        return slot < len(self._owner) and self._owner[slot] == pid >= 0
+
+    def generations(self) -> list[int]:
+        return self._generation.tolist()
+
+    def load_generations(self, generations: list[int]) -> None:
+        """
+        Restores the generations of free slots saved with generations(), so
+        ids handed out before a restart are not issued again after it.
+        """
+        while self.capacity < len(generations):
+            self._grow()
+        for slot, generation in enumerate(generations):
+            if self._owner[slot] < 0:
+                self._generation[slot] = generation & GENERATION_MASK
+
+    def __len__(self) -> int:
+        return self._live
+
+
+class PlayerTable:
+    """
+    Parallel arrays of player state, one entry per slot of `ids`. Map names
+    are interned and their index is recycled once no live player is on the
+    map; directions are stored as indexes into codec.DIRECTIONS (unknown
+    names are stored as "DOWN"). Free slots hold map index 0, "".
+    """
+    ids: IdAllocator
+    x: array
+    y: array
+    map: array
+    direction: array
+    flags: bytearray
+    last_update: array  # last move, for expiry
+    accepted: array  # last accepted update, for the speed check
+    version: array
+    expiry_tag: array  # tag of the current stay and its live expiry heap entry (PlayerHandler)
+    map_names: list[str]
+    _map_index: dict[str, int]
+    _map_refs: list[int]  # live players per map index
+    _free_maps: list[int]
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.ids = IdAllocator(capacity)
+        self.x = array("d", bytes(8 * capacity))
+        self.y = array("d", bytes(8 * capacity))
+        self.map = array("I", bytes(4 * capacity))
+        self.direction = array("B", bytes(capacity))
+        self.flags = bytearray(capacity)
+        self.last_update = array("d", bytes(8 * capacity))
+        self.accepted = array("d", bytes(8 * capacity))
+        self.version = array("q", bytes(8 * capacity))
+        self.expiry_tag = array("q", bytes(8 * capacity))
+        self.map_names = [""]
+        self._map_index = {"": 0}
+        self._map_refs = [0]
+        self._free_maps = []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _fit(self) -> None:
+        # Grows the columns after the allocator grew
+        missing = self.ids.capacity - len(self.flags)
+        if missing > 0:
+            for column in (self.x, self.y, self.map, self.direction, self.last_update, self.accepted,
+                           self.version, self.expiry_tag):
+                column.extend(array(column.typecode, bytes(column.itemsize * missing)))
+            self.flags.extend(bytes(missing))
+
+    def _map_id(self, name: str) -> int:
+        index = self._map_index.get(name)
+        if index is None:
+            if self._free_maps:
+                index = self._free_maps.pop()
+                self.map_names[index] = name
+            else:
+                index = len(self.map_names)
+                self.map_names.append(name)
+                self._map_refs.append(0)
+            self._map_index[name] = index
+        return index
+
+    def _move_map(self, slot: int, index: int) -> None:
+        # Points `slot` at map `index`, forgetting the old map name if nobody is left on it
+        old = self.map[slot]
+        self.map[slot] = index
+        if index:
+            self._map_refs[index] += 1
+        if old:
+            self._map_refs[old] -= 1
+            if not self._map_refs[old]:
+                del self._map_index[self.map_names[old]]
+                self._free_maps.append(old)
+
+    # Rows
+    def insert(self, x: float, y: float, map_name: str, direction: str, moving: bool, now: float, version: int,
+               pid: int | None = None) -> tuple[int, int | None]:
+        """
+        Adds a player under a new id, or under `pid` if given. Returns the id
+        and the id of a player displaced from the same slot (only possible
+        with `pid`), which the caller must treat as removed.
+        """
+        displaced = None
+        if pid is None:
+            pid = self.ids.allocate()
+        else:
+            displaced = self.ids.claim(pid)
+        self._fit()
+        slot = slot_of(pid)
+        self.flags[slot] = LIVE
+        self.set(slot, x, y, map_name, direction, moving)
+        self.last_update[slot] = self.accepted[slot] = now
+        self.version[slot] = version
+        return pid, displaced
+
+    def delete(self, pid: int) -> bool:
+        if not self.ids.release(pid):
+            return False
+        slot = slot_of(pid)
+        self.flags[slot] = 0
+        self._move_map(slot, 0)
+        return True
+
+    def slot(self, pid: int) -> int | None:
+        # Slot of a live player id, None for unknown, removed or recycled ids
+        return slot_of(pid) if self.ids.is_live(pid) else None
+
+    def set(self, slot: int, x: float, y: float, map_name: str, direction: str, moving: bool) -> int:
+        """
+        Writes a row. Returns 0 if nothing visible changed, CHANGED if only the
+        direction or moving flag did, CHANGED | MOVED if the position or map
+        did. last_update and accepted are left to the caller.
+        """
+        map_id = self._map_index.get(map_name)
+        if map_id is None:
+            map_id = self._map_id(map_name)
+        dir_id = _DIRECTION_INDEX.get(direction, 1)
+        flags = LIVE | MOVING if moving else LIVE
+        result = 0
+        if x != self.x[slot] or y != self.y[slot] or map_id != self.map[slot]:
+            self.x[slot] = x
+            self.y[slot] = y
+            if map_id != self.map[slot]:
+                self._move_map(slot, map_id)
+            result = CHANGED | MOVED
+        if dir_id != self.direction[slot] or flags != self.flags[slot]:
+            self.direction[slot] = dir_id
+            self.flags[slot] = flags
+            result |= CHANGED
+        return result
+
+    def map_name(self, slot: int) -> str:
+        return self.map_names[self.map[slot]]
+
+    def to_dict(self, pid: int, slot: int) -> dict:
+        return {
+            "id": pid,
+            "x": self.x[slot],
+            "y": self.y[slot],
+            "map": self.map_names[self.map[slot]],
+            "direction": DIRECTIONS[self.direction[slot]],
+            "moving": bool(self.flags[slot] & MOVING),
+        }
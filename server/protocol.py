@@ -0,0 +1,117 @@
+import json
+import struct
+
+from server import codec
+
+# Length-prefixed JSON frames used by the push channel (server and OnlineManager).
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 1 << 20
+
+
+def encode_frame(obj: object) -> bytes:
+    payload = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    _buffer: bytearray
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> list:
+        self._buffer += data
+        frames = []
+        while len(self._buffer) >= FRAME_HEADER.size:
+            (length,) = FRAME_HEADER.unpack_from(self._buffer)
+            if length > MAX_FRAME_SIZE:
+                raise ValueError(f"frame too large: {length} bytes")
+            end = FRAME_HEADER.size + length
+            if len(self._buffer) < end:
+                break
+            frames.append(json.loads(bytes(self._buffer[FRAME_HEADER.size:end]).decode("utf-8")))
+            del self._buffer[:end]
+        return frames
+
+
+# Datagrams used by the UDP channel: a fixed header and one message per datagram.
+DATAGRAM_HEADER = struct.Struct("<2sBIBB")  # magic, kind, sequence number, part, part count
+DATAGRAM_MAGIC = b"MD"
+MAX_DATAGRAM_SIZE = 1200  # stays below common path MTUs
+SEQ_MASK = 0xFFFFFFFF
+PLAYERS_PER_DATAGRAM = 64  # 14-byte records plus map names stay well under MAX_DATAGRAM_SIZE
+
+# Datagram kinds
+HELLO = 1     # client -> server: HELLO_PAYLOAD padded to MAX_DATAGRAM_SIZE, subscribes the sender to snapshots
+UPDATE = 2    # client -> server: codec.encode_update
+SNAPSHOT = 3  # server -> client: one part of a full codec player listing
+HELLO_PAYLOAD = struct.Struct("<If")  # player id, area-of-interest radius (0 = whole world)
+
+
+def encode_datagram(kind: int, seq: int, payload: bytes, part: int = 0, parts: int = 1) -> bytes:
+    return DATAGRAM_HEADER.pack(DATAGRAM_MAGIC, kind, seq & SEQ_MASK, part, parts) + payload
+
+
+def decode_datagram(data: bytes) -> tuple[int, int, int, int, bytes]:
+    # Returns (kind, seq, part, parts, payload)
+    if len(data) < DATAGRAM_HEADER.size:
+        raise ValueError("datagram too short")
+    magic, kind, seq, part, parts = DATAGRAM_HEADER.unpack_from(data)
+    if magic != DATAGRAM_MAGIC or part >= parts:
+        raise ValueError("not a game datagram")
+    return kind, seq, part, parts, data[DATAGRAM_HEADER.size:]
+
+
+def seq_newer(seq: int, last: int | None) -> bool:
+    # Serial number comparison, so the 32-bit counter can wrap around
+    if last is None:
+        return True
+    return 0 < ((seq - last) & SEQ_MASK) < (1 << 31)
+
+
+def encode_snapshot(seq: int, listing: dict) -> list[bytes]:
+    # Splits a full player listing into datagrams that share one sequence number
+    players = list(listing["players"].values())
+    chunks = [players[i:i + PLAYERS_PER_DATAGRAM] for i in range(0, len(players), PLAYERS_PER_DATAGRAM)] or [[]]
+    if len(chunks) > 255:
+        chunks = chunks[:255]  # the part count is one byte; larger worlds need an AOI radius
+    return [
+        encode_datagram(SNAPSHOT, seq, codec.encode_players(listing["version"], chunk, [], True), i, len(chunks))
+        for i, chunk in enumerate(chunks)
+    ]
+
+
+class SnapshotAssembler:
+    """
+    Reassembles multi-part snapshots on the receiving side. Only the newest
+    sequence number is kept; parts of older snapshots and late datagrams are
+    dropped, and a snapshot missing a part is simply superseded by the next.
+    """
+    _seq: int | None
+    _applied: int | None
+    _parts: dict[int, dict]
+
+    def __init__(self):
+        self._seq = None
+        self._applied = None
+        self._parts = {}
+
+    def feed(self, seq: int, part: int, parts: int, payload: bytes) -> dict | None:
+        # Returns the merged listing once every part of a new snapshot arrived
+        if not seq_newer(seq, self._applied):
+            return None
+        if seq != self._seq:
+            if self._seq is not None and not seq_newer(seq, self._seq):
+                return None
+            self._seq = seq
+            self._parts = {}
+        self._parts[part] = codec.decode_players(payload)
+        if len(self._parts) < parts:
+            return None
+        players = {}
+        for chunk in self._parts.values():
+            players.update(chunk["players"])
+        version = self._parts[0]["version"]
+        self._applied = seq
+        self._parts = {}
+        return {"version": version, "players": players, "removed": [], "full": True}
@@ -0,0 +1,252 @@
+import queue
+import socket
+import threading
+import time
+
+from server.app import MAX_AOI_RADIUS
+from server.playerHandler import PlayerHandler, WorldSnapshot
+from server.protocol import FrameDecoder, encode_frame
+
+PUSH_INTERVAL = 0.05  # at most 20 broadcasts per second
+HEARTBEAT_INTERVAL = 5.0
+SEND_TIMEOUT = 1.0
+SEND_QUEUE_SIZE = 32  # frames waiting for a connection's writer before it is dropped
+
+
+class PushConnection:
+    """
+    One push client. Frames are queued by send() and written by the
+    connection's own writer thread, so a slow client only delays itself; once
+    SEND_QUEUE_SIZE frames are waiting it is disconnected.
+    """
+    _queue: queue.Queue
+
+    def __init__(self, sock: socket.socket, addr):
+        self.sock = sock
+        self.addr = addr
+        self.player_id = -1
+        self.version = -1  # world version of the last snapshot or delta queued
+        self.radius = 0.0  # area of interest around the player; 0 = whole world
+        self.area: dict[int, dict] = {}  # with a radius: the players last sent
+        self.alive = True
+        self._queue = queue.Queue(SEND_QUEUE_SIZE)
+
+    def start(self) -> None:
+        threading.Thread(target=self._writer, name="PushWriter", daemon=True).start()
+
+    def send(self, frame: bytes) -> bool:
+        # Queues a frame without blocking; False if the connection is closed or too far behind
+        if not self.alive:
+            return False
+        try:
+            self._queue.put_nowait(frame)
+            return True
+        except queue.Full:
+            self.close()
+            return False
+
+    def _writer(self) -> None:
+        while True:
+            frame = self._queue.get()
+            if frame is None or not self.alive:
+                return
+            try:
+                self.sock.sendall(frame)
+            except OSError:
+                self.close()
+                return
+
+    def close(self) -> None:
+        self.alive = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        try:
+            self._queue.put_nowait(None)  # wakes the writer; a full queue fails its sendall instead
+        except queue.Full:
+            pass
+
+
+class PushServer:
+    """
+    Persistent server-push channel for player state.
+
+    Clients connect over TCP, send a {"type": "hello", "id": pid} frame and then
+    receive a full "snapshot" frame followed by "delta" frames whenever players
+    join, move or leave. Frames are length-prefixed JSON (see server.protocol).
+
+    A hello with "radius" limits the connection to players on the same map
+    within that many pixels of its player's current (server-side) position,
+    like GET /players?near=. Its deltas are computed against the area it was
+    last sent: players that entered or changed, and ids that left.
+
+    Each connection remembers the world version it was last sent, so a client
+    that attaches while a broadcast is going out still gets every change.
+    The broadcaster only queues frames (see PushConnection); a connection
+    whose write fails, times out or falls SEND_QUEUE_SIZE frames behind is
+    dropped.
+    """
+    _lock: threading.Lock
+    _wake: threading.Event
+    _stop_event: threading.Event
+    _connections: list[PushConnection]
+    _version: int
+
+    def __init__(self, player_handler: PlayerHandler, host: str, port: int):
+        self.player_handler = player_handler
+        self.host = host
+        self.port = port
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._connections = []
+        self._version = -1
+        self._sock: socket.socket | None = None
+
+        self.player_handler.add_listener(self._wake.set)
+
+    # Threading
+    def start(self) -> None:
+        self._sock = socket.create_server((self.host, self.port))
+        self._stop_event.clear()
+        threading.Thread(target=self._accept_loop, name="PushAccept", daemon=True).start()
+        threading.Thread(target=self._broadcast_loop, name="PushBroadcast", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._wake.set()
+        if self._sock:
+            self._sock.close()
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+    def _accept_loop(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                sock, addr = self._sock.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(SEND_TIMEOUT)
+            conn = PushConnection(sock, addr)
+            conn.start()
+            threading.Thread(target=self._reader, args=(conn,), name="PushReader", daemon=True).start()
+
+    def _reader(self, conn: PushConnection) -> None:
+        # The reader only handles the hello frame and notices disconnects;
+        # all outgoing traffic is queued by the broadcaster.
+        decoder = FrameDecoder()
+        attached = False
+        try:
+            while conn.alive:
+                try:
+                    data = conn.sock.recv(4096)
+                except socket.timeout:
+                    continue
+                if not data:
+                    break
+                for frame in decoder.feed(data):
+                    if not isinstance(frame, dict) or frame.get("type") != "hello" or attached:
+                        continue
+                    conn.player_id = int(frame.get("id", -1))
+                    radius = float(frame.get("radius") or 0.0)
+                    conn.radius = min(MAX_AOI_RADIUS, radius) if radius > 0 else 0.0
+                    attached = True
+                    self._attach(conn)
+        except (OSError, ValueError, TypeError):
+            pass
+        finally:
+            conn.close()
+            with self._lock:
+                if conn in self._connections:
+                    self._connections.remove(conn)
+
+    def _attach(self, conn: PushConnection) -> None:
+        # Changes newer than the snapshot go out with the connection's next delta
+        if conn.radius > 0:
+            snap = self.player_handler.snapshot()
+            frame, version = self._area_frame(conn, snap), snap.version
+        else:
+            listing = self.player_handler.list_players_since(-1)
+            frame, version = encode_frame({"type": "snapshot", **listing}), listing["version"]
+        if conn.send(frame):
+            conn.version = version
+            with self._lock:
+                self._connections.append(conn)
+
+    def _area_frame(self, conn: PushConnection, snap: WorldSnapshot) -> bytes | None:
+        """
+        Snapshot of the connection's area on the first call, afterwards a delta
+        against conn.area; None when the area did not change.
+        """
+        area = self.player_handler.list_players_near(conn.player_id, conn.radius)
+        players = area["players"] if area is not None else {}
+        if conn.version < 0:
+            conn.area = dict(players)
+            return encode_frame({"type": "snapshot", "version": snap.version, "players": players,
+                                 "removed": [], "full": True})
+        changed = {pid: p for pid, p in players.items() if conn.area.get(pid) != p}
+        removed = [pid for pid in conn.area if pid not in players]
+        if not changed and not removed:
+            return None
+        conn.area = dict(players)
+        return encode_frame({"type": "delta", "version": snap.version, "players": changed,
+                             "removed": removed, "full": False})
+
+    def _broadcast_loop(self) -> None:
+        last_heartbeat = time.monotonic()
+        while not self._stop_event.is_set():
+            self._wake.wait(HEARTBEAT_INTERVAL)
+            if self._stop_event.is_set():
+                return
+            self._wake.clear()
+            # Coalesce bursts of updates into one broadcast per interval; this also
+            # lets the player table snapshot catch up with the change that woke us.
+            if self._stop_event.wait(PUSH_INTERVAL):
+                return
+
+            snap = self.player_handler.snapshot()
+            if self.player_handler.has_unpublished():
+                # The change that woke us is not in `snap` yet; look again next interval
+                self._wake.set()
+            now = time.monotonic()
+            heartbeat = now - last_heartbeat >= HEARTBEAT_INTERVAL
+            if snap.version == self._version and not heartbeat:
+                continue
+            self._version = snap.version
+            last_heartbeat = now
+            self.broadcast(snap, heartbeat)
+
+    def broadcast(self, snap: WorldSnapshot, heartbeat: bool = False) -> None:
+        # Queues the frames that bring every connection up to `snap`
+        with self._lock:
+            connections = list(self._connections)
+        frames: dict[int, bytes] = {}  # connections at the same version share a frame
+        dead = []
+        for conn in connections:
+            if conn.version == snap.version:
+                frame = encode_frame({"type": "heartbeat"}) if heartbeat else None
+            elif conn.radius > 0:
+                frame = self._area_frame(conn, snap)
+                if frame is None:
+                    conn.version = snap.version
+                    frame = encode_frame({"type": "heartbeat"}) if heartbeat else None
+            else:
+                frame = frames.get(conn.version)
+                if frame is None:
+                    delta = self.player_handler.list_players_since(conn.version, snap)
+                    frame = frames[conn.version] = encode_frame(
+                        {"type": "snapshot" if delta["full"] else "delta", **delta})
+            if frame is None:
+                continue
+            if conn.send(frame):
+                conn.version = snap.version
+            else:
+                dead.append(conn)
+        if dead:
+            with self._lock:
+                self._connections = [c for c in self._connections if c not in dead]
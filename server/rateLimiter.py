@@ -0,0 +1,71 @@
+import threading
+import time
+from contextlib import AbstractContextManager, nullcontext
+
+# endpoint -> (tokens per second, burst). "players" covers POST /players and
+# /sync round-trips, "chat" each chat line from POST /chat or /sync.
+DEFAULT_LIMITS = {"players": (20.0, 40.0), "chat": (2.0, 5.0)}
+PRUNE_INTERVAL = 30.0
+
+
+def parse_limit(text: str) -> tuple[str, float, float]:
+    """Parses ENDPOINT=RATE[:BURST] from the command line; BURST defaults to 2 * RATE."""
+    endpoint, sep, spec = text.partition("=")
+    if not sep or endpoint not in DEFAULT_LIMITS:
+        raise ValueError(f"expected ENDPOINT=RATE[:BURST] with ENDPOINT one of {', '.join(DEFAULT_LIMITS)}, got {text!r}")
+    rate, _, burst = spec.partition(":")
+    rate = float(rate)
+    burst = float(burst) if burst else 2 * rate
+    if rate < 0 or (rate > 0 and burst < 1):
+        raise ValueError(f"bad rate limit {text!r}")
+    return endpoint, rate, burst
+
+
+class RateLimiter:
+    """
+    Token buckets per (endpoint, player id). Each bucket holds up to `burst`
+    tokens and refills at `rate` tokens per second; a request costs one token
+    per unit (an update, a chat line). A rate of 0 disables the limit for that
+    endpoint. Buckets of idle players are dropped once they would be full again.
+    """
+    limits: dict[str, tuple[float, float]]
+    _buckets: dict[tuple[str, int], list[float]]  # -> [tokens, time of last refill]
+
+    def __init__(self, limits: dict[str, tuple[float, float]] | None = None, *, threadsafe: bool = True):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self._buckets = {}
+        self._lock: AbstractContextManager = threading.Lock() if threadsafe else nullcontext()
+        self._last_prune = time.monotonic()
+
+    def acquire(self, endpoint: str, pid: int, cost: float = 1.0) -> float:
+        """
+        Takes `cost` tokens from the bucket of `pid` for `endpoint`. Returns 0 if
+        the request may proceed, otherwise the seconds until it would be allowed
+        (nothing is taken then).
+        """
+        rate, burst = self.limits.get(endpoint, (0.0, 0.0))
+        if rate <= 0:
+            return 0.0
+        cost = min(cost, burst)  # larger requests are allowed from a full bucket
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get((endpoint, pid))
+            if bucket is None:
+                bucket = self._buckets[(endpoint, pid)] = [burst, now]
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                retry_after = 0.0
+            else:
+                retry_after = (cost - bucket[0]) / rate
+            if now - self._last_prune >= PRUNE_INTERVAL:
+                self._prune(now)
+        return retry_after
+
+    def _prune(self, now: float) -> None:
+        self._last_prune = now
+        for key in [k for k, (tokens, stamp) in self._buckets.items()
+                    if tokens + (now - stamp) * self.limits[k[0]][0] >= self.limits[k[0]][1]]:
+            del self._buckets[key]
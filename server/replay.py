@@ -0,0 +1,192 @@
+"""
+Replays traffic recorded with server.py --capture against a server and
+compares what it answers with what the captured server answered:
+
+    python server.py --capture traffic.cap      # record, then stop with Ctrl-C
+    python server.py                            # fresh server, same options
+    python -m server.replay traffic.cap --speed 1
+
+Requests are re-issued with their captured method, target, headers and body,
+at the captured pace (--speed 1), N times faster (--speed N) or as fast as
+--concurrency connections allow (--speed 0). Whatever the speed, a request
+is only sent once every request that had finished before it arrived in the
+capture has finished again (a client's update never overtakes its own
+registration, say), so runs are repeatable. The report lists per endpoint
+how many responses differ in status or body (see server.capture.fingerprint)
+and the captured (server-side) against replayed (round-trip) latency.
+
+Player ids are handed out in registration order, so replay against a fresh
+server started with the same options to get the same ids back.
+"""
+
+import argparse
+import asyncio
+import bisect
+import json
+import time
+import zlib
+from dataclasses import dataclass, field
+from urllib.parse import parse_qs, urlparse
+
+from server.capture import CapturedRequest, decode_body, fingerprint, read_capture
+from server.loadTest import EndpointStats, HttpConnection, raise_file_limit
+
+MAX_EXAMPLES = 10
+
+
+def endpoint_of(request: CapturedRequest) -> str:
+    # Same grouping as the load test report: long-polls are timed apart
+    url = urlparse(request.target)
+    wait = parse_qs(url.query).get("wait", ["0"])[0]
+    poll = " (long-poll)" if url.path in ("/chat", "/battle") and wait not in ("", "0") else ""
+    return f"{request.method} {url.path}{poll}"
+
+
+@dataclass
+class ReplayStats:
+    captured: EndpointStats = field(default_factory=EndpointStats)
+    replayed: EndpointStats = field(default_factory=EndpointStats)
+    status_mismatches: int = 0
+    body_mismatches: int = 0
+
+
+class Replay:
+    def __init__(self, args: argparse.Namespace, requests: list[CapturedRequest]):
+        url = urlparse(args.url)
+        self.host = url.hostname or "localhost"
+        self.port = url.port or 80
+        self.args = args
+        self.requests = requests
+        self.stats: dict[str, ReplayStats] = {}
+        self.examples: list[dict] = []
+        self._idle: list[HttpConnection] = []
+        # Requests by captured completion time; a request waits for the prefix
+        # of this order that had completed when it arrived
+        self._by_completion = sorted(range(len(requests)), key=lambda i: requests[i].arrival + requests[i].latency)
+        self._completions = [requests[i].arrival + requests[i].latency for i in self._by_completion]
+        self._rank = {index: rank for rank, index in enumerate(self._by_completion)}
+        self._finished = bytearray(len(requests))
+        self._finished_prefix = 0
+        self._progress = asyncio.Event()
+
+    async def run(self) -> None:
+        limit = asyncio.Semaphore(self.args.concurrency)
+        tasks = []
+        self.started = time.monotonic()
+        for index, request in enumerate(self.requests):
+            if self.args.speed > 0:
+                delay = self.started + request.arrival / self.args.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            # Arrival order makes these prefixes grow, so waiting here holds back no independent request
+            needed = bisect.bisect_right(self._completions, request.arrival)
+            while self._finished_prefix < needed:
+                self._progress.clear()
+                await self._progress.wait()
+            await limit.acquire()
+            tasks.append(asyncio.create_task(self._send(index, request, limit)))
+        await asyncio.gather(*tasks)
+        self.elapsed = time.monotonic() - self.started
+
+    def _finish(self, index: int) -> None:
+        self._finished[self._rank[index]] = 1
+        while self._finished_prefix < len(self._finished) and self._finished[self._finished_prefix]:
+            self._finished_prefix += 1
+        self._progress.set()
+
+    async def _send(self, index: int, request: CapturedRequest, limit: asyncio.Semaphore) -> None:
+        try:
+            await self._exchange(request)
+        finally:
+            limit.release()
+            self._finish(index)
+
+    async def _exchange(self, request: CapturedRequest) -> None:
+        conn = self._idle.pop() if self._idle else HttpConnection(self.host, self.port, self.args.timeout)
+        stats = self.stats.setdefault(endpoint_of(request), ReplayStats())
+        stats.captured.record(request.latency, request.status < 500)
+        started = time.perf_counter()
+        try:
+            status, headers, data = await conn.request(request.method, request.target, request.body, request.headers)
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            stats.replayed.record(time.perf_counter() - started, False)
+            return
+        self._idle.append(conn)
+        stats.replayed.record(time.perf_counter() - started, status < 500)
+        try:
+            data = decode_body(data, headers.get("content-encoding"))
+        except (OSError, zlib.error):
+            pass
+        if status != request.status:
+            stats.status_mismatches += 1
+            self._example(request, status, "status")
+        elif fingerprint(data, headers.get("content-type", "")) != request.fingerprint:
+            stats.body_mismatches += 1
+            self._example(request, status, "body")
+
+    def _example(self, request: CapturedRequest, status: int, kind: str) -> None:
+        if len(self.examples) < MAX_EXAMPLES:
+            self.examples.append({"at": round(request.arrival, 3), "request": f"{request.method} {request.target}",
+                                  "mismatch": kind, "captured": request.status, "replayed": status})
+
+    def report(self) -> dict:
+        def ms(stats: EndpointStats, q: float) -> float:
+            return round(stats.percentile(q) * 1000, 2)
+
+        return {
+            "requests": len(self.requests),
+            "speed": self.args.speed,
+            "captured_duration": round(self.requests[-1].arrival if self.requests else 0.0, 2),
+            "duration": round(self.elapsed, 2),
+            "endpoints": {
+                name: {
+                    "requests": len(s.replayed.latencies),
+                    "status_mismatches": s.status_mismatches,
+                    "body_mismatches": s.body_mismatches,
+                    "errors": s.replayed.errors,
+                    "captured_p50_ms": ms(s.captured, 0.50),
+                    "captured_p99_ms": ms(s.captured, 0.99),
+                    "replayed_p50_ms": ms(s.replayed, 0.50),
+                    "replayed_p99_ms": ms(s.replayed, 0.99),
+                }
+                for name, s in sorted(self.stats.items())
+            },
+            "examples": self.examples,
+        }
+
+
+def print_report(report: dict) -> None:
+    speed = "max speed" if report["speed"] <= 0 else f"{report['speed']:g}x"
+    print(f"{report['requests']} requests captured over {report['captured_duration']} s, "
+          f"replayed at {speed} in {report['duration']} s")
+    print(f"{'endpoint':<24}{'requests':>9}{'status':>8}{'body':>6}{'errors':>8}"
+          f"{'cap p50':>9}{'cap p99':>9}{'rep p50':>9}{'rep p99':>9}")
+    for name, e in report["endpoints"].items():
+        print(f"{name:<24}{e['requests']:>9}{e['status_mismatches']:>8}{e['body_mismatches']:>6}{e['errors']:>8}"
+              f"{e['captured_p50_ms']:>9}{e['captured_p99_ms']:>9}{e['replayed_p50_ms']:>9}{e['replayed_p99_ms']:>9}")
+    print("status/body: responses that differ from the capture; latencies in ms "
+          "(captured: server-side, replayed: round trip)")
+    for example in report["examples"]:
+        print(f"  {example['at']:>9.3f}s {example['request']}: {example['mismatch']} differs "
+              f"(captured {example['captured']}, replayed {example['replayed']})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a Monster Go server capture")
+    parser.add_argument("capture", help="file written by server.py --capture")
+    parser.add_argument("--url", default="http://localhost:8989")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="pace relative to the capture: 1 real time, N times faster, 0 as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=64, help="requests in flight at most")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds per request (long-polls included)")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    raise_file_limit(args.concurrency // 3 + 1)
+    replay = Replay(args, read_capture(args.capture))
+    asyncio.run(replay.run())
+    result = replay.report()
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
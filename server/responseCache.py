@@ -0,0 +1,127 @@
+import gzip
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import AbstractContextManager, nullcontext
+from typing import Callable, Hashable
+
+MAX_ENTRIES = 256
+
+# Content-Encoding name -> compressor, in order of preference
+COMPRESSORS: dict[str, Callable[[bytes], bytes]] = {
+    "gzip": lambda data: gzip.compress(data, compresslevel=6, mtime=0),
+    "deflate": lambda data: zlib.compress(data, 6),
+}
+MIN_COMPRESS_SIZE = 1024  # smaller bodies are sent as they are
+
+
+def make_etag(namespace: str, version: int, representation: str = "") -> str:
+    return f'"{namespace}-{version}-{representation}"' if representation else f'"{namespace}-{version}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match is "*" or a list of (possibly weak) tags
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def negotiate_encoding(accept_encoding: str) -> str | None:
+    """
+    The preferred COMPRESSORS entry allowed by an Accept-Encoding header, or
+    None. Codings with q=0 are refused; "*" stands for any other coding.
+    """
+    allowed = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        allowed[name.strip()] = q
+    for name in COMPRESSORS:
+        if allowed.get(name, allowed.get("*", 0.0)) > 0:
+            return name
+    return None
+
+
+class CachedBody:
+    """
+    A response body encoded once, with its ETag and lazily built compressed
+    variants. Instances are shared between requests and never mutated except
+    to memoize a variant.
+    """
+    body: bytes
+    etag: str
+    _variants: dict[str, bytes]
+
+    def __init__(self, body: bytes, etag: str):
+        self.body = body
+        self.etag = etag
+        self._variants = {}
+
+    def variant(self, encoding: str) -> bytes:
+        data = self._variants.get(encoding)
+        if data is None:
+            data = COMPRESSORS[encoding](self.body)
+            self._variants[encoding] = data
+        return data
+
+
+class ResponseCache:
+    """
+    Encoded responses keyed by (namespace, state version, params).
+
+    Each namespace ("players", "chat", ...) tracks the newest version it has
+    seen; when the state moves on, entries for older versions are dropped, so
+    a mutation invalidates everything cached for that namespace.
+    """
+    _lock: AbstractContextManager
+    _entries: OrderedDict[tuple, CachedBody]
+    _versions: dict[str, int]
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, *, threadsafe: bool = True):
+        self.max_entries = max_entries
+        self._lock = threading.Lock() if threadsafe else nullcontext()
+        self._entries = OrderedDict()
+        self._versions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, namespace: str, version: int, params: Hashable, build: Callable[[], object],
+            encode: Callable[[object], bytes] | None = None, representation: str = "") -> CachedBody:
+        """
+        The cached body for `params` at `version` of `namespace`, built with
+        `build` and `encode` (JSON by default) on a miss. Its ETag is derived
+        from the namespace, version and `representation`, which must name
+        everything else the body depends on (cursor, limit, encoding), so
+        different bodies never share a tag.
+        """
+        key = (namespace, version, params)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+            if version > self._versions.get(namespace, -1):
+                self._versions[namespace] = version
+                for old in [k for k in self._entries if k[0] == namespace and k[1] < version]:
+                    del self._entries[old]
+
+        # Build outside the lock; concurrent misses for one key both build, one wins
+        payload = build()
+        body = encode(payload) if encode else json.dumps(payload).encode("utf-8")
+        cached = CachedBody(body, make_etag(namespace, version, representation))
+        with self._lock:
+            if version >= self._versions.get(namespace, -1):
+                self._entries[key] = cached
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return cached
@@ -0,0 +1,451 @@
+"""
+Map-sharded serving: one worker process per map behind a front router.
+
+Every map in saves/game.json gets a worker, a shard-mode AsyncGameServer on
+127.0.0.1, so maps are served from separate cores. The ShardRouter runs in
+the front process and:
+
+  * assigns player ids (GET /register) and keeps chat, PvP battles and
+    /metrics itself;
+  * forwards GET /players?near=, POST /players and POST /sync to the worker
+    of the map the player is on;
+  * hands a player over when an update names another map (a teleport via
+    GameManager.switch_map): POST /shard/leave on the old worker, then
+    POST /shard/join with the new position on the new one;
+  * answers world-wide GET /players by merging every shard's listing. Those
+    are always full listings; their version is the sum of shard versions.
+
+The push and UDP channels are not available in this mode.
+"""
+
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from server import codec
+from server.app import GameApp, Response, parse_player_id
+from server.capture import CaptureWriter
+from server.chatStore import DEFAULT_CAPACITY
+from server.playerHandler import CHECK_INTERVAL_TIME, TIMEOUT_TIME
+from server.playerTable import IdAllocator
+from server.responseCache import make_etag
+
+SHARD_BASE_PORT = 9000
+GAME_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "saves", "game.json")
+FORWARD_TIMEOUT = 5.0
+PRUNE_GRACE = 5.0  # a fresh placement may not be visible in its shard's listing yet
+
+
+def load_maps(path: str = GAME_FILE) -> list[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [m["path"] for m in json.load(f)["map"]]
+
+
+def run_worker(map_name: str, port: int, maps_dir: str | None, tick_rate: float = 0.0) -> None:
+    import asyncio
+
+    from server.asyncServer import AsyncGameServer
+
+    # Forked workers inherit server.py's SIGTERM handler; terminate() should just stop them
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        # Rate limits are applied by the router
+        asyncio.run(AsyncGameServer("127.0.0.1", port, shard=True, rate_limits={}, maps_dir=maps_dir,
+                                    tick_rate=tick_rate).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+class Shard:
+    def __init__(self, map_name: str, port: int, maps_dir: str | None = None, tick_rate: float = 0.0):
+        self.map = map_name
+        self.port = port
+        self.maps_dir = maps_dir
+        self.tick_rate = tick_rate
+        self.process: multiprocessing.Process | None = None
+
+    def start(self) -> None:
+        self.process = multiprocessing.Process(
+            target=run_worker, args=(self.map, self.port, self.maps_dir, self.tick_rate), name=f"shard-{self.map}", daemon=True)
+        self.process.start()
+
+    def wait_ready(self, timeout: float = 10.0) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.5).close()
+                return
+            except OSError:
+                if time.monotonic() > deadline or not self.process.is_alive():
+                    raise RuntimeError(f"shard worker for {self.map} did not start")
+                time.sleep(0.05)
+
+
+class ShardRouter:
+    """
+    Front end for map-sharded workers (see module docstring). Serves the same
+    handle() interface as GameApp, so server.py's Handler can sit in front.
+    """
+    shards: list[Shard]
+    _by_map: dict[str, Shard]
+    _placed: dict[int, tuple[Shard, float]]  # pid -> (shard, time placed)
+    _unplaced: dict[int, float]              # registered, no position yet: pid -> registration time
+
+    def __init__(self, maps: list[str], base_port: int = SHARD_BASE_PORT, *,
+                 chat_capacity: int = DEFAULT_CAPACITY, chat_dir: str | None = None,
+                 rate_limits: dict[str, tuple[float, float]] | None = None, maps_dir: str | None = None,
+                 tick_rate: float = 0.0, capture: CaptureWriter | None = None):
+        if not maps:
+            raise ValueError("no maps to shard")
+        # Workers tick on their own; the router holds no player state
+        self.shards = [Shard(m, base_port + i, maps_dir, tick_rate) for i, m in enumerate(maps)]
+        self._by_map = {s.map: s for s in self.shards}
+        # Chat, battles, /metrics, the root endpoint and rate limiting are served here
+        # The local app also records the routed requests when capturing
+        self.local = GameApp(chat_capacity=chat_capacity, chat_dir=chat_dir, rate_limits=rate_limits, maps_dir=maps_dir,
+                             capture=capture)
+        self.chat = self.local.chat
+        self.local.battles.is_player = self._is_known
+
+        self._lock = threading.Lock()
+        # Same generation-tagged, recycled ids as a single server, so workers store
+        # each player in the slot the router picked
+        self._ids = IdAllocator()
+        self._placed = {}
+        self._unplaced = {}
+        self._connections = threading.local()
+        self._stop_event = threading.Event()
+
+    # Lifecycle
+    def start(self) -> None:
+        for shard in self.shards:
+            shard.start()
+        for shard in self.shards:
+            shard.wait_ready()
+        threading.Thread(target=self._pruner, name="ShardPruner", daemon=True).start()
+
+    def close(self) -> None:
+        self._stop_event.set()
+        for shard in self.shards:
+            if shard.process and shard.process.is_alive():
+                shard.process.terminate()
+        self.local.close()
+
+    # Warm restarts (server.stateFile)
+    def save_state(self, path: str) -> None:
+        """
+        Saves players in the PlayerHandler.export_state() layout, so either
+        kind of server can load the file. Positions come from the shards'
+        listings; world versions and idle times of placed players are not kept.
+        """
+        now = time.monotonic()
+        rows = [[p["id"], p["x"], p["y"], p["map"], p["direction"], p["moving"], 0.0, 0]
+                for p in self._world()["players"].values()]
+        with self._lock:
+            rows.extend([pid, 0.0, 0.0, "", "DOWN", False, now - t, 0] for pid, t in self._unplaced.items())
+            generations = self._ids.generations()
+        players = {"version": 0, "players": rows, "removed": [], "removed_floor": 0, "generations": generations}
+        self.local.save_state(path, players)
+
+    def load_state(self, path: str) -> int:
+        # Call after start(): restored players join their map's shard
+        return self.local.load_state(path, self._restore_players)
+
+    def _restore_players(self, state: dict) -> int:
+        now = time.monotonic()
+        with self._lock:
+            if len(self._ids):
+                raise ValueError("players are already registered")
+            self._ids.load_generations(state.get("generations", []))
+        restored = 0
+        keys = ("id", "x", "y", "map", "direction", "moving")
+        for pid, x, y, map_name, direction, moving, idle, _ in state["players"]:
+            with self._lock:
+                self._ids.claim(pid)
+                if not map_name:
+                    # Registered, no position yet
+                    self._unplaced[pid] = now - idle
+                    restored += 1
+                    continue
+                shard = self.shard_for(map_name)
+                self._placed[pid] = (shard, now)
+            joined = self._forward_json(shard, "/shard/join", dict(zip(keys, (pid, x, y, map_name, direction, moving))))
+            if joined.status == 200:
+                restored += 1
+            else:
+                with self._lock:
+                    self._forget(pid)
+        return restored
+
+    def shard_for(self, map_name: str) -> Shard:
+        # Maps missing from saves/game.json are served by the first shard
+        return self._by_map.get(map_name, self.shards[0])
+
+    # Forwarding
+    def _forward(self, shard: Shard, method: str, path: str, body: bytes = b"",
+                 headers: dict[str, str] | None = None) -> Response:
+        conns = getattr(self._connections, "by_port", None)
+        if conns is None:
+            conns = self._connections.by_port = {}
+        for attempt in range(2):
+            conn = conns.get(shard.port)
+            if conn is None:
+                conn = conns[shard.port] = http.client.HTTPConnection("127.0.0.1", shard.port, timeout=FORWARD_TIMEOUT)
+            try:
+                conn.request(method, path, body, headers or {})
+                resp = conn.getresponse()
+                data = resp.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                del conns[shard.port]
+                if attempt:
+                    return Response(502, {"error": "shard_unavailable", "map": shard.map})
+                continue
+            extra = {"ETag": resp.getheader("ETag")} if resp.getheader("ETag") else {}
+            return Response(resp.status, data, extra, content_type=resp.getheader("Content-Type", "application/json"))
+        raise AssertionError("unreachable")
+
+    def _forward_json(self, shard: Shard, path: str, payload: dict) -> Response:
+        return self._forward(shard, "POST", path, json.dumps(payload).encode("utf-8"),
+                             {"Content-Type": "application/json"})
+
+    # Routing
+    def handle(self, method: str, target: str, body: bytes = b"", headers: dict[str, str] | None = None) -> Response:
+        url = urlparse(target)
+        if url.path in ("/", "/chat", "/metrics") or url.path.startswith("/battle"):
+            return self.local.handle(method, target, body, headers)
+        started = time.perf_counter()
+        response = self._route(method, url.path, parse_qs(url.query or ""), target, body, headers or {})
+        response = response.compressed((headers or {}).get("accept-encoding"))
+        response = response.conditional((headers or {}).get("if-none-match"))
+        self.local.observe(method, target, response.status, started)
+        self.local.record(method, target, body, headers, response, started)
+        return response
+
+    def _route(self, method: str, path: str, qs: dict, target: str, body: bytes, headers: dict[str, str]) -> Response:
+        if method == "GET" and path == "/register":
+            return self._register()
+        if method == "GET" and path == "/players":
+            if "near" in qs:
+                return self._get_near(qs, target, headers)
+            return self._get_world(qs, target, headers)
+        if method == "POST" and path == "/players":
+            return self._post_players(body, headers)
+        if method == "POST" and path == "/sync":
+            return self._sync(body)
+        return Response(404, {"error": "not_found"})
+
+    def _register(self) -> Response:
+        now = time.monotonic()
+        with self._lock:
+            for stale in [p for p, t in self._unplaced.items() if now - t >= TIMEOUT_TIME]:
+                del self._unplaced[stale]
+                self._ids.release(stale)
+            pid = self._ids.allocate()
+            self._unplaced[pid] = now
+        return Response(200, {"message": "registration successful", "id": pid})
+
+    def _place(self, fields: tuple) -> Response | None:
+        """
+        Makes sure the player lives on the shard of the map in `fields`
+        (GameApp.parse_update output). Returns a response when the update was
+        fully handled here (a join, or an unknown player), None when it should
+        be forwarded to the player's shard as usual.
+        """
+        pid, x, y, map_name = fields[:4]
+        target = self.shard_for(map_name)
+        # Workers trust joins, so positions are checked here too
+        collision = self.local.players.collision
+        if collision is not None and not collision.walkable(map_name, x, y):
+            return Response(422, {"error": "invalid_move", "reason": "blocked"})
+        with self._lock:
+            current = self._placed.get(pid, (None, 0.0))[0]
+            if current is target:
+                return None
+            registered = self._unplaced.pop(pid, None)
+            if current is None and (registered is None or time.monotonic() - registered >= TIMEOUT_TIME):
+                if registered is not None:
+                    self._ids.release(pid)
+                return Response(404, {"error": "player_not_found"})
+            self._placed[pid] = (target, time.monotonic())
+
+        if current is not None:
+            left = self._forward_json(current, "/shard/leave", {"id": pid})
+            if left.status == 404:
+                # Timed out on the old shard: same as updating an expired player
+                with self._lock:
+                    self._forget(pid)
+                return Response(404, {"error": "player_not_found"})
+        keys = ("id", "x", "y", "map", "direction", "moving")
+        joined = self._forward_json(target, "/shard/join", dict(zip(keys, fields)))
+        if joined.status != 200:
+            with self._lock:
+                self._forget(pid)
+            return joined
+        return Response(200, {"success": True})
+
+    def _forget(self, pid: int) -> None:
+        # Caller holds the lock; the id may be handed out again
+        if self._placed.pop(pid, None) is not None:
+            self._ids.release(pid)
+
+    def _is_known(self, pid: int) -> bool:
+        with self._lock:
+            return pid in self._placed or pid in self._unplaced
+
+    def _shard_of(self, pid: int) -> Shard | None:
+        with self._lock:
+            entry = self._placed.get(pid)
+        return entry[0] if entry else None
+
+    def _checked(self, pid: int, response: Response) -> Response:
+        # A 404 from the shard means the player timed out there
+        if response.status == 404:
+            with self._lock:
+                self._forget(pid)
+        return response
+
+    def _post_players(self, body: bytes, headers: dict[str, str]) -> Response:
+        try:
+            if headers.get("content-type", "").startswith(codec.CONTENT_TYPE):
+                data = codec.decode_update(body)
+            else:
+                data = json.loads(body.decode("utf-8"))
+        except Exception:
+            return Response(400, {"error": "invalid_json"})
+        fields = GameApp.parse_update(data)
+        if isinstance(fields, Response):
+            return fields
+        limited = self.local.throttle("players", fields[0])
+        if limited:
+            return limited
+        handled = self._place(fields)
+        if handled is not None:
+            return handled
+        shard = self._shard_of(fields[0])
+        if shard is None:
+            return Response(404, {"error": "player_not_found"})
+        forward_headers = {"Content-Type": headers.get("content-type", "application/json")}
+        return self._checked(fields[0], self._forward(shard, "POST", "/players", body, forward_headers))
+
+    def _get_near(self, qs: dict, target: str, headers: dict[str, str]) -> Response:
+        try:
+            pid = int(qs["near"][0])
+        except ValueError:
+            return Response(400, {"error": "bad_fields"})
+        shard = self._shard_of(pid)
+        if shard is None:
+            with self._lock:
+                known = pid in self._unplaced
+            if not known:
+                return Response(404, {"error": "player_not_found"})
+            # Not on any map yet, so nobody is near
+            result = {"version": 0, "players": {}, "removed": [], "full": True}
+            return self._listing(result, headers, f"near{pid}")
+        accept = {"Accept": headers["accept"]} if "accept" in headers else {}
+        return self._checked(pid, self._forward(shard, "GET", target, headers=accept))
+
+    def _world(self) -> dict:
+        # Full listing merged from every shard
+        version = 0
+        players = {}
+        for shard in self.shards:
+            response = self._forward(shard, "GET", "/players?since=-1")
+            if response.status != 200:
+                continue
+            listing = json.loads(response.body())
+            version += listing["version"]
+            players.update(listing["players"])
+        return {"version": version, "players": players, "removed": [], "full": True}
+
+    def _get_world(self, qs: dict, target: str, headers: dict[str, str]) -> Response:
+        world = self._world()
+        if target == "/players" and codec.CONTENT_TYPE not in headers.get("accept", ""):
+            return Response(200, {"players": world["players"], "version": world["version"]},
+                            {"ETag": make_etag("players", world["version"], "all")})
+        try:
+            since = int(qs.get("since", ["-1"])[0])
+        except ValueError:
+            since = -1
+        if since == world["version"]:
+            return self._listing({"version": since, "players": {}, "removed": [], "full": False}, headers, "same")
+        return self._listing(world, headers, "full")
+
+    def _listing(self, result: dict, headers: dict[str, str], representation: str) -> Response:
+        # Tagged like GameApp listings, with `representation` naming the shape of
+        # the body; the merged version is the sum of the shards' versions
+        if codec.CONTENT_TYPE in headers.get("accept", ""):
+            return Response(200, codec.encode_listing(result),
+                            {"ETag": make_etag("players", result["version"], f"bin-{representation}")},
+                            content_type=codec.CONTENT_TYPE)
+        return Response(200, result, {"ETag": make_etag("players", result["version"], representation)})
+
+    def _sync(self, body: bytes) -> Response:
+        try:
+            data = json.loads(body.decode("utf-8"))
+            pid = parse_player_id(data["id"])
+            chat_since = int(data.get("chat_since", -1))
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return Response(400, {"error": "bad_fields"})
+        lines = GameApp.parse_chat(data.pop("chat", []))
+        if isinstance(lines, Response):
+            return lines
+
+        limited = self.local.throttle("players", pid)
+        if not limited and lines:
+            limited = self.local.throttle("chat", pid, len(lines))
+        if limited:
+            return limited
+
+        if "x" in data:
+            fields = GameApp.parse_update(data)
+            if isinstance(fields, Response):
+                return fields
+            handled = self._place(fields)
+            if handled is not None and handled.status != 200:
+                return handled
+        for text in lines:
+            self.chat.append(pid, text)
+
+        shard = self._shard_of(pid)
+        if shard is None:
+            with self._lock:
+                known = pid in self._unplaced
+            if not known:
+                return Response(404, {"error": "player_not_found"})
+            result = self._world() if data.get("radius") is None else {
+                "version": 0, "players": {}, "removed": [], "full": True}
+        else:
+            response = self._checked(pid, self._forward_json(shard, "/sync", data))
+            if response.status != 200:
+                return response
+            result = json.loads(response.body())
+        chat = self.chat.since(chat_since, 50)
+        result["messages"] = chat["messages"]
+        result["chat_gap"] = chat["gap"]
+        return Response(200, result)
+
+    # Housekeeping
+    def _pruner(self) -> None:
+        # Forgets placements of players that timed out on their shard
+        while not self._stop_event.wait(CHECK_INTERVAL_TIME):
+            alive = set()
+            for shard in self.shards:
+                response = self._forward(shard, "GET", "/players?since=-1")
+                if response.status != 200:
+                    break
+                alive.update(int(pid) for pid in json.loads(response.body())["players"])
+            else:
+                self._prune(alive)
+
+    def _prune(self, alive: set[int]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for pid in [p for p, (_, t) in self._placed.items() if p not in alive and now - t > PRUNE_GRACE]:
+                self._forget(pid)
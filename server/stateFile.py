@@ -0,0 +1,42 @@
+"""
+Server state kept across restarts with server.py --state-file.
+
+On shutdown (Ctrl-C or SIGTERM) the server writes its players, world
+version, removed ids, slot generations and, without --chat-dir, recent chat
+and the next chat id to a JSON file; on startup it loads the file back.
+Clients therefore keep their ids and cursors across a deploy instead of all
+registering again at once. PvP battles and rate limit budgets are not kept.
+
+The file is written to a temporary name and renamed over the old one, so a
+crash while saving leaves the previous snapshot intact. Loading deletes the
+file: after a later crash the server starts empty rather than from a
+snapshot older than what clients have already seen.
+"""
+
+import json
+import os
+import time
+
+FORMAT = 1
+
+
+def save_state(path: str, state: dict) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(dict(state, format=FORMAT, saved_at=time.time()), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_state(path: str) -> dict | None:
+    """The state saved at `path`, which is then deleted; None if there is none."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    if state.get("format") != FORMAT:
+        raise ValueError(f"{path} has unsupported format {state.get('format')!r}")
+    os.remove(path)
+    return state
@@ -0,0 +1,193 @@
+import socket
+import struct
+import threading
+import time
+from dataclasses import dataclass
+
+from server import codec
+from server.playerHandler import PlayerHandler, WorldSnapshot
+from server.rateLimiter import RateLimiter
+from server.protocol import (
+    HELLO, HELLO_PAYLOAD, SEQ_MASK, UPDATE,
+    decode_datagram, encode_snapshot, seq_newer,
+)
+
+PUSH_INTERVAL = 0.05  # at most 20 snapshots per second
+RESEND_INTERVAL = 1.0  # unchanged snapshots are re-sent so lost datagrams heal
+SUBSCRIBER_TIMEOUT = 5.0  # clients say hello every second
+
+
+@dataclass
+class Subscriber:
+    addr: tuple
+    player_id: int
+    radius: float
+    last_seen: float
+
+
+class UdpServer:
+    """
+    Unreliable channel for position updates and player snapshots.
+
+    Clients send HELLO datagrams (their id and area-of-interest radius) about
+    once a second and UPDATE datagrams carrying a codec position update.
+    Subscribers receive full player listings whenever the world changes, and at
+    least every RESEND_INTERVAL, so a lost datagram only delays the next one.
+    Every datagram carries a sequence number and stale ones are dropped on both
+    sides. Registration and chat stay on HTTP (see server.protocol).
+
+    UDP source addresses can be spoofed, so a HELLO only subscribes an address
+    that the player's latest accepted UPDATE came from. Any other HELLO for a
+    live player is answered once, with no more snapshot bytes than the HELLO
+    itself carried (clients pad it to MAX_DATAGRAM_SIZE), so the channel cannot
+    amplify traffic towards a third party. UPDATEs spend the same "players"
+    rate limit tokens as POST /players when a `limiter` is given.
+    """
+    _lock: threading.Lock
+    _wake: threading.Event
+    _stop_event: threading.Event
+    _subscribers: dict[tuple, Subscriber]
+    _last_seq: dict[int, int]
+    _verified: dict[int, tuple]  # pid -> address of its latest accepted UPDATE
+    _seq: int
+    _version: int
+
+    def __init__(self, player_handler: PlayerHandler, host: str, port: int, limiter: RateLimiter | None = None):
+        self.player_handler = player_handler
+        self.limiter = limiter
+        self.host = host
+        self.port = port
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._subscribers = {}
+        # Newest sequence number of an accepted update per player
+        self._last_seq = {}
+        self._verified = {}
+        self._seq = 0
+        self._version = -1
+        self._sock: socket.socket | None = None
+
+        self.player_handler.add_listener(self._wake.set)
+
+    # Threading
+    def start(self) -> None:
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((self.host, self.port))
+        self._stop_event.clear()
+        threading.Thread(target=self._receive_loop, name="UdpReceive", daemon=True).start()
+        threading.Thread(target=self._broadcast_loop, name="UdpBroadcast", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._wake.set()
+        if self._sock:
+            self._sock.close()
+
+    def _receive_loop(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                data, addr = self._sock.recvfrom(65535)
+            except OSError:
+                if self._stop_event.is_set():
+                    return
+                continue  # e.g. ICMP port unreachable from a client that went away
+            try:
+                kind, seq, _, _, payload = decode_datagram(data)
+                if kind == HELLO:
+                    self._hello(addr, *HELLO_PAYLOAD.unpack_from(payload), len(data))
+                elif kind == UPDATE:
+                    self._apply_update(addr, seq, codec.decode_update(payload))
+            except (ValueError, IndexError, struct.error):
+                continue
+
+    def _hello(self, addr: tuple, pid: int, radius: float, budget: int) -> None:
+        snap = self.player_handler.snapshot()
+        if pid not in snap.players:
+            return
+        sub = Subscriber(addr, pid, max(0.0, radius), time.monotonic())
+        with self._lock:
+            verified = self._verified.get(pid) == addr
+            if verified:
+                self._subscribers[addr] = sub
+        if verified:
+            return
+        # Unverified: one reply, no larger than the request
+        for packet in self._packets(sub, snap) or ():
+            budget -= len(packet)
+            if budget < 0:
+                break
+            try:
+                self._sock.sendto(packet, addr)
+            except OSError:
+                return
+
+    def _apply_update(self, addr: tuple, seq: int, data: dict) -> None:
+        pid = data["id"]
+        with self._lock:
+            if not seq_newer(seq, self._last_seq.get(pid)):
+                return  # late or duplicated datagram
+        if self.limiter is not None and self.limiter.acquire("players", pid):
+            return
+        # A RejectedUpdate (ValueError) is dropped like any malformed datagram. Only
+        # accepted updates move the sequence on, so a rejected or spoofed datagram
+        # cannot make the player's later updates look old.
+        if self.player_handler.update(pid, data["x"], data["y"], data["map"], data["direction"], data["moving"]):
+            with self._lock:
+                if seq_newer(seq, self._last_seq.get(pid)):
+                    self._last_seq[pid] = seq
+                self._verified[pid] = addr
+
+    def _packets(self, sub: Subscriber, snap: WorldSnapshot) -> list[bytes] | None:
+        # Snapshot datagrams for one subscriber; None if its player is gone
+        if sub.radius > 0:
+            listing = self.player_handler.list_players_near(sub.player_id, sub.radius)
+            return None if listing is None else encode_snapshot(self._seq, listing)
+        return encode_snapshot(self._seq, self.player_handler.list_players_since(-1, snap))
+
+    def _broadcast_loop(self) -> None:
+        last_send = 0.0
+        while not self._stop_event.is_set():
+            self._wake.wait(RESEND_INTERVAL)
+            if self._stop_event.is_set():
+                return
+            self._wake.clear()
+            # Coalesce bursts of updates, as the push channel does
+            if self._stop_event.wait(PUSH_INTERVAL):
+                return
+
+            snap = self.player_handler.snapshot()
+            now = time.monotonic()
+            if snap.version == self._version and now - last_send < RESEND_INTERVAL:
+                continue
+            self._version = snap.version
+            last_send = now
+            self._seq = (self._seq + 1) & SEQ_MASK
+
+            with self._lock:
+                for pid in [pid for pid in self._last_seq if pid not in snap.players]:
+                    del self._last_seq[pid]
+                for pid in [pid for pid in self._verified if pid not in snap.players]:
+                    del self._verified[pid]
+                # Also drops subscribers whose player has since updated from another address
+                for addr in [a for a, s in self._subscribers.items()
+                             if now - s.last_seen > SUBSCRIBER_TIMEOUT or self._verified.get(s.player_id) != a]:
+                    del self._subscribers[addr]
+                subscribers = list(self._subscribers.values())
+
+            world: list[bytes] | None = None  # full listing shared by subscribers without a radius
+            for sub in subscribers:
+                if sub.radius > 0:
+                    packets = self._packets(sub, snap)
+                    if packets is None:
+                        continue
+                else:
+                    if world is None:
+                        world = self._packets(sub, snap)
+                    packets = world
+                try:
+                    for packet in packets:
+                        self._sock.sendto(packet, sub.addr)
+                except OSError:
+                    continue
@@ -97,10 +97,10 @@ class GameManager:
         for npc in self.npcs.get(self.current_map_key, []):
             if rect.colliderect(npc.animation.rect):
                 return True
+        # set_online_entities only receives players on the current map
         for online in self.online_entities:
-            if getattr(online, "map_name", "") == self.current_map.path_name:
-                if rect.colliderect(online.hitbox):
-                    return True
+            if rect.colliderect(online.hitbox):
+                return True
 
         
         return False
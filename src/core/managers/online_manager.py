@@ -1,13 +1,35 @@
 import queue
 import requests
+import socket
+import struct
 import threading
 import time
+from urllib.parse import urlparse
+from server import codec
+from server.chatStore import MAX_TEXT_LENGTH
+from server.protocol import (
+    FrameDecoder, HELLO, HELLO_PAYLOAD, MAX_DATAGRAM_SIZE, SEQ_MASK, SNAPSHOT, UPDATE,
+    SnapshotAssembler, decode_datagram, encode_datagram, encode_frame,
+)
 from src.utils import Logger, GameSettings
 
 POLL_INTERVAL = 0.4  # relaxed to reduce load
 POLL_INTERVAL_IDLE = 1.0
 UPDATE_INTERVAL = 0.1  # up to 10 Hz when moving
+MAX_UPDATE_INTERVAL = 2.0  # slowest cadence after repeated 429 responses
 KEEPALIVE_INTERVAL = 1.0
+PUSH_RETRY_INTERVAL = 5.0  # poll over HTTP for this long before retrying push
+PUSH_READ_TIMEOUT = 0.5
+PUSH_STALE_TIMEOUT = 15.0  # server heartbeats every 5 s
+UDP_RETRY_INTERVAL = 5.0
+UDP_MAX_RETRY_INTERVAL = 120.0  # retries back off up to this while the server has no UDP channel
+UDP_HELLO_INTERVAL = 1.0
+UDP_STALE_TIMEOUT = 3.0  # server re-sends snapshots every second
+CHAT_WAIT = 20.0  # long-poll duration for GET /chat
+CHAT_RETRY_INTERVAL = 1.0
+BATTLE_WAIT = 20.0  # long-poll duration for GET /battle
+# Codings the server may compress responses with; requests decodes them transparently
+ACCEPT_ENCODING = "gzip, deflate"
 
 class OnlineManager:
     list_players: list[dict]
@@ -16,6 +38,8 @@ class OnlineManager:
     _stop_event: threading.Event
     _thread: threading.Thread | None
     _send_thread: threading.Thread | None
+    _chat_thread: threading.Thread | None
+    _battle_thread: threading.Thread | None
     _lock: threading.Lock
     _session: requests.Session
     _poll_session: requests.Session
@@ -28,14 +52,41 @@ class OnlineManager:
 
         self._thread = None
         self._send_thread = None
+        self._chat_thread = None
+        self._battle_thread = None
         self._stop_event = threading.Event()
         self._lock = threading.Lock()
         self._on_error = None
         self._session = requests.Session()
         self._poll_session = requests.Session()
+        self._chat_session = requests.Session()
+        self._battle_session = requests.Session()
+        for session in (self._session, self._poll_session, self._chat_session, self._battle_session):
+            session.headers["Accept-Encoding"] = ACCEPT_ENCODING
         self._send_queue = queue.Queue(maxsize=1)
         self._last_sent_state: dict | None = None
         self._last_send_time: float = 0.0
+        # Send cadence; stretched when the server rate-limits us (429 + Retry-After)
+        self._send_interval = UPDATE_INTERVAL
+        self._send_resume = 0.0
+        self._remote_players: dict[int, dict] = {}
+        self._world_version = -1
+        # ETag of the last polled listing, the world version it described and
+        # whether anyone in it was moving; a 304 keeps that result
+        self._players_etag: tuple[str, int] | None = None
+        self._players_moving = False
+        # Set once the server answers in the binary codec; updates are then sent binary too
+        self._binary_ok = False
+        # UDP channel; position updates use it only while snapshots are arriving
+        self._udp_sock: socket.socket | None = None
+        self._udp_seq = 0
+        # Chat received by the long-poll (or /sync), and queued for sending in sync mode
+        self._chat_messages: list[dict] = []
+        self._chat_cursor = -1
+        self._chat_outbox: list[str] = []
+        # PvP battle events received by the GET /battle long-poll
+        self._battle_events: list[dict] = []
+        self._battle_cursor = -1
         Logger.info("OnlineManager initialized")
         
     def enter(self):
@@ -51,29 +102,74 @@ class OnlineManager:
 
     # Chat API
     def send_chat(self, text: str) -> bool:
-        if self.player_id == -1:
+        text = str(text).strip()[:MAX_TEXT_LENGTH]
+        if self.player_id == -1 or not text:
             return False
-        payload = {"id": self.player_id, "text": str(text)}
+        if GameSettings.ONLINE_USE_SYNC:
+            # Delivered by the next /sync round-trip
+            with self._lock:
+                self._chat_outbox.append(text)
+            return True
+        payload = {"id": self.player_id, "text": text}
         try:
             resp = self._session.post(f"{self.base}/chat", json=payload, timeout=(0.2, 0.5))
+            if resp.status_code == 429:
+                Logger.warning("Online chat rate limited by the server")
             return resp.status_code == 200
         except Exception as e:
             Logger.warning(f"Online chat send error: {e}")
             return False
 
     def get_recent_chat(self, since_id: int, limit: int = 50) -> list[dict]:
+        # Served from the local buffer filled by the chat long-poll or /sync
+        with self._lock:
+            return [m for m in self._chat_messages if m["id"] > since_id][-limit:]
+
+    def _store_chat(self, messages: list[dict]) -> None:
+        if not messages:
+            return
+        with self._lock:
+            self._chat_messages.extend(m for m in messages if m["id"] > self._chat_cursor)
+            self._chat_messages = self._chat_messages[-200:]
+            self._chat_cursor = max(self._chat_cursor, int(messages[-1]["id"]))
+    
+    # PvP battle API. Turns are resolved by the server; results arrive as events
+    # ("challenge", "start", "turn", "end") from get_battle_events.
+    def challenge(self, target_id: int, monsters: list[dict], name: str | None = None) -> int | None:
+        # Returns the battle id, or None if the challenge was refused
+        data = self._battle_post("challenge", {"target": target_id, "team": monsters, "name": name})
+        return data["battle"] if data else None
+
+    def accept_battle(self, battle_id: int, monsters: list[dict], name: str | None = None) -> bool:
+        return self._battle_post("accept", {"battle": battle_id, "team": monsters, "name": name}) is not None
+
+    def decline_battle(self, battle_id: int) -> bool:
+        # Refuses or withdraws a challenge, or forfeits a running battle
+        return self._battle_post("decline", {"battle": battle_id}) is not None
+
+    def battle_action(self, battle_id: int, action: str = "attack", skill: int = 0) -> dict | None:
+        # "attack" with a skill index, or "switch"; returns the resolved turn
+        return self._battle_post("action", {"battle": battle_id, "action": action, "skill": skill})
+
+    def get_battle_events(self, since_id: int) -> list[dict]:
+        with self._lock:
+            return [e for e in self._battle_events if e["id"] > since_id]
+
+    def _battle_post(self, path: str, payload: dict) -> dict | None:
+        if self.player_id == -1:
+            return None
         try:
-            resp = self._poll_session.get(
-                f"{self.base}/chat",
-                params={"since": since_id, "limit": limit},
-                timeout=(0.2, 0.5),
-            )
-            if resp.status_code == 200:
-                return resp.json().get("messages", [])
+            resp = self._session.post(f"{self.base}/battle/{path}", json=dict(payload, id=self.player_id),
+                                      timeout=(0.2, 1.0))
+            data = resp.json()
         except Exception as e:
-            Logger.warning(f"Online chat poll error: {e}")
-        return []
-    
+            Logger.warning(f"Online battle {path} error: {e}")
+            return None
+        if resp.status_code != 200:
+            Logger.warning(f"Online battle {path} refused: {data.get('error')}")
+            return None
+        return data
+
     def register(self):
         try:
             url = f"{self.base}/register"
@@ -117,6 +213,22 @@ class OnlineManager:
         if self._thread and self._thread.is_alive():
             return
         self._stop_event.clear()
+        # One outstanding battle event long-poll
+        self._battle_thread = threading.Thread(
+            target=self._battle_loop,
+            name="OnlineManagerBattle",
+            daemon=True
+        )
+        self._battle_thread.start()
+        if GameSettings.ONLINE_USE_SYNC:
+            # A single thread drives position, players and chat through /sync
+            self._thread = threading.Thread(
+                target=self._sync_loop,
+                name="OnlineManagerSync",
+                daemon=True
+            )
+            self._thread.start()
+            return
         self._thread = threading.Thread(
             target=self._loop,
             name="OnlineManagerPoller",
@@ -130,6 +242,13 @@ class OnlineManager:
             daemon=True
         )
         self._send_thread.start()
+        # One outstanding chat long-poll
+        self._chat_thread = threading.Thread(
+            target=self._chat_loop,
+            name="OnlineManagerChat",
+            daemon=True
+        )
+        self._chat_thread.start()
 
     def stop(self) -> None:
         self._stop_event.set()
@@ -137,16 +256,257 @@ class OnlineManager:
             self._thread.join(timeout=2)
         if self._send_thread and self._send_thread.is_alive():
             self._send_thread.join(timeout=2)
+        # The chat and battle threads may sit in a long-poll; they are daemons and exit on their next wake-up
+        for thread in (self._chat_thread, self._battle_thread):
+            if thread and thread.is_alive():
+                thread.join(timeout=0.1)
+
+    def _chat_loop(self) -> None:
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            try:
+                resp = self._chat_session.get(
+                    f"{self.base}/chat",
+                    params={"since": self._chat_cursor, "limit": 50, "wait": CHAT_WAIT},
+                    timeout=(0.5, CHAT_WAIT + 5.0),
+                )
+                resp.raise_for_status()
+                data = resp.json()
+                messages = data.get("messages", [])
+                if data.get("gap") and self._chat_cursor >= 0:
+                    Logger.warning("Online chat skipped messages no longer kept by the server")
+                self._store_chat(messages)
+            except Exception as e:
+                Logger.warning(f"Online chat poll error: {e}")
+                messages = []
+            # Don't spin if the server answered early with nothing (error or no long-poll support)
+            if not messages and time.monotonic() - started < CHAT_RETRY_INTERVAL:
+                self._stop_event.wait(CHAT_RETRY_INTERVAL)
+
+    def _battle_loop(self) -> None:
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            events = []
+            if self.player_id != -1:
+                try:
+                    resp = self._battle_session.get(
+                        f"{self.base}/battle",
+                        params={"id": self.player_id, "since": self._battle_cursor, "wait": BATTLE_WAIT},
+                        timeout=(0.5, BATTLE_WAIT + 5.0),
+                    )
+                    resp.raise_for_status()
+                    data = resp.json()
+                    events = data.get("events", [])
+                    with self._lock:
+                        if int(data.get("last", -1)) < self._battle_cursor:
+                            # The server restarted and numbers events from scratch
+                            self._battle_cursor = -1
+                        if events:
+                            self._battle_events = (self._battle_events + events)[-64:]
+                            self._battle_cursor = int(events[-1]["id"])
+                except Exception as e:
+                    Logger.warning(f"Online battle poll error: {e}")
+            if not events and time.monotonic() - started < CHAT_RETRY_INTERVAL:
+                self._stop_event.wait(CHAT_RETRY_INTERVAL)
 
     def _loop(self) -> None:
         idle_intervals = 0
-        while not self._stop_event.wait(POLL_INTERVAL if idle_intervals < 3 else POLL_INTERVAL_IDLE):
+        next_udp_attempt = 0.0
+        udp_retry_interval = UDP_RETRY_INTERVAL
+        next_push_attempt = 0.0
+        while not self._stop_event.is_set():
+            if GameSettings.ONLINE_USE_UDP and self.player_id != -1 and time.monotonic() >= next_udp_attempt:
+                # Each failed probe blocks polling for UDP_STALE_TIMEOUT, so failures back off
+                if self._run_udp():
+                    udp_retry_interval = UDP_RETRY_INTERVAL
+                else:
+                    udp_retry_interval = min(UDP_MAX_RETRY_INTERVAL, udp_retry_interval * 2)
+                next_udp_attempt = time.monotonic() + udp_retry_interval
+                if self._stop_event.is_set():
+                    break
+            if GameSettings.ONLINE_USE_PUSH and time.monotonic() >= next_push_attempt:
+                self._run_push()
+                next_push_attempt = time.monotonic() + PUSH_RETRY_INTERVAL
+                continue
+            if self._stop_event.wait(POLL_INTERVAL if idle_intervals < 3 else POLL_INTERVAL_IDLE):
+                break
             moved = self._fetch_players()
             if moved:
                 idle_intervals = 0
             else:
                 idle_intervals += 1
 
+    def _run_push(self) -> None:
+        # Blocks while the push connection is healthy; returns so _loop can fall back to polling.
+        host = urlparse(self.base).hostname or "localhost"
+        try:
+            sock = socket.create_connection((host, GameSettings.ONLINE_PUSH_PORT), timeout=1.0)
+        except OSError as e:
+            Logger.warning(f"OnlineManager push connect error: {e}")
+            return
+        Logger.info("OnlineManager using push channel")
+        decoder = FrameDecoder()
+        try:
+            sock.settimeout(PUSH_READ_TIMEOUT)
+            hello = {"type": "hello", "id": self.player_id}
+            if GameSettings.ONLINE_AOI_RADIUS > 0:
+                hello["radius"] = GameSettings.ONLINE_AOI_RADIUS
+            sock.sendall(encode_frame(hello))
+            last_frame = time.monotonic()
+            while not self._stop_event.is_set():
+                try:
+                    data = sock.recv(65536)
+                except socket.timeout:
+                    if time.monotonic() - last_frame > PUSH_STALE_TIMEOUT:
+                        Logger.warning("OnlineManager push channel stalled")
+                        return
+                    continue
+                if not data:
+                    Logger.warning("OnlineManager push channel closed")
+                    return
+                last_frame = time.monotonic()
+                for frame in decoder.feed(data):
+                    if frame.get("type") in ("snapshot", "delta"):
+                        self._apply_players(frame)
+        except (OSError, ValueError) as e:
+            Logger.warning(f"OnlineManager push error: {e}")
+        finally:
+            sock.close()
+
+    def _run_udp(self) -> bool:
+        # Blocks while snapshots keep arriving over UDP; returns so _loop can fall back to push or polling.
+        # Returns whether any snapshot arrived, i.e. whether the server has a UDP channel.
+        host = urlparse(self.base).hostname or "localhost"
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.connect((host, GameSettings.ONLINE_UDP_PORT))
+            sock.settimeout(PUSH_READ_TIMEOUT)
+        except OSError as e:
+            Logger.warning(f"OnlineManager UDP connect error: {e}")
+            return False
+        assembler = SnapshotAssembler()
+        # Padded: until this address has sent an accepted UPDATE, the server
+        # answers a HELLO with no more bytes than it carried
+        radius = float(max(0, GameSettings.ONLINE_AOI_RADIUS))
+        hello = encode_datagram(HELLO, 0, HELLO_PAYLOAD.pack(self.player_id, radius))
+        hello += bytes(MAX_DATAGRAM_SIZE - len(hello))
+        last_hello = 0.0
+        last_snapshot = time.monotonic()
+        received = False
+        try:
+            while not self._stop_event.is_set():
+                now = time.monotonic()
+                if now - last_hello >= UDP_HELLO_INTERVAL:
+                    sock.send(hello)
+                    # The server subscribes this address once an update from it was accepted
+                    state = self._last_sent_state
+                    if state is not None and self._udp_sock is None:
+                        self._udp_seq = (self._udp_seq + 1) & SEQ_MASK
+                        sock.send(encode_datagram(UPDATE, self._udp_seq, codec.encode_update(
+                            state["id"], state["x"], state["y"], state["map"], state["direction"], state["moving"])))
+                    last_hello = now
+                if now - last_snapshot > UDP_STALE_TIMEOUT:
+                    Logger.warning("OnlineManager UDP channel stalled")
+                    return received
+                try:
+                    data = sock.recv(65535)
+                except socket.timeout:
+                    continue
+                try:
+                    kind, seq, part, parts, payload = decode_datagram(data)
+                    listing = assembler.feed(seq, part, parts, payload) if kind == SNAPSHOT else None
+                except (ValueError, IndexError, struct.error):
+                    continue
+                if listing is None:
+                    continue
+                if self._udp_sock is None:
+                    Logger.info("OnlineManager using UDP channel")
+                    self._udp_sock = sock
+                received = True
+                last_snapshot = time.monotonic()
+                self._apply_players(listing)
+        except OSError as e:
+            Logger.warning(f"OnlineManager UDP error: {e}")
+        finally:
+            self._udp_sock = None
+            sock.close()
+        return received
+
+    def _apply_players(self, data: dict) -> list[dict]:
+        # Applies a versioned (possibly partial) player listing from the server
+        if data.get("full", True):
+            self._remote_players = {}
+        for key, p in data.get("players", {}).items():
+            self._remote_players[int(key)] = p
+        for key in data.get("removed", []):
+            self._remote_players.pop(int(key), None)
+        self._world_version = int(data.get("version", -1))
+
+        pid = self.player_id
+        filtered = [p for key, p in self._remote_players.items() if key != pid]
+        with self._lock:
+            self.list_players = filtered
+        return filtered
+
+    def _sync_loop(self) -> None:
+        last_sync = 0.0
+        idle_intervals = 0
+        while not self._stop_event.is_set():
+            # Wake early when the local player produces a new state
+            try:
+                body = self._send_queue.get(timeout=POLL_INTERVAL if idle_intervals < 3 else POLL_INTERVAL_IDLE)
+            except queue.Empty:
+                body = None
+
+            now = time.monotonic()
+            wait_time = max(self._send_interval - (now - last_sync), self._send_resume - now)
+            if wait_time > 0 and self._stop_event.wait(wait_time):
+                break
+            try:
+                body = self._send_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+            moved = self._sync(body)
+            last_sync = time.monotonic()
+            if moved or body is not None:
+                idle_intervals = 0
+            else:
+                idle_intervals += 1
+
+    def _sync(self, state: dict | None) -> bool:
+        with self._lock:
+            outbox, self._chat_outbox = self._chat_outbox, []
+        body = {"id": self.player_id, "since": self._world_version, "chat_since": self._chat_cursor}
+        if state is not None:
+            body.update(state)
+        if outbox:
+            body["chat"] = outbox
+        if GameSettings.ONLINE_AOI_RADIUS > 0 and self.player_id != -1:
+            body["radius"] = GameSettings.ONLINE_AOI_RADIUS
+        try:
+            resp = self._session.post(f"{self.base}/sync", json=body, timeout=(0.2, 0.5))
+            if self._throttled(resp):
+                data = None
+            else:
+                resp.raise_for_status()
+                data = resp.json()
+        except Exception as e:
+            Logger.warning(f"OnlineManager sync error: {e}")
+            data = None
+        if data is None:
+            # Resent with the next sync
+            with self._lock:
+                self._chat_outbox[:0] = outbox
+            return False
+
+        if state is not None:
+            self._last_send_time = time.monotonic()
+            self._last_sent_state = state.copy()
+        self._store_chat(data.get("messages", []))
+        filtered = self._apply_players(data)
+        return any(p.get("moving") for p in filtered)
+
     def _send_loop(self) -> None:
         last_send = 0.0
         while not self._stop_event.is_set():
@@ -162,9 +522,14 @@ class OnlineManager:
                     break
 
             now = time.monotonic()
-            wait_time = UPDATE_INTERVAL - (now - last_send)
+            wait_time = max(self._send_interval - (now - last_send), self._send_resume - now)
             if wait_time > 0 and self._stop_event.wait(wait_time):
                 break
+            # Send the newest state that arrived while waiting
+            try:
+                body = self._send_queue.get_nowait()
+            except queue.Empty:
+                pass
 
             self._send_player_state(body)
             last_send = time.monotonic()
@@ -172,8 +537,28 @@ class OnlineManager:
             self._last_sent_state = body.copy()
 
     def _send_player_state(self, body: dict) -> None:
+        udp_sock = self._udp_sock
+        if udp_sock is not None:
+            # Fire and forget; the server drops datagrams older than the newest it applied
+            self._udp_seq = (self._udp_seq + 1) & SEQ_MASK
+            payload = codec.encode_update(body["id"], body["x"], body["y"], body["map"], body["direction"], body["moving"])
+            try:
+                udp_sock.send(encode_datagram(UPDATE, self._udp_seq, payload))
+                return
+            except OSError as e:
+                Logger.warning(f"OnlineManager UDP send error: {e}")
         try:
-            resp = self._session.post(f"{self.base}/players", json=body, timeout=(0.2, 0.5))
+            if self._binary_ok:
+                resp = self._session.post(
+                    f"{self.base}/players",
+                    data=codec.encode_update(body["id"], body["x"], body["y"], body["map"], body["direction"], body["moving"]),
+                    headers={"Content-Type": codec.CONTENT_TYPE},
+                    timeout=(0.2, 0.5),
+                )
+            else:
+                resp = self._session.post(f"{self.base}/players", json=body, timeout=(0.2, 0.5))
+            if self._throttled(resp):
+                return
             if resp.status_code != 200:
                 Logger.warning(f"Update failed: {resp.status_code} {resp.text}")
         except Exception as e:
@@ -184,19 +569,52 @@ class OnlineManager:
                     pass
             Logger.warning(f"Online update error: {e}")
             
+    def _throttled(self, resp: requests.Response) -> bool:
+        """
+        Adapts the send cadence to the server's rate limiter: a 429 pauses
+        sending for its Retry-After and doubles the interval between sends (up
+        to MAX_UPDATE_INTERVAL); accepted sends shrink it back gradually.
+        """
+        if resp.status_code != 429:
+            self._send_interval = max(UPDATE_INTERVAL, self._send_interval * 0.9)
+            return False
+        try:
+            retry_after = float(resp.json()["retry_after"])
+        except Exception:
+            try:
+                retry_after = float(resp.headers.get("Retry-After", "1"))
+            except ValueError:
+                retry_after = 1.0
+        self._send_resume = time.monotonic() + retry_after
+        self._send_interval = min(MAX_UPDATE_INTERVAL, self._send_interval * 2)
+        Logger.warning(f"OnlineManager rate limited; sending every {self._send_interval:.2f}s")
+        return True
+
     def _fetch_players(self) -> bool:
         try:
             url = f"{self.base}/players"
-            resp = self._poll_session.get(url, timeout=(0.2, 0.5))
+            params = {"since": self._world_version}
+            if GameSettings.ONLINE_AOI_RADIUS > 0 and self.player_id != -1:
+                params["near"] = self.player_id
+                params["radius"] = GameSettings.ONLINE_AOI_RADIUS
+            headers = {"Accept": f"{codec.CONTENT_TYPE}, application/json"} if GameSettings.ONLINE_BINARY else {}
+            # Only valid while nothing else (push, UDP, sync) moved our state on
+            if self._players_etag is not None and self._players_etag[1] == self._world_version:
+                headers["If-None-Match"] = self._players_etag[0]
+            resp = self._poll_session.get(url, params=params, headers=headers, timeout=(0.2, 0.5))
+            if resp.status_code == 304:
+                return self._players_moving
             resp.raise_for_status()
-            all_players = resp.json().get("players", [])
-
-            pid = self.player_id
-            filtered = [p for key, p in all_players.items() if int(key) != pid]
-            with self._lock:
-                self.list_players = filtered
-
-            return any(p.get("moving") for p in filtered)
+            if resp.headers.get("Content-Type", "").startswith(codec.CONTENT_TYPE):
+                self._binary_ok = True
+                data = codec.decode_players(resp.content)
+            else:
+                data = resp.json()
+            filtered = self._apply_players(data)
+            etag = resp.headers.get("ETag")
+            self._players_etag = (etag, self._world_version) if etag else None
+            self._players_moving = any(p.get("moving") for p in filtered)
+            return self._players_moving
         except Exception as e:
             Logger.warning(f"OnlineManager fetch error: {e}")
         return False
@@ -40,6 +40,13 @@ def type_multiplier(attacker_element: object, defender_element: object) -> float
     return 1.0
 
 
+def calculate_damage(attacker: "Monster", target: "Monster", skill: "Skill", atk_buff: int = 0, def_buff: int = 0) -> int:
+    # Battle damage rule shared by BattleScene and the server's PvP battles (no pygame here)
+    base_damage = max(1, skill.power + getattr(attacker, "attack", 10) + atk_buff - getattr(target, "defense", 5) - def_buff)
+    mult = type_multiplier(getattr(attacker, "element", "neutral"), getattr(target, "element", "neutral"))
+    return max(1, int(base_damage * mult))
+
+
 class Monster:
     def __init__(
         self,
@@ -139,7 +146,8 @@ import os
 
 
 def _load_wild_pools() -> dict[str, list[dict]]:
-    json_path = os.path.join("saves", "wildpokemon.json")
+    # Relative to the repository, not the working directory, so the server can import this module from anywhere
+    json_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "saves", "wildpokemon.json")
     with open(json_path, "r") as f:
         data = json.load(f)
 
@@ -3,7 +3,7 @@ from src.core.services import scene_manager, resource_manager
 from src.interface.components.button import Button
 from src.sprites import Sprite, BackgroundSprite
 from src.utils import GameSettings
-from src.entities.monsters import type_multiplier
+from src.entities.monsters import calculate_damage
 
 
 class BattleScene:
@@ -155,10 +155,7 @@ class BattleScene:
         target = self.current_enemy()
         attacker = self.current_player()
         atk_buff = self.player_buffs.get(attacker, {}).get("atk", 0)
-        target_def = getattr(target, "defense", 5)
-        base_damage = max(1, skill.power + getattr(attacker, "attack", 10) + atk_buff - target_def)
-        mult = type_multiplier(getattr(attacker, "element", "neutral"), getattr(target, "element", "neutral"))
-        actual_damage = max(1, int(base_damage * mult))
+        actual_damage = calculate_damage(attacker, target, skill, atk_buff=atk_buff)
         actual_damage = min(actual_damage, target.hp)
         target.hp -= actual_damage
 
@@ -177,15 +174,8 @@ class BattleScene:
     def enemy_attack(self):
         target = self.current_player()
         skill = self.current_enemy().skills[0]
-        base_damage = max(
-            1,
-            skill.power
-            + getattr(self.current_enemy(), "attack", 10)
-            - getattr(target, "defense", 5)
-            - self.player_buffs.get(target, {}).get("def", 0)
-        )
-        mult = type_multiplier(getattr(self.current_enemy(), "element", "neutral"), getattr(target, "element", "neutral"))
-        damage = max(1, int(base_damage * mult))
+        damage = calculate_damage(self.current_enemy(), target, skill,
+                                  def_buff=self.player_buffs.get(target, {}).get("def", 0))
         target.hp -= damage
 
         
@@ -70,7 +70,6 @@ class GameScene(Scene):
         self._chat_overlay_last_id = -1
         self._chat_overlay_since = -1
         self._chat_history: list[tuple[int, int, str]] = []
-        self._chat_poll_timer = 0.0
         self.chat_overlay = ChatOverlay(
             send_callback=self._send_chat_message,
             fetch_callback=self._fetch_chat_for_overlay,
@@ -133,13 +132,8 @@ class GameScene(Scene):
                 p for p in self.online_players.values()
                 if p.map_name == self.game_manager.current_map.path_name
             ])
-            # Poll chat periodically (always, but faster when chat UI active or bubbles shown)
-            self._chat_poll_timer -= dt
-            if self._chat_poll_timer <= 0:
-                active_overlay = scene_manager.overlay_scene is self.chat_overlay
-                has_bubbles = bool(self._chat_bubbles)
-                self._chat_poll_timer = 0.25 if active_overlay else (0.5 if has_bubbles else 1.0)
-                self._pull_chat_messages()
+            # Chat arrives through the online manager's long-poll; this only reads its buffer
+            self._pull_chat_messages()
             
         else:
             self.game_manager.set_online_entities([])
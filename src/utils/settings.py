@@ -20,5 +20,12 @@ class Settings:
 
     
     ONLINE_SERVER_URL: str = "http://localhost:8989"
+    ONLINE_USE_PUSH: bool = True    # Receive player updates over the push channel
+    ONLINE_PUSH_PORT: int = 8990    # Falls back to HTTP polling if unreachable
+    ONLINE_AOI_RADIUS: int = 1024   # Poll only players nearby on the same map (0 = whole world)
+    ONLINE_USE_SYNC: bool = False   # Batch position, players and chat into one POST /sync per tick
+    ONLINE_BINARY: bool = True      # Negotiate the compact binary encoding for player state
+    ONLINE_USE_UDP: bool = False    # Send positions and receive snapshots over UDP (before trying push)
+    ONLINE_UDP_PORT: int = 8991
     
 GameSettings = Settings()
\ No newline at end of file
@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+from server.app import GameApp, MAX_CHAT_WAIT
+from server.chatStore import MAX_TEXT_LENGTH
+from server.playerTable import ID_LIMIT
+
+
+@pytest.fixture
+def app():
+    app = GameApp(rate_limits={})
+    yield app
+    app.close()
+
+
+def post(app: GameApp, target: str, data: object) -> tuple[int, object]:
+    body = data if isinstance(data, bytes) else json.dumps(data).encode()
+    response = app.handle("POST", target, body)
+    return response.status, response.payload
+
+
+def test_register_and_update(app):
+    assert app.handle("GET", "/").payload == {"status": "ok"}
+    pid = app.handle("GET", "/register").payload["id"]
+    assert post(app, "/players", {"id": pid, "x": 64, "y": 32, "map": "map.tmx", "direction": "UP",
+                                  "moving": True}) == (200, {"success": True})
+    with app.players._lock:
+        app.players._publish()  # skip PUBLISH_INTERVAL
+    players = json.loads(app.handle("GET", "/players").body())["players"]
+    assert players[str(pid)] == {"id": pid, "x": 64.0, "y": 32.0, "map": "map.tmx", "direction": "UP",
+                                 "moving": True}
+
+
+@pytest.mark.parametrize("method, target", [
+    ("GET", "/nowhere"), ("POST", "/register"), ("PUT", "/players"), ("POST", "/shard/join"),
+])
+def test_unknown_routes(app, method, target):
+    response = app.handle(method, target, b"{}")
+    assert (response.status, response.payload) == (404, {"error": "not_found"})
+
+
+@pytest.mark.parametrize("body, error", [
+    (b"not json", {"error": "invalid_json"}),
+    ({"id": 0, "x": 1}, {"error": "bad_fields", "missing": ["y", "map"]}),
+    ({"id": "me", "x": 1, "y": 1, "map": "m"}, {"error": "bad_fields"}),
+    ({"id": ID_LIMIT, "x": 1, "y": 1, "map": "m"}, {"error": "bad_fields"}),
+    ({"id": 0, "x": "nan", "y": 1, "map": "m"}, {"error": "bad_fields"}),
+])
+def test_malformed_updates(app, body, error):
+    app.players.register()
+    assert post(app, "/players", body) == (400, error)
+
+
+def test_update_of_unknown_player(app):
+    assert post(app, "/players", {"id": 5, "x": 1, "y": 1, "map": "m"}) == (404, {"error": "player_not_found"})
+
+
+def test_chat(app):
+    status, payload = post(app, "/chat", {"id": 1, "text": "  hi  "})
+    assert status == 200 and payload["msg"]["text"] == "hi"
+    assert post(app, "/chat", {"id": 1, "text": " "}) == (400, {"error": "empty_text"})
+    assert post(app, "/chat", {"id": 1, "text": "x" * (MAX_TEXT_LENGTH + 1)}) == (
+        400, {"error": "text_too_long", "max": MAX_TEXT_LENGTH})
+    assert post(app, "/chat", {"text": "hi"}) == (400, {"error": "bad_fields"})
+    assert post(app, "/chat", {"id": -1, "text": "hi"}) == (400, {"error": "bad_fields"})
+    chat = json.loads(app.handle("GET", "/chat?since=-1").body())
+    assert [m["text"] for m in chat["messages"]] == ["hi"]
+
+
+def test_chat_wait_time(app):
+    assert app.chat_wait_time("GET", "/chat?since=-1&wait=5") == 5.0
+    assert app.chat_wait_time("GET", "/chat?since=-1&wait=999") == MAX_CHAT_WAIT
+    assert app.chat_wait_time("GET", "/chat?since=-1") == 0.0
+    assert app.chat_wait_time("POST", "/chat?since=-1&wait=5") == 0.0
+    app.chat.append(1, "hi")
+    assert app.chat_wait_time("GET", "/chat?since=-1&wait=5") == 0.0
+    assert app.chat_wait_time("GET", "/chat?since=0&wait=5") == 5.0
+
+
+def test_sync_batches_update_players_and_chat(app):
+    a, b = app.players.register(), app.players.register()
+    status, payload = post(app, "/sync", {"id": a, "x": 10, "y": 0, "map": "map.tmx", "chat": ["hello"],
+                                          "since": -1, "chat_since": -1})
+    assert status == 200
+    assert {a, b} <= set(payload["players"]) and payload["full"]
+    assert [m["text"] for m in payload["messages"]] == ["hello"] and not payload["chat_gap"]
+    assert post(app, "/sync", {"x": 1}) == (400, {"error": "bad_fields"})
+    assert post(app, "/sync", {"id": a, "chat": "hello"}) == (400, {"error": "bad_fields"})
+    assert post(app, "/sync", {"id": a, "radius": "far"}) == (400, {"error": "bad_fields"})
+    assert post(app, "/sync", {"id": 99, "radius": 100}) == (404, {"error": "player_not_found"})
+
+
+def test_area_of_interest_errors(app):
+    assert app.handle("GET", "/players?near=x").status == 400
+    assert app.handle("GET", "/players?near=99").status == 404
+
+
+def test_shard_handoff_endpoints():
+    app = GameApp(shard=True, rate_limits={})
+    assert post(app, "/shard/join", {"id": 7, "x": 1, "y": 2, "map": "gym.tmx"}) == (200, {"success": True})
+    assert 7 in app.players._cells
+    assert post(app, "/shard/join", b"{") == (400, {"error": "invalid_json"})
+    assert post(app, "/shard/leave", {"id": 7}) == (200, {"success": True})
+    assert post(app, "/shard/leave", {"id": 7}) == (404, {"error": "player_not_found"})
+    assert post(app, "/shard/leave", {}) == (400, {"error": "bad_fields"})
+    app.close()
+
+
+def test_requests_are_counted_in_metrics(app):
+    app.handle("GET", "/")
+    app.handle("GET", "/nowhere")
+    text = app.handle("GET", "/metrics").body().decode()
+    assert 'http_requests_total{endpoint="GET /",status="200"} 1' in text
+    assert 'http_requests_total{endpoint="GET other",status="404"} 1' in text
@@ -0,0 +1,141 @@
+import json
+import time
+
+import pytest
+
+from server.app import GameApp
+from server.battleService import (CHALLENGE_TIMEOUT, DEFAULT_LIMITS, DEFAULT_SKILL, MAX_TEAM, BattleError,
+                                  BattleService, build_trainer)
+
+
+class Clock:
+    # Starts at the real clock: BattleSession.updated defaults to the unpatched time.monotonic
+    def __init__(self):
+        self.now = time.monotonic()
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
+
+
+def monster(name: str, hp: int = 30, power: int = 10, **stats) -> dict:
+    # Neutral monsters deal power + attack - defense = power + 5 damage
+    return dict({"name": name, "hp": hp, "max_hp": 30, "level": 5, "attack": 10, "defense": 5,
+                 "skills": [{"name": "Hit", "power": power}]}, **stats)
+
+
+@pytest.fixture
+def service():
+    return BattleService(lambda pid: pid in (1, 2, 3), limits=DEFAULT_LIMITS)
+
+
+def types(service: BattleService, pid: int) -> list[str]:
+    return [e["type"] for e in service.events(pid, -1)["events"]]
+
+
+def test_submitted_teams_are_clamped():
+    trainer = build_trainer([monster("a", hp=9999, max_hp=9999, attack=9999, skills=[]),
+                             monster("b", hp=0), monster("c", hp=5), monster("d", hp=20), monster("e", hp=10)],
+                            "x" * 100)
+    assert len(trainer.name) == 32
+    assert [m.name for m in trainer.monsters] == ["a", "d", "e"][:MAX_TEAM]
+    strongest = trainer.monsters[0]
+    assert strongest.max_hp == strongest.hp == DEFAULT_LIMITS["max_hp"]
+    assert strongest.attack == DEFAULT_LIMITS["attack"]
+    assert [s.name for s in strongest.skills] == [DEFAULT_SKILL["name"]]
+
+
+@pytest.mark.parametrize("team, error", [
+    (None, "bad_team"),
+    ([], "bad_team"),
+    ([{"name": "a"}], "bad_team"),
+    ([monster("a", hp="lots")], "bad_team"),
+    ([monster("a", hp=0)], "no_monsters"),
+])
+def test_malformed_teams_are_rejected(team, error):
+    with pytest.raises(BattleError) as rejected:
+        build_trainer(team, "me")
+    assert (rejected.value.status, rejected.value.error) == (400, error)
+
+
+def test_battle_is_resolved_on_the_server(service):
+    battle = service.challenge(1, 2, [monster("a", power=25)], "Ash")
+    assert types(service, 2) == ["challenge"]
+    service.accept(2, battle, [monster("b", hp=30), monster("c", hp=10)], "Gary")
+    assert types(service, 1) == ["start"]
+    with pytest.raises(BattleError) as rejected:
+        service.act(2, battle, "attack")
+    assert rejected.value.error == "not_your_turn"
+
+    turn = service.act(1, battle, "attack")
+    assert (turn["damage"], turn["hp"], turn["active"], turn["turn"]) == (30, 0, [0, 1], 1)
+    service.act(2, battle, "attack")
+    turn = service.act(1, battle, "attack")
+    assert (turn["damage"], turn["turn"]) == (10, None)
+    end = service.events(2, -1)["events"][-1]
+    assert end == dict(end, type="end", winner=1, reason="defeated")
+    # Both players are free again
+    assert service.challenge(2, 1, [monster("b")]) != battle
+
+
+def test_players_can_only_be_in_one_battle(service):
+    service.challenge(1, 2, [monster("a")])
+    with pytest.raises(BattleError) as rejected:
+        service.challenge(3, 2, [monster("c")])
+    assert (rejected.value.status, rejected.value.error) == (409, "already_in_battle")
+    for target in (1, 4):
+        with pytest.raises(BattleError) as rejected:
+            service.challenge(1, target, [monster("a")])
+        assert rejected.value.error == "player_not_found"
+
+
+def test_decline_and_forfeit(service):
+    battle = service.challenge(1, 2, [monster("a")])
+    service.decline(2, battle)
+    assert service.events(1, -1)["events"][-1]["reason"] == "declined"
+    battle = service.challenge(1, 2, [monster("a")])
+    service.accept(2, battle, [monster("b")])
+    service.decline(1, battle)
+    end = service.events(2, -1)["events"][-1]
+    assert (end["winner"], end["reason"]) == (2, "forfeit")
+    with pytest.raises(BattleError):
+        service.act(1, battle, "attack")
+
+
+def test_unanswered_challenge_times_out(service, clock):
+    battle = service.challenge(1, 2, [monster("a")])
+    clock.now += CHALLENGE_TIMEOUT + 1
+    assert service.events(1, -1)["events"][-1] == {"type": "end", "battle": battle, "winner": None,
+                                                   "reason": "timeout", "id": 1}
+    with pytest.raises(BattleError):
+        service.accept(2, battle, [monster("b")])
+
+
+def test_app_answers_battle_errors_with_their_status():
+    app = GameApp(rate_limits={})
+    a, b = app.players.register(), app.players.register()
+
+    def post(endpoint: str, **data) -> tuple[int, dict]:
+        response = app.handle("POST", f"/battle/{endpoint}", json.dumps(data).encode())
+        return response.status, response.payload
+
+    status, payload = post("challenge", id=a, target=b, team=[monster("a")])
+    assert status == 200
+    battle = payload["battle"]
+    assert post("accept", id=a, battle=battle, team=[monster("a")]) == (409, {"error": "not_pending"})
+    assert post("accept", id=b, battle=battle + 1, team=[monster("b")]) == (404, {"error": "battle_not_found"})
+    assert post("accept", id=b, battle=battle, team="none") == (400, {"error": "bad_team"})
+    assert post("accept", id=b, battle=battle, team=[monster("b")])[0] == 200
+    assert post("action", id=a, battle=battle, action="dance") == (400, {"error": "bad_action"})
+    assert post("action", id=a, battle=battle, action="attack", skill=3) == (400, {"error": "bad_skill"})
+    assert post("action", id=a, battle=battle, action="attack")[0] == 200
+    response = app.handle("GET", f"/battle?id={b}&since=-1")
+    assert [e["type"] for e in response.payload["events"]] == ["challenge", "start", "turn"]
+    assert app.handle("GET", "/battle?since=-1").status == 400
+    app.close()
@@ -0,0 +1,65 @@
+import gzip
+import json
+
+from server.capture import CaptureWriter, fingerprint, read_capture
+
+
+def record(writer: CaptureWriter, target: str, status: int = 200, headers: dict[str, str] | None = None,
+           body: bytes = b"", response: bytes = b'{"ok": true}') -> None:
+    writer.record(0.0, "GET" if not body else "POST", target, headers, body, status, {}, response, "application/json")
+
+
+def test_requests_round_trip(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    writer = CaptureWriter(path)
+    record(writer, "/players?since=3", headers={"accept": "application/x-monster-players", "cookie": "dropped"})
+    record(writer, "/chat", body=b'{"id": 1, "text": "hi"}', status=429)
+    writer.close()
+    first, second = read_capture(path)
+    assert (first.method, first.target, first.headers) == ("GET", "/players?since=3",
+                                                          {"accept": "application/x-monster-players"})
+    assert (second.method, second.body, second.status) == ("POST", b'{"id": 1, "text": "hi"}', 429)
+    assert first.length == len(b'{"ok": true}')
+    assert first.fingerprint == fingerprint(b'{"ok": true}', "application/json")
+
+
+def test_long_targets_and_headers_are_kept(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    writer = CaptureWriter(path)
+    target = "/players?pad=" + "x" * 70000
+    record(writer, target, headers={"if-none-match": "y" * 70000})
+    writer.close()
+    (captured,) = read_capture(path)
+    assert captured.target == target
+    assert len(captured.headers["if-none-match"]) == 70000
+
+
+def test_bad_record_does_not_stop_the_writer(tmp_path, capsys):
+    path = str(tmp_path / "capture.bin")
+    writer = CaptureWriter(path)
+    record(writer, "/first")
+    record(writer, "/bad", status=70000)  # does not fit the status field
+    record(writer, "/last")
+    writer.close()
+    assert [r.target for r in read_capture(path)] == ["/first", "/last"]
+    assert "/bad" in capsys.readouterr().err
+
+
+def test_truncated_capture_is_read_up_to_the_cut(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    writer = CaptureWriter(path)
+    for i in range(3):
+        record(writer, f"/{i}")
+    writer.close()
+    with gzip.open(path, "rb") as f:
+        data = f.read()
+    with gzip.open(path, "wb") as f:
+        f.write(data[:-3])
+    assert [r.target for r in read_capture(path)] == ["/0", "/1"]
+
+
+def test_fingerprint_ignores_volatile_fields_and_key_order():
+    a = json.dumps({"messages": [{"id": 1, "ts": 5.0}], "version": 3}).encode()
+    b = json.dumps({"version": 9, "messages": [{"ts": 7.0, "id": 1}]}).encode()
+    assert fingerprint(a, "application/json") == fingerprint(b, "application/json")
+    assert fingerprint(a, "application/json") != fingerprint(b'{"messages": []}', "application/json")
@@ -0,0 +1,110 @@
+import os
+
+from server.chatLog import RECORD, SUFFIX, SegmentLog, _encode
+from server.chatStore import ChatStore
+
+
+def message(mid: int, text: str = "hello") -> dict:
+    return {"id": mid, "from": 7, "text": text, "ts": 1700000000.0 + mid}
+
+
+def segment_files(directory) -> list[str]:
+    return sorted(name for name in os.listdir(directory) if name.endswith(SUFFIX))
+
+
+def test_rollover_keeps_every_message_in_order(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_size=256)
+    for mid in range(50):
+        log.append(message(mid))
+    assert len(segment_files(tmp_path)) > 1
+    assert [m["id"] for m in log.read(0)] == list(range(50))
+    assert [m["id"] for m in log.read(37)] == list(range(37, 50))
+    assert log.read(50) == []
+    assert log.read(20)[0] == message(20)
+    log.close()
+
+
+def test_oldest_segments_are_deleted(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_size=256, max_segments=2)
+    for mid in range(50):
+        log.append(message(mid))
+    assert len(segment_files(tmp_path)) == 2
+    oldest = log.oldest_id()
+    assert oldest > 0
+    assert [m["id"] for m in log.read(0)] == list(range(oldest, 50))
+    assert len(log) == 50 - oldest
+    log.close()
+
+
+def test_message_larger_than_a_segment(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_size=64)
+    log.append(message(0, "x" * 500))
+    log.append(message(1))
+    assert [len(m["text"]) for m in log.read(0)] == [500, 5]
+    log.close()
+
+
+def test_history_is_recovered_after_restart(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_size=256)
+    store = ChatStore(storage=log)
+    for i in range(30):
+        store.append(1, f"line {i}")
+    store.close()
+
+    store = ChatStore(storage=SegmentLog(str(tmp_path), segment_size=256))
+    assert store.next_id == 30
+    assert store.append(1, "after restart")["id"] == 30
+    texts = [m["text"] for m in store.since(-1, 100)["messages"]]
+    assert texts == [f"line {i}" for i in range(30)] + ["after restart"]
+    store.close()
+
+
+def test_truncated_record_is_dropped_on_recovery(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    for mid in range(3):
+        log.append(message(mid))
+    log.close()
+    path = os.path.join(tmp_path, segment_files(tmp_path)[-1])
+    valid = sum(len(_encode(message(mid))) for mid in range(3))
+    with open(path, "r+b") as f:
+        f.truncate(valid - 3)
+
+    log = SegmentLog(str(tmp_path))
+    assert log.last_id() == 1
+    log.append(message(2, "rewritten"))
+    assert [m["text"] for m in log.read(0)] == ["hello", "hello", "rewritten"]
+    log.close()
+
+
+def test_corrupt_record_ends_the_valid_prefix(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    for mid in range(4):
+        log.append(message(mid))
+    log.close()
+    path = os.path.join(tmp_path, segment_files(tmp_path)[-1])
+    offset = 2 * len(_encode(message(0))) + RECORD.size
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(b"J")
+
+    log = SegmentLog(str(tmp_path))
+    assert log.last_id() == 1
+    assert [m["id"] for m in log.read(0)] == [0, 1]
+    log.close()
+
+
+def test_corrupt_sealed_segment_stops_reading_there(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_size=128)
+    for mid in range(12):
+        log.append(message(mid))
+    log.close()
+    first = os.path.join(tmp_path, segment_files(tmp_path)[0])
+    with open(first, "r+b") as f:
+        f.seek(RECORD.size)
+        f.write(b"J")
+
+    log = SegmentLog(str(tmp_path), segment_size=128)
+    ids = [m["id"] for m in log.read(0)]
+    assert 0 not in ids
+    assert ids[-1] == 11
+    log.close()
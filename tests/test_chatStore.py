@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+from server.chatLog import SegmentLog
+from server.chatStore import ChatStore, RingBuffer
+
+
+@pytest.fixture(params=["ring", "segments"])
+def store(request, tmp_path):
+    # Either backend retains only a window of the newest messages
+    if request.param == "ring":
+        store = ChatStore(capacity=100, storage=RingBuffer(5))
+    else:
+        store = ChatStore(capacity=100, storage=SegmentLog(str(tmp_path), segment_size=128, max_segments=2))
+    yield store
+    store.close()
+
+
+def ids(result: dict) -> list[int]:
+    return [m["id"] for m in result["messages"]]
+
+
+def test_empty_store(store):
+    assert store.since(-1, 10) == {"messages": [], "gap": False}
+    assert not store.has_newer(-1)
+
+
+def test_reads_after_the_cursor_without_gap(store):
+    for text in ("a", "b", "c"):
+        store.append(7, text)
+    assert ids(store.since(-1, 10)) == [0, 1, 2]
+    assert store.since(0, 10) == {"messages": store.since(-1, 10)["messages"][1:], "gap": False}
+    assert store.since(2, 10) == {"messages": [], "gap": False}
+    assert store.has_newer(1) and not store.has_newer(2)
+
+
+def test_limit_returns_the_newest_messages_and_reports_the_gap(store):
+    for i in range(3):
+        store.append(7, str(i))
+    result = store.since(-1, 2)
+    assert ids(result) == [1, 2]
+    assert result["gap"] and result["oldest"] == 1
+
+
+def test_cursor_older_than_the_window_reports_the_gap(store):
+    for i in range(40):
+        store.append(7, f"message {i}")
+    oldest = store._storage.oldest_id()
+    assert oldest > 0
+    result = store.since(-1, 100)
+    assert ids(result) == list(range(oldest, 40))
+    assert result["gap"] and result["oldest"] == oldest
+    assert store.since(oldest - 2, 100)["gap"]
+    # A client that saw the message just before the window missed nothing
+    result = store.since(oldest - 1, 100)
+    assert ids(result) == list(range(oldest, 40))
+    assert not result["gap"] and "oldest" not in result
+
+
+def test_wait_returns_when_a_message_is_posted(store):
+    assert not store.wait(-1, 0.01)
+    threading.Timer(0.05, store.append, (7, "hi")).start()
+    assert store.wait(-1, 5.0)
+    assert ids(store.since(-1, 10)) == [0]
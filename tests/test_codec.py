@@ -0,0 +1,67 @@
+import pytest
+
+from server import codec
+from server.app import GameApp
+from server.codec import QUANTIZE, decode_players, decode_update, encode_listing, encode_players, encode_update
+
+
+def player(pid: int, x: float, y: float, map_name: str = "map.tmx", direction: str = "DOWN",
+           moving: bool = False) -> dict:
+    return {"id": pid, "x": x, "y": y, "map": map_name, "direction": direction, "moving": moving}
+
+
+def test_listing_round_trip():
+    listing = {
+        "version": 1 << 40,
+        "players": {
+            3: player(3, 10.25, -4.5, "map.tmx", "UP", True),
+            9: player(9, 0.0, 2048.75, "gym.tmx", "RIGHT"),
+            12: player(12, 64.0, 64.0, "map.tmx", "NONE"),
+        },
+        "removed": [4, 5],
+        "full": False,
+    }
+    assert decode_players(encode_listing(listing)) == listing
+
+
+def test_map_names_are_sent_once():
+    players = [player(pid, 0.0, 0.0, "a-rather-long-map-name.tmx") for pid in range(10)]
+    data = encode_players(1, players, [], True)
+    assert data.count(b"a-rather-long-map-name.tmx") == 1
+    assert len(data) == codec.HEADER.size + 1 + len("a-rather-long-map-name.tmx") + 10 * codec.RECORD.size
+    assert decode_players(data)["full"]
+
+
+def test_positions_are_quantized():
+    decoded = decode_players(encode_players(1, [player(1, 1.1, 2.0 + 1 / QUANTIZE)], [], True))
+    assert decoded["players"][1]["x"] == round(1.1 * QUANTIZE) / QUANTIZE
+    assert decoded["players"][1]["y"] == 2.0 + 1 / QUANTIZE
+
+
+def test_update_round_trip():
+    data = encode_update(5, 100.5, 200.0, "map.tmx", "LEFT", True)
+    assert decode_update(data) == player(5, 100.5, 200.0, "map.tmx", "LEFT", True)
+
+
+def test_update_must_carry_one_player():
+    with pytest.raises(ValueError):
+        decode_update(encode_players(0, [player(1, 0, 0), player(2, 0, 0)], [], False))
+
+
+def test_other_messages_are_rejected():
+    with pytest.raises(ValueError):
+        decode_players(b'{"version": 1, "players": {}}')
+
+
+def test_app_negotiates_the_binary_encoding():
+    app = GameApp(rate_limits={})
+    pid = app.handle("GET", "/register").payload["id"]
+    update = encode_update(pid, 32.0, 48.0, "map.tmx", "UP", True)
+    assert app.handle("POST", "/players", update, {"content-type": codec.CONTENT_TYPE}).status == 200
+    assert app.handle("POST", "/players", b"MP\x01", {"content-type": codec.CONTENT_TYPE}).status == 400
+    with app.players._lock:
+        app.players._publish()  # skip PUBLISH_INTERVAL
+    response = app.handle("GET", "/players?since=0", headers={"accept": codec.CONTENT_TYPE})
+    assert response.content_type == codec.CONTENT_TYPE
+    assert decode_players(response.body())["players"] == {pid: player(pid, 32.0, 48.0, "map.tmx", "UP", True)}
+    assert app.handle("GET", "/players?since=0").content_type == "application/json"
@@ -0,0 +1,77 @@
+import base64
+import os
+import zlib
+
+from server.collision import MAPS_DIR, TILE_SIZE, CollisionGrid, CollisionIndex
+
+TMX = """<?xml version="1.0" encoding="UTF-8"?>
+<map version="1.10" orientation="orthogonal" width="4" height="3" tilewidth="16" tileheight="16">
+ <layer id="1" name="Ground" width="4" height="3">
+  <data encoding="csv">1,1,1,1,1,1,1,1,1,1,1,1</data>
+ </layer>
+ <layer id="2" name="Collision" width="4" height="3">
+  <data encoding="csv">
+0,0,0,0,
+0,5,0,0,
+0,0,0,0</data>
+ </layer>
+ <layer id="3" name="House" width="4" height="3">
+  <data encoding="base64" compression="zlib">{house}</data>
+ </layer>
+ <layer id="4" name="Hidden collision" width="4" height="3" visible="0">
+  <data encoding="csv">1,1,1,1,1,1,1,1,1,1,1,1</data>
+ </layer>
+ <layer id="5" name="collision xml" width="4" height="3">
+  <data>{xml}</data>
+ </layer>
+</map>
+"""
+
+
+def write_map(directory, name: str = "test.tmx") -> str:
+    house = [0] * 12
+    house[3] = 9  # tile (3, 0)
+    raw = b"".join(gid.to_bytes(4, "little") for gid in house)
+    xml = "".join(f'<tile gid="{1 if i == 8 else 0}"/>' for i in range(12))  # tile (0, 2)
+    path = os.path.join(directory, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(TMX.format(house=base64.b64encode(zlib.compress(raw)).decode(), xml=xml))
+    return path
+
+
+def test_collision_layers_are_parsed(tmp_path):
+    grid = CollisionGrid.from_tmx(write_map(tmp_path))
+    assert (grid.width, grid.height) == (4, 3)
+    blocked = {(tx, ty) for ty in range(3) for tx in range(4) if grid.blocked(tx, ty)}
+    assert blocked == {(1, 1), (3, 0), (0, 2)}
+
+
+def test_outside_the_map_is_blocked(tmp_path):
+    grid = CollisionGrid.from_tmx(write_map(tmp_path))
+    assert grid.blocked(-1, 0)
+    assert grid.blocked(4, 0)
+    assert grid.blocked(0, 3)
+
+
+def test_walkable_checks_the_centre_of_the_hitbox(tmp_path):
+    grid = CollisionGrid.from_tmx(write_map(tmp_path))
+    assert grid.walkable(0, 0)
+    assert not grid.walkable(TILE_SIZE, TILE_SIZE)
+    # Less than half a tile into (1, 1) still counts as standing on (0, 1)
+    assert grid.walkable(TILE_SIZE / 2 - 1, TILE_SIZE)
+    assert not grid.walkable(TILE_SIZE / 2, TILE_SIZE)
+
+
+def test_index_has_every_map_and_no_unknown_ones(tmp_path):
+    write_map(tmp_path, "a.tmx")
+    write_map(tmp_path, "b.tmx")
+    (tmp_path / "notes.txt").write_text("not a map")
+    index = CollisionIndex(str(tmp_path))
+    assert sorted(index.grids) == ["a.tmx", "b.tmx"]
+    assert index.walkable("a.tmx", 0, 0)
+    assert not index.walkable("missing.tmx", 0, 0)
+
+
+def test_default_maps_do_not_depend_on_the_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert "map.tmx" in CollisionIndex().grids
@@ -0,0 +1,192 @@
+import time
+
+import pytest
+
+from server import playerHandler
+from server.playerHandler import MAX_SPEED, MOVE_TOLERANCE, TIMEOUT_TIME, PlayerHandler, RejectedUpdate
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class OpenMaps:
+    # Collision index without blocked tiles
+    def walkable(self, map_name: str, x: float, y: float) -> bool:
+        return True
+
+
+class BlockedMaps:
+    def walkable(self, map_name: str, x: float, y: float) -> bool:
+        return False
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
+
+
+def test_blocked_tiles_are_rejected():
+    handler = PlayerHandler(collision=BlockedMaps())
+    pid = handler.register()
+    with pytest.raises(RejectedUpdate) as rejected:
+        handler.update(pid, 0.0, 0.0, "map.tmx", "DOWN", False)
+    assert rejected.value.reason == "blocked"
+
+
+def test_moves_within_walking_speed_are_accepted(clock):
+    handler = PlayerHandler(collision=OpenMaps())
+    pid = handler.register()
+    clock.now += 0.5
+    assert handler.update(pid, MAX_SPEED / 2 + MOVE_TOLERANCE, 0.0, "", "DOWN", True)
+    clock.now += 0.1
+    with pytest.raises(RejectedUpdate) as rejected:
+        handler.update(pid, MAX_SPEED + 2 * MOVE_TOLERANCE, 0.0, "", "DOWN", True)
+    assert rejected.value.reason == "too_fast"
+
+
+def test_standing_still_does_not_build_up_speed(clock):
+    handler = PlayerHandler(collision=OpenMaps())
+    pid = handler.register()
+    handler.update(pid, 0.0, 0.0, "map.tmx", "DOWN", False)
+    for _ in range(10):
+        clock.now += 1
+        handler.update(pid, 0.0, 0.0, "map.tmx", "DOWN", False)
+    clock.now += 10
+    with pytest.raises(RejectedUpdate) as rejected:
+        handler.update(pid, 2 * MAX_SPEED + MOVE_TOLERANCE, 0.0, "map.tmx", "DOWN", True)
+    assert rejected.value.reason == "too_fast"
+    assert handler.update(pid, MAX_SPEED, 0.0, "map.tmx", "DOWN", True)
+    # Teleports skip the check
+    assert handler.update(pid, 5000.0, 0.0, "other.tmx", "DOWN", True)
+
+
+def test_tick_mode_rejects_too_fast_moves_right_away(clock):
+    handler = PlayerHandler(collision=OpenMaps(), tick_rate=20)
+    pid = handler.register()
+    clock.now += 1
+    assert handler.update(pid, MAX_SPEED, 0.0, "", "DOWN", True)
+    # Measured from the buffered update, not from the table
+    with pytest.raises(RejectedUpdate):
+        handler.update(pid, 2 * MAX_SPEED + MOVE_TOLERANCE + 1, 0.0, "", "DOWN", True)
+    assert handler.tick() == 1
+    assert handler.list_players()[pid]["x"] == MAX_SPEED
+
+
+def test_tick_drops_updates_buffered_before_the_player_left(clock):
+    handler = PlayerHandler(collision=OpenMaps(), tick_rate=20)
+    pid = handler.register()
+    clock.now += 1
+    assert handler.update(pid, MAX_SPEED, 0.0, "", "DOWN", True)
+    handler.remove(pid)
+    assert not handler.update(pid, MAX_SPEED, 0.0, "", "DOWN", True)
+    # Back under the same id (a shard handoff) before the tick
+    handler.add(pid, 500.0, 0.0, "", "UP", False)
+    assert handler.tick() == 0
+    assert handler.list_players()[pid]["x"] == 500.0
+    # The new stay is checked against its own position, not the stale buffer
+    clock.now += 0.5
+    assert handler.update(pid, 500.0 + MAX_SPEED / 2, 0.0, "", "UP", True)
+    assert handler.tick() == 1
+
+
+def test_expiry_entry_of_a_player_who_moved_is_pushed_again(clock):
+    handler = PlayerHandler()
+    idle = handler.register()
+    active = handler.register()
+    clock.now += TIMEOUT_TIME / 2
+    handler.update(active, 10.0, 0.0, "map.tmx", "DOWN", True)
+    clock.now += TIMEOUT_TIME / 2
+    assert handler.sweep() == 1
+    assert handler.table.slot(idle) is None
+    assert handler.table.slot(active) is not None
+    assert [(stamp, pid) for stamp, _, pid in handler._expiry] == [(clock.now - TIMEOUT_TIME / 2, active)]
+    clock.now += TIMEOUT_TIME / 2
+    assert handler.sweep() == 1
+    assert handler.list_players() == {}
+
+
+def test_expiry_entries_of_removed_players_are_dropped(clock):
+    handler = PlayerHandler()
+    pid = handler.register()
+    handler.remove(pid)
+    replacement = handler.register()
+    clock.now += TIMEOUT_TIME
+    handler.update(replacement, 1.0, 0.0, "map.tmx", "DOWN", False)
+    assert handler.sweep() == 0
+    assert [(stamp, pid) for stamp, _, pid in handler._expiry] == [(clock.now, replacement)]
+
+
+def test_rejoining_under_the_same_id_leaves_one_live_entry(clock):
+    # A shard worker sees the same id leave and join again on every round trip
+    handler = PlayerHandler()
+    pid = 5
+    handler.add(pid, 0.0, 0.0, "map.tmx", "DOWN", False)
+    for _ in range(100):
+        handler.remove(pid)
+        handler.add(pid, 0.0, 0.0, "map.tmx", "DOWN", False)
+        clock.now += 0.1
+    clock.now += TIMEOUT_TIME / 2
+    handler.update(pid, 1.0, 0.0, "map.tmx", "DOWN", False)
+    clock.now += TIMEOUT_TIME / 2
+    assert handler.sweep() == 0
+    assert len(handler._expiry) == 1
+    clock.now += TIMEOUT_TIME
+    assert handler.sweep() == 1
+    assert handler._expiry == []
+
+
+def test_next_expiry_is_capped(clock):
+    handler = PlayerHandler()
+    handler.register()
+    assert handler.next_expiry() == playerHandler.CHECK_INTERVAL_TIME
+    clock.now += TIMEOUT_TIME - 1
+    assert handler.next_expiry() == 1
+
+
+def test_old_snapshots_are_not_changed_by_publishing():
+    handler = PlayerHandler()
+    pids = [handler.register() for _ in range(100)]
+    before = handler.snapshot()
+    listing = dict(before.players)
+    handler.update(pids[0], 64.0, 64.0, "map.tmx", "UP", True)
+    handler.remove(pids[1])
+    after = handler._publish()
+    assert dict(before.players) == listing
+    assert dict(before.removed) == {}
+    assert len(after.players) == 99
+    assert after.players[pids[0]]["x"] == 64.0
+    assert pids[1] not in after.players
+    assert dict(after.removed) == {pids[1]: after.version}
+    assert after.grid["map.tmx"][(0, 0)] == (pids[0],)
+
+
+def test_tombstones_are_shared_until_they_change():
+    handler = PlayerHandler()
+    pids = [handler.register() for _ in range(3)]
+    handler.remove(pids[0])
+    first = handler._publish()
+    handler.update(pids[1], 64.0, 64.0, "map.tmx", "UP", True)
+    assert handler._publish().removed is first.removed
+    handler.add(pids[0], 0.0, 0.0, "map.tmx", "DOWN", False)
+    assert pids[0] not in handler.snapshot().removed
+    assert dict(first.removed) == {pids[0]: first.version}
+
+
+def test_oldest_tombstones_are_dropped_first(monkeypatch):
+    monkeypatch.setattr(playerHandler, "MAX_TOMBSTONES", 3)
+    handler = PlayerHandler()
+    pids = [handler.register() for _ in range(5)]
+    for pid in pids:
+        handler.remove(pid)
+    snap = handler._publish()
+    assert sorted(snap.removed) == pids[2:]
+    assert snap.removed_floor == snap.removed[pids[2]] - 1
+    assert handler.list_players_since(snap.removed_floor - 1)["full"]
+    assert sorted(handler.list_players_since(snap.removed_floor)["removed"]) == pids[2:]
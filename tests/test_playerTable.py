@@ -0,0 +1,116 @@
+from server.playerTable import GENERATION_MASK, ID_LIMIT, SLOT_BITS, IdAllocator, PlayerTable, slot_of
+
+
+def test_allocate_hands_out_lowest_slots_first():
+    ids = IdAllocator(4)
+    assert [ids.allocate() for _ in range(4)] == [0, 1, 2, 3]
+    assert len(ids) == 4
+
+
+def test_released_slot_is_reused_under_a_new_id():
+    ids = IdAllocator(4)
+    first = ids.allocate()
+    ids.allocate()
+    assert ids.release(first)
+    assert not ids.is_live(first)
+    second = ids.allocate()
+    assert slot_of(second) == slot_of(first)
+    assert second != first
+    assert second >> SLOT_BITS == 1
+    assert not ids.release(first)
+
+
+def test_grow_doubles_and_keeps_free_order():
+    ids = IdAllocator(2)
+    assert [ids.allocate() for _ in range(5)] == [0, 1, 2, 3, 4]
+    assert ids.capacity == 8
+    ids.release(1)
+    assert ids.allocate() == 1 << SLOT_BITS | 1
+    assert ids.allocate() == 5
+
+
+def test_generation_wraps_around_below_id_limit():
+    ids = IdAllocator(1)
+    pid = ids.allocate()
+    seen = {pid}
+    for _ in range(GENERATION_MASK + 1):
+        ids.release(pid)
+        pid = ids.allocate()
+        assert 0 <= pid < ID_LIMIT
+        seen.add(pid)
+    # Every generation was used once before the first one came back
+    assert pid == 0
+    assert len(seen) == GENERATION_MASK + 1
+
+
+def test_claim_of_free_slot_is_not_handed_out_again():
+    ids = IdAllocator(4)
+    claimed = 3 << SLOT_BITS | 1
+    assert ids.claim(claimed) is None
+    assert ids.is_live(claimed)
+    assert [ids.allocate() for _ in range(3)] == [0, 2, 3]
+    assert ids.allocate() == 4
+    assert len(ids) == 5
+
+
+def test_claim_displaces_the_live_owner_of_the_slot():
+    ids = IdAllocator(4)
+    old = ids.allocate()
+    new = 2 << SLOT_BITS | slot_of(old)
+    assert ids.claim(new) == old
+    assert not ids.is_live(old)
+    assert ids.is_live(new)
+    assert ids.claim(new) is None
+    assert len(ids) == 1
+
+
+def test_repeated_claims_and_releases_stay_bounded():
+    ids = IdAllocator(4)
+    for generation in range(1000):
+        pid = generation << SLOT_BITS | 2
+        ids.claim(pid)
+        ids.release(pid)
+    assert len(ids._free) == 4
+    assert len(ids) == 0
+
+
+def test_claim_beyond_capacity_grows():
+    ids = IdAllocator(2)
+    assert ids.claim(9) is None
+    assert ids.capacity == 16
+    assert ids.is_live(9)
+
+
+def test_load_generations_skips_live_slots():
+    ids = IdAllocator(4)
+    live = ids.allocate()
+    ids.load_generations([5, 6, 7, 8])
+    assert ids.is_live(live)
+    assert ids.allocate() == 6 << SLOT_BITS | 1
+
+
+def test_table_rows_and_recycling():
+    table = PlayerTable(2)
+    pid, displaced = table.insert(1.0, 2.0, "map.tmx", "LEFT", True, 0.0, 1)
+    assert displaced is None
+    slot = table.slot(pid)
+    assert table.to_dict(pid, slot) == {"id": pid, "x": 1.0, "y": 2.0, "map": "map.tmx", "direction": "LEFT",
+                                        "moving": True}
+    assert table.delete(pid)
+    assert table.slot(pid) is None
+    assert not table.delete(pid)
+    other, _ = table.insert(0.0, 0.0, "map.tmx", "nowhere", False, 0.0, 2)
+    assert slot_of(other) == slot
+    assert table.to_dict(other, slot)["direction"] == "DOWN"
+
+
+def test_map_names_are_forgotten_when_nobody_is_on_them():
+    table = PlayerTable(4)
+    pid, _ = table.insert(0.0, 0.0, "a", "DOWN", False, 0.0, 1)
+    slot = table.slot(pid)
+    for i in range(100):
+        table.set(slot, 0.0, 0.0, f"made-up-{i}", "DOWN", False)
+    assert len(table.map_names) == 3
+    assert table.map_name(slot) == "made-up-99"
+    table.delete(pid)
+    assert set(table._map_index) == {""}
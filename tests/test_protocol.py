@@ -0,0 +1,97 @@
+import pytest
+
+from server.protocol import (DATAGRAM_HEADER, FRAME_HEADER, MAX_DATAGRAM_SIZE, MAX_FRAME_SIZE, SEQ_MASK, SNAPSHOT,
+                             FrameDecoder, SnapshotAssembler, decode_datagram, encode_frame, encode_snapshot, seq_newer)
+
+
+def listing(count: int, version: int = 1) -> dict:
+    players = {pid: {"id": pid, "x": float(pid), "y": 0.0, "map": "map.tmx", "direction": "DOWN", "moving": False}
+               for pid in range(count)}
+    return {"version": version, "players": players, "removed": [], "full": True}
+
+
+def test_frames_split_at_every_byte():
+    data = encode_frame({"type": "snapshot", "n": 1}) + encode_frame({"type": "delta", "n": 2})
+    decoder = FrameDecoder()
+    frames = []
+    for i in range(len(data)):
+        frames += decoder.feed(data[i:i + 1])
+    assert frames == [{"type": "snapshot", "n": 1}, {"type": "delta", "n": 2}]
+
+
+def test_several_frames_in_one_read():
+    decoder = FrameDecoder()
+    data = b"".join(encode_frame(i) for i in range(5))
+    assert decoder.feed(data[:-2]) == [0, 1, 2, 3]
+    assert decoder.feed(data[-2:]) == [4]
+    assert decoder.feed(b"") == []
+
+
+def test_oversized_frame_is_rejected():
+    with pytest.raises(ValueError):
+        FrameDecoder().feed(FRAME_HEADER.pack(MAX_FRAME_SIZE + 1))
+
+
+def test_seq_newer_wraps_around():
+    assert seq_newer(0, None)
+    assert seq_newer(1, 0)
+    assert not seq_newer(0, 0)
+    assert not seq_newer(0, 1)
+    assert seq_newer(0, SEQ_MASK)
+    assert seq_newer(5, SEQ_MASK - 5)
+    assert not seq_newer(SEQ_MASK, 0)
+
+
+def test_snapshot_parts_reassemble_in_any_order():
+    packets = encode_snapshot(7, listing(150, version=3))
+    assert len(packets) == 3
+    assert all(len(packet) <= MAX_DATAGRAM_SIZE for packet in packets)
+    assembler = SnapshotAssembler()
+    result = None
+    for packet in reversed(packets):
+        kind, seq, part, parts, payload = decode_datagram(packet)
+        assert (kind, seq, parts) == (SNAPSHOT, 7, 3)
+        result = assembler.feed(seq, part, parts, payload)
+    assert result["version"] == 3
+    assert sorted(result["players"]) == list(range(150))
+
+
+def feed_all(assembler: SnapshotAssembler, seq: int, packets: list[bytes]) -> dict | None:
+    result = None
+    for packet in packets:
+        _, _, part, parts, payload = decode_datagram(packet)
+        result = assembler.feed(seq, part, parts, payload)
+    return result
+
+
+def test_late_and_partial_snapshots_are_dropped():
+    assembler = SnapshotAssembler()
+    newer = encode_snapshot(10, listing(100, version=2))
+    older = encode_snapshot(9, listing(1, version=1))
+    # Start of snapshot 10, then a late snapshot 9 that must not replace it
+    _, _, part, parts, payload = decode_datagram(newer[0])
+    assert assembler.feed(10, part, parts, payload) is None
+    assert feed_all(assembler, 9, older) is None
+    assert feed_all(assembler, 10, newer[1:])["version"] == 2
+    # Already applied
+    assert feed_all(assembler, 10, newer) is None
+    # A snapshot missing a part is superseded by the next one
+    _, _, part, parts, payload = decode_datagram(encode_snapshot(11, listing(100))[0])
+    assembler.feed(11, part, parts, payload)
+    assert feed_all(assembler, 12, encode_snapshot(12, listing(1, version=4)))["version"] == 4
+
+
+def test_assembler_across_sequence_wraparound():
+    assembler = SnapshotAssembler()
+    assert feed_all(assembler, SEQ_MASK, encode_snapshot(SEQ_MASK, listing(1, version=1))) is not None
+    assert feed_all(assembler, 0, encode_snapshot(0, listing(1, version=2)))["version"] == 2
+    assert feed_all(assembler, SEQ_MASK, encode_snapshot(SEQ_MASK, listing(1, version=1))) is None
+
+
+def test_malformed_datagrams():
+    with pytest.raises(ValueError):
+        decode_datagram(b"MD")
+    with pytest.raises(ValueError):
+        decode_datagram(DATAGRAM_HEADER.pack(b"XX", SNAPSHOT, 0, 0, 1))
+    with pytest.raises(ValueError):
+        decode_datagram(DATAGRAM_HEADER.pack(b"MD", SNAPSHOT, 0, 1, 1))
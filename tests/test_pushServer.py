@@ -0,0 +1,117 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from server import pushServer
+from server.playerHandler import PlayerHandler
+from server.protocol import FrameDecoder, encode_frame
+from server.pushServer import PushConnection, PushServer
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def sendall(self, data: bytes) -> None:
+        if self.closed:
+            raise OSError("closed")
+        self.sent.append(data)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class StalledSocket(RecordingSocket):
+    # A client that never reads: sendall blocks until the socket is closed
+    def __init__(self):
+        super().__init__()
+        self._closed = threading.Event()
+
+    def sendall(self, data: bytes) -> None:
+        self._closed.wait()
+        raise OSError("closed")
+
+    def close(self) -> None:
+        self.closed = True
+        self._closed.set()
+
+
+def connect(server: PushServer, sock, pid: int) -> PushConnection:
+    conn = PushConnection(sock, ("test", 0))
+    conn.player_id = pid
+    conn.start()
+    server._attach(conn)
+    return conn
+
+
+def wait_for(condition, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_stalled_client_does_not_delay_the_others():
+    handler = PlayerHandler()
+    server = PushServer(handler, "127.0.0.1", 0)
+    pid = handler.register()
+    stalled = connect(server, StalledSocket(), pid)
+    fast_sock = RecordingSocket()
+    connect(server, fast_sock, pid)
+
+    for i in range(pushServer.SEND_QUEUE_SIZE + 1):
+        handler.update(pid, float(i + 1), 0.0, "map.tmx", "DOWN", True)
+        with handler._lock:
+            snap = handler._publish()
+        started = time.monotonic()
+        server.broadcast(snap)
+        assert time.monotonic() - started < pushServer.SEND_TIMEOUT / 10
+        time.sleep(0.005)  # broadcasts are PUSH_INTERVAL apart; let the writers run
+    wait_for(lambda: len(fast_sock.sent) == pushServer.SEND_QUEUE_SIZE + 2)
+    assert not stalled.alive
+    assert server._connections == [server._connections[0]]
+    assert server._connections[0].sock is fast_sock
+
+
+def test_connection_drops_frames_once_closed():
+    conn = PushConnection(RecordingSocket(), ("test", 0))
+    conn.start()
+    assert conn.send(encode_frame({"type": "heartbeat"}))
+    conn.close()
+    assert not conn.send(encode_frame({"type": "heartbeat"}))
+
+
+@pytest.fixture
+def running_server():
+    handler = PlayerHandler()
+    server = PushServer(handler, "127.0.0.1", 0)
+    server.start()
+    yield handler, server
+    server.stop()
+
+
+def read_frame(sock: socket.socket, decoder: FrameDecoder) -> dict:
+    while True:
+        frames = decoder.feed(sock.recv(65536))
+        if frames:
+            assert len(frames) == 1
+            return frames[0]
+
+
+def test_hello_gets_a_snapshot_then_deltas(running_server):
+    handler, server = running_server
+    pid = handler.register()
+    sock = socket.create_connection(server._sock.getsockname(), timeout=2.0)
+    decoder = FrameDecoder()
+    sock.sendall(encode_frame({"type": "hello", "id": pid}))
+    snapshot = read_frame(sock, decoder)
+    assert snapshot["type"] == "snapshot"
+    assert list(snapshot["players"]) == [str(pid)]
+    handler.update(pid, 64.0, 0.0, "map.tmx", "UP", True)
+    delta = read_frame(sock, decoder)
+    assert delta["type"] == "delta"
+    assert delta["players"][str(pid)]["x"] == 64.0
+    sock.close()
@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+from server import rateLimiter
+from server.app import GameApp
+from server.rateLimiter import RateLimiter, parse_limit
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
+
+
+def test_burst_then_retry_after(clock):
+    limiter = RateLimiter({"chat": (2.0, 5.0)})
+    assert [limiter.acquire("chat", 1) for _ in range(5)] == [0.0] * 5
+    assert limiter.acquire("chat", 1) == pytest.approx(0.5)
+    # Another player has a bucket of their own
+    assert limiter.acquire("chat", 2) == 0.0
+
+
+def test_tokens_refill_at_the_rate(clock):
+    limiter = RateLimiter({"players": (4.0, 2.0)})
+    limiter.acquire("players", 1)
+    limiter.acquire("players", 1)
+    clock.now += 0.25
+    assert limiter.acquire("players", 1) == 0.0
+    assert limiter.acquire("players", 1) == pytest.approx(0.25)
+    clock.now += 10
+    assert [limiter.acquire("players", 1) for _ in range(3)] == [0.0, 0.0, pytest.approx(0.25)]
+
+
+def test_rejected_request_takes_nothing(clock):
+    limiter = RateLimiter({"chat": (1.0, 2.0)})
+    limiter.acquire("chat", 1, 2)
+    for _ in range(5):
+        assert limiter.acquire("chat", 1) == pytest.approx(1.0)
+    clock.now += 1
+    assert limiter.acquire("chat", 1) == 0.0
+
+
+def test_cost_above_burst_needs_a_full_bucket(clock):
+    limiter = RateLimiter({"chat": (1.0, 2.0)})
+    assert limiter.acquire("chat", 1, 10) == 0.0
+    assert limiter.acquire("chat", 1, 10) == pytest.approx(2.0)
+
+
+def test_zero_rate_and_unknown_endpoints_are_unlimited(clock):
+    limiter = RateLimiter({"chat": (0.0, 0.0)})
+    assert all(limiter.acquire("chat", 1) == 0.0 for _ in range(100))
+    assert limiter.acquire("players", 1) == 0.0
+
+
+def test_idle_buckets_are_pruned(clock):
+    limiter = RateLimiter({"chat": (1.0, 2.0)})
+    limiter.acquire("chat", 1)
+    clock.now += rateLimiter.PRUNE_INTERVAL
+    limiter.acquire("chat", 2)
+    assert list(limiter._buckets) == [("chat", 2)]
+
+
+def test_parse_limit():
+    assert parse_limit("chat=3") == ("chat", 3.0, 6.0)
+    assert parse_limit("players=10:15") == ("players", 10.0, 15.0)
+    for text in ("chat", "battle=1", "chat=-1", "chat=0.2:0.5"):
+        with pytest.raises(ValueError):
+            parse_limit(text)
+
+
+def test_app_answers_429_with_retry_after(clock):
+    app = GameApp(rate_limits={"players": (0.5, 1.0)})
+    pid = app.players.register()
+    body = f'{{"id": {pid}, "x": 0, "y": 0, "map": "map.tmx"}}'.encode()
+    assert app.handle("POST", "/players", body).status == 200
+    response = app.handle("POST", "/players", body)
+    assert response.status == 429
+    assert response.headers["Retry-After"] == "2"
+    clock.now += 2
+    assert app.handle("POST", "/players", body).status == 200
+    app.close()
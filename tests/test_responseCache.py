@@ -0,0 +1,153 @@
+import gzip
+import json
+import zlib
+
+import pytest
+
+from server.app import GameApp
+from server.responseCache import MIN_COMPRESS_SIZE, ResponseCache, make_etag, negotiate_encoding
+
+
+def test_cached_body_is_built_once_per_version():
+    cache = ResponseCache()
+    builds = []
+
+    def build():
+        builds.append(1)
+        return {"n": len(builds)}
+
+    first = cache.get("players", 1, "all", build, representation="all")
+    assert cache.get("players", 1, "all", build, representation="all") is first
+    assert json.loads(first.body) == {"n": 1}
+    assert first.etag == make_etag("players", 1, "all") == '"players-1-all"'
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.get("players", 2, "all", build, representation="all").body != first.body
+    assert len(builds) == 2
+
+
+def test_newer_version_drops_older_entries_of_its_namespace():
+    cache = ResponseCache()
+    cache.get("players", 1, "a", dict)
+    cache.get("chat", 1, "a", dict)
+    cache.get("players", 2, "a", dict)
+    assert sorted(cache._entries) == [("chat", 1, "a"), ("players", 2, "a")]
+    # A late build for an old version is returned but not stored
+    cache.get("players", 1, "b", dict)
+    assert ("players", 1, "b") not in cache._entries
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.get("chat", 1, "a", dict)
+    cache.get("chat", 1, "b", dict)
+    cache.get("chat", 1, "a", dict)
+    cache.get("chat", 1, "c", dict)
+    assert sorted(k[2] for k in cache._entries) == ["a", "c"]
+
+
+@pytest.fixture
+def app():
+    app = GameApp(rate_limits={})
+    yield app
+    app.close()
+
+
+def etag(app: GameApp, target: str, headers: dict[str, str] | None = None) -> str:
+    response = app.handle("GET", target, b"", headers or {})
+    assert response.status == 200
+    return response.headers["ETag"]
+
+
+def test_listings_of_different_shapes_have_different_tags(app):
+    pid = app.players.register()
+    version = app.players.version
+    tags = [
+        etag(app, "/players"),
+        etag(app, "/players?since=-1"),
+        etag(app, f"/players?since={version}"),
+        etag(app, "/players?since=-1", {"accept": "application/x-monster-players"}),
+        etag(app, f"/players?near={pid}&radius=100"),
+        etag(app, f"/players?near={pid}&radius=200"),
+        etag(app, f"/players?near={pid}&radius=100&since={version}"),
+    ]
+    assert len(set(tags)) == len(tags)
+    assert etag(app, "/chat?since=-1&limit=10") != etag(app, "/chat?since=-1&limit=20")
+
+
+def test_tag_of_one_shape_does_not_revalidate_another(app):
+    app.players.register()
+    version = app.players.version
+    full = etag(app, "/players?since=-1")
+    response = app.handle("GET", f"/players?since={version}", b"", {"if-none-match": full})
+    assert response.status == 200
+    assert json.loads(response.body())["full"] is False
+
+
+def test_encoding_negotiation():
+    assert negotiate_encoding("gzip, deflate, br") == "gzip"
+    assert negotiate_encoding("deflate") == "deflate"
+    assert negotiate_encoding("gzip;q=0, deflate;q=0.5") == "deflate"
+    assert negotiate_encoding("*") == "gzip"
+    assert negotiate_encoding("*, gzip;q=0") == "deflate"
+    assert negotiate_encoding("identity") is None
+    assert negotiate_encoding("gzip;q=bogus") is None
+    assert negotiate_encoding("") is None
+
+
+def test_large_listings_are_compressed(app):
+    for _ in range(100):
+        app.players.register()
+    plain = app.handle("GET", "/players")
+    assert len(plain.body()) >= MIN_COMPRESS_SIZE
+    assert plain.headers["Vary"] == "Accept-Encoding" and "Content-Encoding" not in plain.headers
+    gzipped = app.handle("GET", "/players", b"", {"accept-encoding": "gzip"})
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(gzipped.body()) == plain.body()
+    deflated = app.handle("GET", "/players", b"", {"accept-encoding": "deflate"})
+    assert zlib.decompress(deflated.body()) == plain.body()
+    # Each coding is its own representation
+    assert len({plain.headers["ETag"], gzipped.headers["ETag"], deflated.headers["ETag"]}) == 3
+    assert gzipped.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+    # The compressed variant of a cached body is built once
+    assert app.handle("GET", "/players", b"", {"accept-encoding": "gzip"}).body() is gzipped.body()
+
+
+def test_small_bodies_and_errors_are_not_compressed(app):
+    response = app.handle("GET", "/", b"", {"accept-encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers and "Vary" not in response.headers
+    response = app.handle("GET", "/nowhere", b"", {"accept-encoding": "gzip"})
+    assert response.status == 404 and "Content-Encoding" not in response.headers
+
+
+def test_unchanged_listing_is_answered_304(app):
+    app.players.register()
+    tag = etag(app, "/players")
+    for if_none_match in (tag, f"W/{tag}", f'"other", {tag}', "*"):
+        response = app.handle("GET", "/players", b"", {"if-none-match": if_none_match})
+        assert response.status == 304
+        assert response.body() == b""
+        assert response.headers == {"ETag": tag}
+    assert app.handle("GET", "/players", b"", {"if-none-match": '"players-0-all"'}).status == 200
+
+
+def test_changed_world_is_sent_in_full(app):
+    pid = app.players.register()
+    tag = etag(app, "/players")
+    app.handle("POST", "/players", json.dumps({"id": pid, "x": 64, "y": 0, "map": "map.tmx"}).encode())
+    with app.players._lock:
+        app.players._publish()  # skip PUBLISH_INTERVAL
+    response = app.handle("GET", "/players", b"", {"if-none-match": tag})
+    assert response.status == 200
+    assert response.headers["ETag"] != tag
+
+
+def test_compressed_listing_is_revalidated_per_coding(app):
+    for _ in range(100):
+        app.players.register()
+    headers = {"accept-encoding": "gzip"}
+    tag = etag(app, "/players", headers)
+    response = app.handle("GET", "/players", b"", dict(headers, **{"if-none-match": tag}))
+    assert response.status == 304
+    assert response.headers == {"ETag": tag, "Vary": "Accept-Encoding"}
+    # The uncompressed representation has another tag
+    assert app.handle("GET", "/players", b"", {"if-none-match": tag}).status == 200
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from server.app import GameApp
+from server.shardRouter import ShardRouter, load_maps
+
+
+@pytest.fixture
+def router():
+    router = ShardRouter(["a.tmx", "b.tmx"])
+    # Shards served in-process instead of by worker processes
+    workers = {shard.map: GameApp(shard=True, rate_limits={}) for shard in router.shards}
+    router._forward = lambda shard, method, path, body=b"", headers=None: workers[shard.map].handle(
+        method, path, body, headers or {})
+    router.workers = workers
+    yield router
+    router.close()
+    for app in workers.values():
+        app.close()
+
+
+def post(router: ShardRouter, pid: int, x: float, map_name: str):
+    body = json.dumps({"id": pid, "x": x, "y": 0.0, "map": map_name}).encode("utf-8")
+    return router.handle("POST", "/players", body, {"content-type": "application/json"})
+
+
+def register(router: ShardRouter) -> int:
+    return json.loads(router.handle("GET", "/register").body())["id"]
+
+
+def world(router: ShardRouter) -> dict:
+    for app in router.workers.values():
+        with app.players._lock:
+            app.players._publish()  # skip PUBLISH_INTERVAL
+    return json.loads(router.handle("GET", "/players").body())["players"]
+
+
+def test_first_update_joins_the_shard_of_the_map(router):
+    pid = register(router)
+    assert post(router, pid, 10.0, "b.tmx").status == 200
+    assert list(router.workers["b.tmx"].players.list_players()) == [pid]
+    assert router.workers["a.tmx"].players.list_players() == {}
+    assert post(router, pid, 20.0, "b.tmx").status == 200
+    assert world(router)[str(pid)]["x"] == 20.0
+
+
+def test_teleport_hands_the_player_over(router):
+    pid = register(router)
+    post(router, pid, 10.0, "a.tmx")
+    assert post(router, pid, 30.0, "b.tmx").status == 200
+    assert router.workers["a.tmx"].players.list_players() == {}
+    assert router.workers["b.tmx"].players.list_players()[pid]["x"] == 30.0
+    assert list(world(router)) == [str(pid)]
+
+
+def test_unknown_maps_go_to_the_first_shard(router):
+    pid = register(router)
+    post(router, pid, 10.0, "elsewhere.tmx")
+    assert pid in router.workers["a.tmx"].players.list_players()
+
+
+def test_unregistered_players_are_not_placed(router):
+    assert post(router, 12345, 10.0, "a.tmx").status == 404
+    assert world(router) == {}
+
+
+def test_player_expired_on_the_old_shard_is_forgotten(router):
+    pid = register(router)
+    post(router, pid, 10.0, "a.tmx")
+    router.workers["a.tmx"].players.remove(pid)
+    assert post(router, pid, 10.0, "b.tmx").status == 404
+    assert not router._is_known(pid)
+    assert router.workers["b.tmx"].players.list_players() == {}
+
+
+def test_near_is_answered_by_the_players_shard(router):
+    first, second = register(router), register(router)
+    post(router, first, 10.0, "a.tmx")
+    post(router, second, 50.0, "a.tmx")
+    listing = json.loads(router.handle("GET", f"/players?near={first}&radius=100").body())
+    assert list(listing["players"]) == [str(second)]
+    unplaced = register(router)
+    listing = json.loads(router.handle("GET", f"/players?near={unplaced}").body())
+    assert listing["players"] == {}
+
+
+def test_game_file_does_not_depend_on_the_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert "map.tmx" in load_maps()
@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+from server.playerHandler import PlayerHandler
+from server.rateLimiter import RateLimiter
+from server.udpServer import UdpServer
+
+ADDR = ("127.0.0.1", 40000)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
+
+
+class BlockedMaps:
+    def walkable(self, map_name: str, x: float, y: float) -> bool:
+        return x < 1000
+
+
+def update(pid: int, x: float) -> dict:
+    return {"id": pid, "x": x, "y": 0.0, "map": "map.tmx", "direction": "DOWN", "moving": True}
+
+
+def position(handler: PlayerHandler, pid: int) -> float:
+    with handler._lock:
+        return handler._publish().players[pid]["x"]
+
+
+def test_stale_sequence_numbers_are_dropped():
+    handler = PlayerHandler()
+    server = UdpServer(handler, "127.0.0.1", 0)
+    pid = handler.register()
+    server._apply_update(ADDR, 5, update(pid, 10.0))
+    server._apply_update(ADDR, 4, update(pid, 20.0))
+    server._apply_update(ADDR, 5, update(pid, 30.0))
+    assert position(handler, pid) == 10.0
+    assert server._verified[pid] == ADDR
+
+
+def test_rejected_update_does_not_advance_sequence():
+    handler = PlayerHandler(collision=BlockedMaps())
+    server = UdpServer(handler, "127.0.0.1", 0)
+    pid = handler.register()
+    try:
+        server._apply_update(("10.0.0.1", 1), 1000, update(pid, 5000.0))
+    except ValueError:
+        pass
+    assert pid not in server._last_seq
+    assert pid not in server._verified
+    server._apply_update(ADDR, 1, update(pid, 10.0))
+    assert position(handler, pid) == 10.0
+    assert server._verified[pid] == ADDR
+
+
+def test_rate_limited_update_does_not_advance_sequence(clock):
+    handler = PlayerHandler()
+    limiter = RateLimiter({"players": (1.0, 1.0)})
+    server = UdpServer(handler, "127.0.0.1", 0, limiter=limiter)
+    pid = handler.register()
+    server._apply_update(ADDR, 1, update(pid, 10.0))
+    server._apply_update(ADDR, 1000, update(pid, 20.0))
+    assert server._last_seq[pid] == 1
+    clock.now += 1.0
+    server._apply_update(ADDR, 2, update(pid, 30.0))
+    assert position(handler, pid) == 30.0